@@ -0,0 +1,1307 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import contextlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import functools
+import gc
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Optional
+import uuid
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import numpy as np
+from PIL import Image, ImageDraw
+
+from casino import flip_generator, graph, spin_generator
+from casino.avatars import avatar_cache
+from casino.casino import CasinoLobby, CasinoPitboss
+from casino.coinflip import Coinflip
+from casino.models import DegenerateGambler
+from casino.rendering import build_palette, encode_gif
+import db
+from edit_scheduler import MessageEditScheduler
+from party import (
+    STARTING_SSC,
+    MemberList,
+    Party,
+    PartyMember,
+    PartyMemberStatus,
+    PartyService,
+    PartyStatus,
+)
+import recalculate
+from scb import SailCreditBureau
+from timers import TimerWheel
+from util import get_last_reset_time
+
+
+async def setup_database(path: str, user_count: int) -> None:
+    """
+    Connects the db module to a fresh database at the given path with the schema,
+    migrations and some users.
+    """
+    await db.init(path)
+
+    with open("schema.sql", "r") as f:
+        await db.db.executescript(f.read())
+    await db.run_migrations()
+
+    await db.db.executemany(
+        "INSERT INTO users (discord_id, sail_credit) VALUES (?, ?)",
+        [(user_id, 1000) for user_id in range(user_count)],
+    )
+    await db.db.commit()
+
+
+async def settle_commit_per_call(user_id: int, amount: int) -> None:
+    """
+    The previous change_and_log_sail_credit write path: one transaction per entry.
+    """
+    async with db.db.execute(
+        "SELECT * FROM users WHERE discord_id = ?", (user_id,)
+    ) as cursor:
+        user = await cursor.fetchone()
+    await db.db.execute(
+        "INSERT INTO sail_credit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            user_id,
+            -1,
+            -1,
+            -1,
+            user["sail_credit"],
+            user["sail_credit"] + amount,
+            "CRASH_CREDIT",
+            int(time.time()),
+        ),
+    )
+    await db.db.execute(
+        "UPDATE users SET sail_credit = ? WHERE discord_id = ?",
+        (user["sail_credit"] + amount, user_id),
+    )
+    await db.db.commit()
+
+
+async def settle_group_commit(user_id: int, amount: int) -> None:
+    await db.apply_sail_credit_delta(user_id, amount, "CRASH_CREDIT")
+
+
+async def bench_settlements(user_count: int = 200):
+    """
+    Settles crash rounds of 20 concurrent cash outs, then one burst of concurrent
+    settlements, with the commit per call path (rollback journal, full sync) and the
+    group commit path (WAL).
+    """
+    for scenario, rounds, round_size in [
+        ("100 rounds of 20 cash outs", 100, 20),
+        ("burst of 5000 settlements", 1, 5000),
+    ]:
+        print(f"Settling {scenario}...")
+        for name, settle, pragmas in [
+            (
+                "commit-per-call",
+                settle_commit_per_call,
+                ["PRAGMA journal_mode = DELETE", "PRAGMA synchronous = FULL"],
+            ),
+            ("group-commit", settle_group_commit, []),
+        ]:
+            with tempfile.TemporaryDirectory() as tmp:
+                await setup_database(os.path.join(tmp, "bench.db"), user_count)
+                for pragma in pragmas:
+                    await db.db.execute(pragma)
+
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    await asyncio.gather(
+                        *[settle(i % user_count, 10) for i in range(round_size)]
+                    )
+                elapsed = time.perf_counter() - start
+                await db.cleanup()
+
+            settlements = rounds * round_size
+            print(
+                f"{name:>16} : {settlements / elapsed:>10,.0f} settlements/s ({elapsed:.2f}s)"
+            )
+
+
+async def seed_synthetic_ledger(row_count: int, user_count: int, now: int) -> None:
+    """
+    Logs row_count entries spread over the 90 days before now: mostly parties with
+    the odd flake, plus daily rewards and admin changes.
+    """
+    sources = ["PARTY"] * 8 + ["DAILY_SSC", "ADMIN"]
+
+    def rows():
+        for _ in range(row_count):
+            source = random.choice(sources)
+            finished_at = now - random.randrange(60 * 60 * 24 * 90)
+            party_size = random.randint(2, 5) if source == "PARTY" else -1
+            created_at = finished_at - random.randrange(60 * 60 * 2)
+            sign = -1 if source != "DAILY_SSC" and random.random() < 0.05 else 1
+            delta = sign * random.randint(1, 100)
+            yield (
+                random.randrange(user_count),
+                party_size,
+                created_at if source == "PARTY" else -1,
+                finished_at if source == "PARTY" else -1,
+                1000,
+                1000 + delta,
+                source,
+                finished_at,
+            )
+
+    await db.db.executemany(
+        "INSERT INTO sail_credit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows()
+    )
+    await db.db.commit()
+
+
+async def recalculate_row_by_row() -> None:
+    """
+    A copy of recalculate.calculate() from before the in-memory replay, with the db
+    and SailCreditBureau calls it made written out as the SQL they ran then. Every row
+    reads the user, queries their party history or flakes and commits its own write.
+    Only the credit and debit formulas are shared with the current code.
+    """
+    existing_logs = await db.db.execute_fetchall(
+        "SELECT * FROM sail_credit_log ORDER BY timestamp ASC"
+    )
+    for user in await db.db.execute_fetchall("SELECT * FROM users"):
+        await db.db.execute(
+            "UPDATE users SET sail_credit = ? WHERE discord_id = ?",
+            (STARTING_SSC, user["discord_id"]),
+        )
+        await db.db.commit()
+    await db.db.execute("DELETE FROM sail_credit_log")
+    await db.db.commit()
+
+    scb = SailCreditBureau()
+    for log in existing_logs:
+        user = (
+            await db.db.execute_fetchall(
+                "SELECT * FROM users WHERE discord_id = ?", (log["discord_id"],)
+            )
+        )[0]
+        old_ssc = user["sail_credit"]
+        # Parties were rebuilt with a placeholder member per logged member, so their
+        # size is never negative.
+        party_size = max(0, log["party_size"])
+
+        if log["source"] == "ADMIN":
+            party_size = log["party_size"]
+            delta = log["new_sail_credit"] - log["prev_sail_credit"]
+            new_ssc = max(0, old_ssc + delta)
+        elif log["new_sail_credit"] - log["prev_sail_credit"] < 0:
+            # SailCreditBureau.process_flaked_user
+            def round_nearest_day(x, base=(24 * 60 * 60)) -> int:
+                return base * round(x / base)
+
+            days_flaked = set()
+            start_timestamp = int(time.time()) - scb.FLAKE_WINDOW
+            history = await db.db.execute_fetchall(
+                "SELECT * FROM sail_credit_log WHERE discord_id = ? AND timestamp > ? "
+                "AND source = ? ORDER BY timestamp DESC",
+                (log["discord_id"], start_timestamp, "PARTY"),
+            )
+            for entry in history:
+                if entry["new_sail_credit"] - entry["prev_sail_credit"] < 0:
+                    days_flaked.add(round_nearest_day(entry["timestamp"]))
+
+            new_ssc = old_ssc + scb.debit(
+                log["discord_id"],
+                old_ssc,
+                len(days_flaked),
+                log["party_finished_at"] - log["party_created_at"],
+                party_size,
+            )
+        else:
+            # SailCreditBureau.process_party_member
+            history = await db.db.execute_fetchall(
+                "SELECT * FROM sail_credit_log WHERE discord_id = ? AND timestamp > ? "
+                "AND source = ? ORDER BY timestamp DESC",
+                (log["discord_id"], get_last_reset_time(), "PARTY"),
+            )
+            new_ssc = old_ssc + scb.credit(
+                log["discord_id"], old_ssc, len(history), party_size
+            )
+
+        # The process methods logged every row as a party, apart from admin changes.
+        source = "ADMIN" if log["source"] == "ADMIN" else "PARTY"
+        await db.db.execute(
+            "INSERT INTO sail_credit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                log["discord_id"],
+                party_size,
+                log["party_created_at"],
+                log["party_finished_at"],
+                old_ssc,
+                new_ssc,
+                source,
+                log["timestamp"] or int(time.time()),
+            ),
+        )
+        await db.db.execute(
+            "UPDATE users SET sail_credit = ? WHERE discord_id = ?",
+            (new_ssc, log["discord_id"]),
+        )
+        await db.db.commit()
+
+
+async def dump_ledger():
+    logs = await db.db.execute_fetchall("SELECT * FROM sail_credit_log ORDER BY rowid")
+    users = await db.db.execute_fetchall("SELECT * FROM users ORDER BY discord_id")
+    return logs, users
+
+
+async def bench_recalculate(
+    rows_per_user: int = 50, ledger_rows: int = 1_000_000, legacy_rows: int = 20_000
+):
+    """
+    Recalculates synthetic ledgers with the original row by row replay and the
+    in-memory replay, asserting that both rebuild the same ledger and balances. The
+    row by row replay takes minutes on the full ledger.
+    """
+    now = int(time.time())
+    expected_ledgers = {}
+    for name, recalculate_fn, row_count in [
+        ("row-by-row", recalculate_row_by_row, legacy_rows),
+        ("in-memory", recalculate.calculate, legacy_rows),
+        ("row-by-row", recalculate_row_by_row, ledger_rows),
+        ("in-memory", recalculate.calculate, ledger_rows),
+    ]:
+        random.seed(row_count)
+        user_count = row_count // rows_per_user
+        with tempfile.TemporaryDirectory() as tmp:
+            await setup_database(os.path.join(tmp, "bench.db"), user_count)
+            await seed_synthetic_ledger(row_count, user_count, now)
+            db.user_cache.clear()
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                await recalculate_fn()
+            elapsed = time.perf_counter() - start
+
+            ledger = await dump_ledger()
+            await db.cleanup()
+
+        if name == "row-by-row":
+            expected_ledgers[row_count] = ledger
+        elif ledger != expected_ledgers.pop(row_count):
+            raise AssertionError("The in-memory replay rebuilt a different ledger")
+
+        print(
+            f"{name:>16} : {row_count / elapsed:>10,.0f} rows/s ({row_count:,} rows in {elapsed:.2f}s)"
+        )
+
+
+def render_crash_per_pixel(current_return: float) -> list[str]:
+    """
+    The previous casino.graph.render_dynamic_crash: rasterizes the curve one pixel at
+    a time and builds each braille character from its eight dots.
+    """
+    buf = [0.0] * (graph.W * graph.H)
+    y_min, y_max = 1.0, max(2.0, current_return)
+
+    draw_percentage = max(0.0, min(1.0, (current_return - 1.0) / (2.0 - 1.0)))
+    max_px = int(graph.W * draw_percentage)
+    k = math.log(current_return)
+
+    for px in range(max_px):
+        t = px / (graph.W - 1)
+        val = math.exp(k * t)
+
+        norm_y = (val - y_min) / (y_max - y_min)
+        y_center = (1.0 - norm_y) * (graph.H - 1)
+
+        y0 = int(math.floor(y_center - 1.0))
+        y1 = int(math.ceil(y_center + 1.0))
+        for py in range(max(0, y0), min(graph.H - 1, y1) + 1):
+            dist = abs(py + 0.5 - y_center)
+            intensity = max(0.0, 1.0 - dist)
+            if intensity > 0:
+                idx = py * graph.W + px
+                buf[idx] = max(buf[idx], intensity)
+
+    ticks = graph.get_y_ticks(y_min, y_max)
+    row_labels: list[str | None] = []
+    for row in range(graph.ROWS):
+        y_val = y_max - (row / (graph.ROWS - 1)) * (y_max - y_min)
+        closest = min(ticks, key=lambda t: abs(t - y_val))
+        row_height_in_values = (y_max - y_min) / (graph.ROWS - 1)
+        if abs(closest - y_val) <= row_height_in_values * 0.5:
+            row_labels.append(graph.format_label(closest))
+        else:
+            row_labels.append(None)
+
+    out = []
+    for row in range(graph.ROWS):
+        line = ""
+        for col in range(graph.COLS):
+            bits = 0
+            for dc, dr, bit in [
+                (0, 0, 0x01),
+                (0, 1, 0x02),
+                (0, 2, 0x04),
+                (0, 3, 0x40),
+                (1, 0, 0x08),
+                (1, 1, 0x10),
+                (1, 2, 0x20),
+                (1, 3, 0x80),
+            ]:
+                px, py = col * 2 + dc, row * 4 + dr
+                if px < graph.W and py < graph.H and buf[py * graph.W + px] > 0.35:
+                    bits |= bit
+            line += chr(graph.B | bits)
+
+        label = row_labels[row]
+        if label is not None:
+            out.append(f"{label} ┤{line}")
+        else:
+            out.append(f"{'':>6s} │{line}")
+
+    out.append(" " * 7 + "\u2514" + "\u2500" * (graph.COLS + 10))
+    return out
+
+
+async def bench_crash_graph(rounds: int = 20, max_multiplier: float = 10.0):
+    """
+    Renders every frame of crash rounds climbing from 1.00x to max_multiplier, with
+    the per pixel renderer and the vectorized one, asserting both draw the same
+    frames. Then renders the same rounds through the frame cache, after warming it
+    up.
+    """
+    multipliers = [
+        round(1.0 + i * 0.01, 2) for i in range(int((max_multiplier - 1.0) * 100) + 1)
+    ]
+    expected_frames = [render_crash_per_pixel(m) for m in multipliers]
+    if [graph.render_dynamic_crash(m) for m in multipliers] != expected_frames:
+        raise AssertionError("The vectorized renderer drew different frames")
+
+    for name, render in [
+        ("per-pixel", render_crash_per_pixel),
+        ("vectorized", graph.render_dynamic_crash),
+        ("cached", lambda multiplier: graph.render_graph(multiplier, False)),
+    ]:
+        graph.y_label_cache.clear()
+        graph.graph_cache.clear()
+        if name == "cached":
+            graph.warm_graph_cache()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for multiplier in multipliers:
+                render(multiplier)
+        elapsed = time.perf_counter() - start
+
+        frames = rounds * len(multipliers)
+        print(f"{name:>16} : {frames / elapsed:>10,.0f} frames/s ({elapsed:.2f}s)")
+
+
+class RateLimitedInteraction:
+    """
+    Stands in for a command interaction, recording the edits to its original response.
+    Like discord.py, it waits out the rate limit bucket before each edit.
+    """
+
+    def __init__(self, limit: int, per: float, latency: float):
+        self.id = 0
+        self.message = None
+        self.limit = limit
+        self.per = per
+        self.latency = latency
+        self.edits = []
+        self._sent_at = []
+        self._bucket = asyncio.Lock()
+
+    async def edit_original_response(self, **fields):
+        async with self._bucket:
+            if len(self._sent_at) >= self.limit:
+                await asyncio.sleep(
+                    max(0, self._sent_at[-self.limit] + self.per - time.monotonic())
+                )
+            self._sent_at.append(time.monotonic())
+        await asyncio.sleep(self.latency)
+        self.edits.append(fields)
+
+
+async def bench_lobby_edits(bets: int = 30):
+    """
+    Edits a lobby message for a burst of bets 20ms apart, directly and through the
+    edit scheduler, against Discord's limit of 5 edits every 5 seconds.
+    """
+    for name, edit in [
+        (
+            "direct",
+            lambda target, **fields: target.edit_original_response(**fields),
+        ),
+        ("scheduled", MessageEditScheduler().edit),
+    ]:
+        target = RateLimitedInteraction(limit=5, per=5, latency=0.1)
+
+        async def bet(i: int):
+            await asyncio.sleep(i * 0.02)
+            await edit(target, content=f"{i + 1} bets")
+
+        start = time.perf_counter()
+        await asyncio.gather(*[bet(i) for i in range(bets)])
+        elapsed = time.perf_counter() - start
+
+        if target.edits[-1]["content"] != f"{bets} bets":
+            raise AssertionError(f"The {name} edits didn't end on the last bet")
+        print(
+            f"{name:>16} : {len(target.edits):>4} edits for {bets} bets, last bet shown after {elapsed:.2f}s"
+        )
+
+
+def synthetic_avatar(seed: int, size: int) -> Image.Image:
+    """
+    A gradient in random colours, which compresses about as well as a real avatar.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    base, slope = rng.integers(0, 256, 3), rng.integers(-2, 3, 3)
+    channels = [(base[i] + slope[i] * x + y * (i + 1) // 3) % 256 for i in range(3)]
+    return Image.fromarray(
+        np.stack(channels + [np.full((size, size), 255)], axis=-1).astype(np.uint8)
+    )
+
+
+async def measure_tick_lag(task: asyncio.Future, interval: float = 0.05) -> float:
+    """
+    Renders a crash frame every interval until task is done, like a running crash
+    round, and returns the longest any tick was late.
+    """
+    worst_lag = 0.0
+    next_tick = time.perf_counter()
+    while not task.done():
+        next_tick += interval
+        await asyncio.sleep(max(0, next_tick - time.perf_counter()))
+        worst_lag = max(worst_lag, time.perf_counter() - next_tick)
+        graph.render_dynamic_crash(1.0 + random.random() * 10)
+    return worst_lag
+
+
+def build_jackpot_gif_per_frame_palette(
+    players, winner_idx, *, total_ms, frame_ms, hold_ms, **options
+):
+    """
+    The previous encoding of spin_generator._build_gif: Pillow picks a palette for
+    each frame as it saves them.
+    """
+    frames = max(2, total_ms // frame_ms)
+    gif_frames = list(
+        spin_generator._render_frames(
+            players, winner_idx, total_ms=total_ms, frames=frames, **options
+        )
+    )
+    gif_frames.append(gif_frames[-1])
+
+    output = io.BytesIO()
+    gif_frames[0].save(
+        output,
+        format="GIF",
+        save_all=True,
+        append_images=gif_frames[1:],
+        duration=[frame_ms] * frames + [hold_ms],
+        loop=0,
+        disposal=2,
+    )
+    return output.getvalue()
+
+
+async def bench_gif_render(players: int = 15):
+    """
+    Renders a jackpot GIF for the given number of players in a thread, with a
+    palette per frame and against one shared palette, while a crash round ticks
+    every 50ms, and reports how late the ticks got.
+    """
+    jackpot_players = [
+        spin_generator.Player(str(i), 100 / players, synthetic_avatar(i, 192))
+        for i in range(players)
+    ]
+    options = dict(
+        avatar_size=192,
+        tile_w=192,
+        canvas_w=192 * 5,
+        total_ms=4000,
+        frame_ms=40,
+        hold_ms=2000,
+    )
+
+    for name, build_gif in [
+        ("per-frame", build_jackpot_gif_per_frame_palette),
+        ("shared-palette", spin_generator._build_gif),
+    ]:
+        random.seed(0)
+        start = time.perf_counter()
+        task = asyncio.ensure_future(
+            asyncio.to_thread(build_gif, jackpot_players, 0, **options)
+        )
+        worst_lag = await measure_tick_lag(task)
+        gif = await task
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"{name:>16} : rendered {len(gif) / 1024:,.0f} KiB in {elapsed:.2f}s, worst crash tick {worst_lag * 1000:.0f}ms late"
+        )
+
+
+async def bench_coinflip(flips: int = 20, size: int = 128):
+    """
+    Times create_coinflip_gif end to end, the delay players see before the flip
+    starts, with both avatars already in the avatar cache.
+    """
+    urls = ["https://example.com/front.png", "https://example.com/back.png"]
+    for seed, url in enumerate(urls):
+        avatar_cache.memory.put((url, size), synthetic_avatar(seed, size))
+
+    latencies = []
+    for i in range(flips):
+        start = time.perf_counter()
+        await flip_generator.create_coinflip_gif(
+            *urls,
+            front_label="H",
+            back_label="T",
+            result="front" if i % 2 else "back",
+            size=size,
+        )
+        latencies.append(time.perf_counter() - start)
+
+    first = latencies[0]
+    latencies.sort()
+    print(
+        f"{'create_coinflip_gif':>16} : first {first * 1000:.0f}ms, median {latencies[len(latencies) // 2] * 1000:.0f}ms, worst {latencies[-1] * 1000:.0f}ms"
+    )
+
+
+def render_reel_from_strip(
+    players, winner_idx, *, avatar_size, tile_w, canvas_w, total_ms, frames
+):
+    """
+    The previous jackpot reel renderer: pastes the whole reel into one strip image,
+    crops every frame out of it and keeps them all in a list.
+    """
+    marker_x = canvas_w // 2
+    total_distance = int((total_ms / 1000) * 800 * tile_w / 112)
+    tile_sequence, final_offset = spin_generator._build_reel(
+        players, tile_w, total_distance, marker_x, winner_idx
+    )
+
+    strip_w = len(tile_sequence) * tile_w
+    strip = Image.new("RGBA", (strip_w, avatar_size), (0, 0, 0, 0))
+    for i, pidx in enumerate(tile_sequence):
+        tile = spin_generator._draw_avatar_tile(players[pidx].image, tile_w)
+        strip.paste(tile, (i * tile_w, 0))
+
+    decel_distance = int(final_offset * 0.15)
+    cruise_end = final_offset - decel_distance
+    gif_frames = []
+    for i in range(frames):
+        t = i / (frames - 1)
+        if t <= 0.35:
+            offset = int((t / 0.35) * cruise_end)
+        else:
+            t2 = (t - 0.35) / 0.65
+            offset = int(cruise_end + (1 - (1 - t2) ** 3) * decel_distance)
+
+        frame = Image.new("RGBA", (canvas_w, avatar_size), (0, 0, 0, 0))
+        x_in_strip = max(0, min(offset, strip_w - 1))
+        visible_end = min(x_in_strip + canvas_w, strip_w)
+        frame.paste(strip.crop((x_in_strip, 0, visible_end, avatar_size)), (0, 0))
+        draw = ImageDraw.Draw(frame)
+        for dx in range(-3 // 2, 3 // 2 + 1):
+            draw.line(
+                [(marker_x + dx, 0), (marker_x + dx, avatar_size)],
+                fill=spin_generator.MARKER_COLOR,
+            )
+        gif_frames.append(frame)
+    return gif_frames
+
+
+def build_jackpot_gif_from_strip(players, winner_idx, *, frame_ms, hold_ms, **options):
+    frames = max(2, options["total_ms"] // frame_ms)
+    gif_frames = render_reel_from_strip(players, winner_idx, frames=frames, **options)
+    gif_frames.append(gif_frames[-1])
+    return encode_gif(
+        gif_frames,
+        build_palette(
+            [p.image for p in players],
+            [spin_generator.MARKER_COLOR, (0, 0, 0, 255)],
+        ),
+        duration=[frame_ms] * frames + [hold_ms],
+        loop=0,
+        disposal=2,
+    )
+
+
+def read_memory_status(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+
+def measure_peak_memory(build_gif, *args, **kwargs):
+    """
+    Runs build_gif, returning how far its peak memory use rose above the memory in
+    use before, in bytes, and how long it took. Linux only.
+    """
+    # Resets the peak resident set size to the current one.
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    before = read_memory_status("VmRSS")
+    start = time.perf_counter()
+    build_gif(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return read_memory_status("VmHWM") - before, elapsed
+
+
+async def bench_jackpot_reel(players: int = 15):
+    """
+    Renders jackpot reels of growing spin durations with the strip renderer and the
+    windowed one, asserting both draw the same frames, and reports each build's peak
+    memory and time.
+    """
+    jackpot_players = [
+        spin_generator.Player(str(i), 100 / players, synthetic_avatar(i, 192))
+        for i in range(players)
+    ]
+    options = dict(avatar_size=192, tile_w=192, canvas_w=192 * 5)
+
+    random.seed(0)
+    expected = render_reel_from_strip(
+        jackpot_players, 0, total_ms=4000, frames=100, **options
+    )
+    random.seed(0)
+    windowed = spin_generator._render_frames(
+        jackpot_players, 0, total_ms=4000, frames=100, **options
+    )
+    if [frame.tobytes() for frame in expected] != [
+        frame.tobytes() for frame in windowed
+    ]:
+        raise AssertionError("The windowed reel drew different frames")
+    del expected
+
+    loop = asyncio.get_running_loop()
+    for total_ms in [4000, 8000, 16000]:
+        print(f"Spinning for {total_ms / 1000:.0f}s...")
+        for name, build_gif in [
+            ("strip", build_jackpot_gif_from_strip),
+            ("windowed", spin_generator._build_gif),
+        ]:
+            # A fresh process per build, so memory freed by the last one can't hide
+            # this one's peak.
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                peak, elapsed = await loop.run_in_executor(
+                    pool,
+                    functools.partial(
+                        measure_peak_memory,
+                        build_gif,
+                        jackpot_players,
+                        0,
+                        total_ms=total_ms,
+                        frame_ms=40,
+                        hold_ms=2000,
+                        **options,
+                    ),
+                )
+            print(f"{name:>16} : {peak / 1024 / 1024:>6,.0f} MiB peak, {elapsed:.2f}s")
+
+
+class StartupClient:
+    """
+    Stands in for the bot's client right after connecting, with one cached guild,
+    role and channel. Records the views registered with it.
+    """
+
+    def __init__(self):
+        guild = SimpleNamespace(id=1)
+        self.role = SimpleNamespace(id=2, guild=guild, color=0)
+        guild.get_role = lambda role_id: self.role
+        self.guild = guild
+        self.channel = SimpleNamespace(id=3)
+        self.channel.get_partial_message = lambda message_id: SimpleNamespace(
+            id=message_id, channel=self.channel
+        )
+        self.views = 0
+
+    def get_guild(self, guild_id: int):
+        return self.guild
+
+    def get_channel(self, channel_id: int):
+        return self.channel
+
+    def add_view(self, view, *, message_id=None):
+        self.views += 1
+
+
+async def bench_restore(parties: int = 10_000, lobbies: int = 100):
+    """
+    Saves parties with pending start jobs and coinflip lobbies with bets in, like a
+    busy server right before a deploy, then restores them into fresh services and
+    reports how long each step took.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        await setup_database(os.path.join(tmp, "bench.db"), 0)
+        client = StartupClient()
+        run_date = datetime.now(tz=timezone.utc) + timedelta(hours=1)
+
+        timers = TimerWheel()
+        party_service = PartyService(client, timers)
+        pitboss = CasinoPitboss(client, timers)
+        start = time.perf_counter()
+        for i in range(parties):
+            user = SimpleNamespace(id=i, display_name=f"user {i}")
+            party = party_service.create_party(
+                user, 1000, run_date, role=client.role, created_at=int(time.time())
+            )
+            for member in range(1, 4):
+                party_service.add_member(party, parties + member, "member", 1000)
+            party.channel_id = client.channel.id
+            party.message_id = i
+            party_service.save_party(party)
+        for i in range(lobbies):
+            game = Coinflip(None, host_bet=100, host_choice="heads", host_id=i)
+            lobby = CasinoLobby(
+                uuid=uuid.uuid4(),
+                name=game.name,
+                created_at=int(time.time()),
+                start_time=int(run_date.timestamp()),
+                interaction=None,
+                game=game,
+                alias="coinflip",
+                members=[DegenerateGambler(i, 100, "https://example.com/avatar.png")],
+                channel_id=client.channel.id,
+                message_id=i,
+            )
+            pitboss._open_lobby(lobby, run_date)
+            pitboss.save_lobby(lobby)
+        marked = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await party_service.store.flush()
+        await pitboss.store.flush()
+        flushed = time.perf_counter() - start
+
+        print(
+            f"{'save':>16} : {marked:.2f}s to create and mark, {flushed:.2f}s to write"
+        )
+
+        timers = TimerWheel()
+        party_service = PartyService(client, timers)
+        pitboss = CasinoPitboss(client, timers)
+        start = time.perf_counter()
+        restored_parties = await party_service.restore()
+        restored_lobbies = await pitboss.restore()
+        elapsed = time.perf_counter() - start
+        jobs = len(timers)
+        await db.cleanup()
+
+    if (restored_parties, restored_lobbies) != (parties, lobbies):
+        raise AssertionError(
+            f"Restored {restored_parties} parties and {restored_lobbies} lobbies"
+        )
+    print(
+        f"{'restore':>16} : {elapsed:.2f}s for {parties:,} parties and {lobbies:,} lobbies "
+        f"({jobs:,} jobs, {client.views:,} views), {elapsed / jobs * 1e6:.0f}us per job"
+    )
+
+
+async def noop(*args):
+    pass
+
+
+async def bench_timers(parties: int = 50_000):
+    """
+    Schedules a start job for each of the given number of parties, reschedules them
+    all like a round of time adjustments, then cancels them, with APScheduler and the
+    timer wheel. Reports each step's time and the memory the scheduled jobs take up,
+    and checks that the wheel never runs a timer early.
+    """
+    now = datetime.now(tz=timezone.utc)
+    run_dates = [
+        now + timedelta(seconds=random.randint(60, 12 * 3600)) for _ in range(parties)
+    ]
+    new_run_dates = [run_date + timedelta(minutes=15) for run_date in run_dates]
+    ids = [str(uuid.uuid4()) for _ in range(parties)]
+
+    apscheduler = AsyncIOScheduler(timezone="UTC")
+    apscheduler.start()
+    wheel = TimerWheel()
+    for name, schedule, reschedule, cancel in [
+        (
+            "apscheduler",
+            lambda id, run_date: apscheduler.add_job(
+                noop, "date", args=[id], run_date=run_date, id=id
+            ),
+            lambda id, run_date: apscheduler.reschedule_job(id, run_date=run_date),
+            lambda id: apscheduler.remove_job(id),
+        ),
+        (
+            "timer-wheel",
+            lambda id, run_date: wheel.schedule(id, run_date, noop, id),
+            wheel.reschedule,
+            wheel.cancel,
+        ),
+    ]:
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        for id, run_date in zip(ids, run_dates):
+            schedule(id, run_date)
+        scheduled = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for id, run_date in zip(ids, new_run_dates):
+            reschedule(id, run_date)
+        rescheduled = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for id in ids:
+            cancel(id)
+        cancelled = time.perf_counter() - start
+
+        print(
+            f"{name:>16} : {memory / 1024 / 1024:>6.1f} MiB, schedule {scheduled / parties * 1e6:>5.1f}us, "
+            f"reschedule {rescheduled / parties * 1e6:>5.1f}us, cancel {cancelled / parties * 1e6:>5.1f}us per job"
+        )
+    apscheduler.shutdown(wait=False)
+    del apscheduler, wheel
+    gc.collect()
+    # APScheduler queues a wakeup on the loop for every change, which would hold up
+    # the first ticks below.
+    await asyncio.sleep(0)
+
+    # Timers spread over a few wheels' worth of 1ms ticks.
+    wheel = TimerWheel(resolution=0.001)
+    fired = {}
+
+    async def record(id: int):
+        fired[id] = time.time()
+
+    now = time.time()
+    run_at = [now + random.uniform(-0.1, 3) for _ in range(2000)]
+    for id, timestamp in enumerate(run_at):
+        wheel.schedule(
+            str(id), datetime.fromtimestamp(timestamp, tz=timezone.utc), record, id
+        )
+    while len(wheel):
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.05)
+
+    if len(fired) != len(run_at):
+        raise AssertionError(f"Only {len(fired)} of {len(run_at)} timers ran")
+    if any(fired[id] < timestamp for id, timestamp in enumerate(run_at)):
+        raise AssertionError("A timer ran before its run time")
+    late = max(fired[id] - max(timestamp, now) for id, timestamp in enumerate(run_at))
+    print(
+        f"{'timer-wheel':>16} : 2,000 timers at 1ms ticks ran at most {late * 1000:.0f}ms late"
+    )
+
+
+def search_by_scan(party_service: PartyService, role_id: int) -> list[Party]:
+    """
+    The previous /search, which went through every party.
+    """
+    party_list = []
+    for party in party_service.parties.values():
+        if party.role.id == role_id:
+            party_list.append(party)
+    return party_list
+
+
+def user_parties_by_scan(party_service: PartyService, user_id: int) -> list[Party]:
+    """
+    The previous /parties, which went through every party's members.
+    """
+    personal_party_list = []
+    for party in party_service.parties.values():
+        member_ids = {m.user_id for m in party.members}
+        if user_id in member_ids:
+            personal_party_list.append(party)
+    return personal_party_list
+
+
+async def bench_party_search(
+    parties: int = 100_000, roles: int = 50, users: int = 20_000, lookups: int = 200
+):
+    """
+    Fills a party service with parties spread over roles and users, with some members
+    leaving and waitlisted members taking their spots, then looks up parties by role
+    and by user by scanning every party and through the indexes, asserting both find
+    the same parties.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        await setup_database(os.path.join(tmp, "bench.db"), 0)
+        party_service = PartyService(StartupClient(), TimerWheel())
+        role_objects = [
+            SimpleNamespace(id=i, guild=SimpleNamespace(id=0)) for i in range(roles)
+        ]
+        run_date = datetime.now(tz=timezone.utc) + timedelta(hours=1)
+
+        rng = random.Random(0)
+        for _ in range(parties):
+            owner = SimpleNamespace(id=rng.randrange(users), display_name="owner")
+            party = party_service.create_party(
+                owner,
+                1000,
+                run_date,
+                role=rng.choice(role_objects),
+                created_at=0,
+                max_size=3,
+            )
+            for user_id in rng.sample(range(users), 4):
+                if user_id != owner.id:
+                    party_service.add_member(party, user_id, "member", 1000)
+            if rng.random() < 0.2:
+                party_service.remove_member(
+                    party, rng.choice(list(party.members)).user_id
+                )
+            if rng.random() < 0.1:
+                party_service.remove_party(party.uuid)
+
+        role_ids = [rng.randrange(roles) for _ in range(lookups)]
+        user_ids = [rng.randrange(users) for _ in range(lookups)]
+        for name, by_role, by_user in [
+            (
+                "scan",
+                functools.partial(search_by_scan, party_service),
+                functools.partial(user_parties_by_scan, party_service),
+            ),
+            ("index", party_service.get_role_parties, party_service.get_user_parties),
+        ]:
+            start = time.perf_counter()
+            found_by_role = [by_role(role_id) for role_id in role_ids]
+            role_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            found_by_user = [by_user(user_id) for user_id in user_ids]
+            user_elapsed = time.perf_counter() - start
+
+            found = [
+                {party.uuid for party in found_parties}
+                for found_parties in found_by_role + found_by_user
+            ]
+            if name == "scan":
+                expected = found
+            elif found != expected:
+                raise AssertionError("The indexes found different parties")
+            print(
+                f"{name:>16} : /search {role_elapsed / lookups * 1e6:>9,.1f}us, "
+                f"/parties {user_elapsed / lookups * 1e6:>9,.1f}us per call"
+            )
+        await party_service.store.flush()
+        await db.cleanup()
+
+
+@dataclass
+class DictPartyMember:
+    """
+    The previous PartyMember, without slots.
+    """
+
+    user_id: int
+    name: str
+    cached_ssc: int
+    status: PartyMemberStatus = PartyMemberStatus.NEUTRAL
+
+
+@dataclass
+class ListParty:
+    """
+    The previous Party, without slots, with its members in a list and its waitlist in
+    a deque.
+    """
+
+    uuid: uuid.UUID
+    role: object
+    name: str
+    owner_id: Optional[int]
+    created_at: int
+    role_image_url: Optional[int] = None
+    finished_at: Optional[int] = None
+    start_time: Optional[int] = None
+    channel_id: Optional[int] = None
+    message_id: Optional[int] = None
+    jump_url: Optional[str] = None
+    expires_at: Optional[int] = None
+    max_size: int = 5
+    status: PartyStatus = PartyStatus.ASSEMBLING
+    description: str = ""
+    members: list = field(default_factory=list)
+    waitlist: deque = field(default_factory=deque)
+
+
+def remove_member_by_rebuild(
+    members: list, waitlist: deque, user_id: int
+) -> tuple[list, deque]:
+    """
+    The previous Party.remove_member, which rebuilt the lists, with the waitlist kept
+    a deque so promoting from it works.
+    """
+    if user_id in [member.user_id for member in waitlist]:
+        return members, deque(
+            member for member in waitlist if member.user_id != user_id
+        )
+
+    members = [member for member in members if member.user_id != user_id]
+    if waitlist:
+        members.append(waitlist.popleft())
+    return members, waitlist
+
+
+async def bench_party_members(
+    parties: int = 20_000, max_size: int = 500, operations: int = 5_000
+):
+    """
+    Measures the memory of whole parties of 5 members with 2 waitlisted, before and
+    after their embed fragments are cached by rendering it, then churns a big
+    party with a full waitlist, with members and waitlisted users leaving and new
+    users joining, using lists and the member lists. Asserts both end up with the
+    same members and waitlist, in the same order.
+    """
+
+    role = SimpleNamespace(id=0, color=0xFFAE00)
+
+    def old_party(i: int):
+        return ListParty(
+            uuid=uuid.uuid4(),
+            role=role,
+            name="party",
+            owner_id=i * 7,
+            created_at=0,
+            members=[DictPartyMember(i * 7 + j, "member", 1000) for j in range(5)],
+            waitlist=deque(
+                DictPartyMember(i * 7 + j, "member", 1000) for j in range(5, 7)
+            ),
+        )
+
+    def new_party(i: int):
+        party = Party(
+            uuid=uuid.uuid4(), role=role, name="party", owner_id=i * 7, created_at=0
+        )
+        for j in range(7):
+            party.add_member(i * 7 + j, "member", 1000)
+        return party
+
+    def rendered_party(i: int):
+        party = new_party(i)
+        party.generate_embed()
+        return party
+
+    for name, make_party in [
+        ("lists", old_party),
+        ("member-lists", new_party),
+        ("rendered", rendered_party),
+    ]:
+        gc.collect()
+        tracemalloc.start()
+        kept = [make_party(i) for i in range(parties)]
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        print(f"{name:>16} : {memory / parties:>6,.0f} bytes per party")
+
+    rng = random.Random(0)
+    leaving = [rng.random() for _ in range(operations)]
+
+    members = [DictPartyMember(i, "member", 1000) for i in range(max_size)]
+    waitlist = deque(
+        DictPartyMember(max_size + i, "member", 1000) for i in range(max_size)
+    )
+    next_user_id = max_size * 2
+    start = time.perf_counter()
+    for roll in leaving:
+        # Picking who leaves is part of the work here, to match the checks in the views.
+        everyone = [member.user_id for member in members] + [
+            member.user_id for member in waitlist
+        ]
+        members, waitlist = remove_member_by_rebuild(
+            members, waitlist, everyone[int(roll * len(everyone))]
+        )
+        waitlist.append(DictPartyMember(next_user_id, "member", 1000))
+        next_user_id += 1
+    old_elapsed = time.perf_counter() - start
+    expected = [member.user_id for member in members], [
+        member.user_id for member in waitlist
+    ]
+
+    party = Party(
+        uuid=uuid.uuid4(),
+        role=0,
+        name="",
+        owner_id=None,
+        created_at=0,
+        max_size=max_size,
+    )
+    for user_id in range(max_size * 2):
+        party.add_member(user_id, "member", 1000)
+    next_user_id = max_size * 2
+    start = time.perf_counter()
+    for roll in leaving:
+        index = int(roll * (len(party.members) + len(party.waitlist)))
+        if index < len(party.members):
+            user_id = next(itertools.islice(party.members, index, None)).user_id
+        else:
+            user_id = next(
+                itertools.islice(party.waitlist, index - len(party.members), None)
+            ).user_id
+        party.remove_member(user_id)
+        party.add_member(next_user_id, "member", 1000)
+        next_user_id += 1
+    new_elapsed = time.perf_counter() - start
+
+    if (
+        [member.user_id for member in party.members],
+        [member.user_id for member in party.waitlist],
+    ) != expected:
+        raise AssertionError("The member lists ended up with different members")
+    for name, elapsed in [("lists", old_elapsed), ("member-lists", new_elapsed)]:
+        print(
+            f"{name:>16} : {elapsed / operations * 1e6:>8,.1f}us per leave and join "
+            f"with {max_size} members and {max_size} waitlisted"
+        )
+
+
+def generate_embed_by_rebuild(party: Party) -> dict:
+    """
+    The previous Party.generate_embed, which rendered the whole embed every time.
+    """
+    start_string = f"\n\nStarts: <t:{party.start_time}:R>" if party.start_time else ""
+    waitlist_mentions = [f"<@{m.user_id}>" for m in party.waitlist]
+    waitlist_string = f"Waitlist: {" ".join(waitlist_mentions)}"
+    remaining_spots = party.max_size - len(party.members)
+    content = (
+        f"**{party.name}**\n\n`{remaining_spots}` spot{'s' if remaining_spots != 1 else ''} left.{start_string}\n\n"
+        + f"Current Party:\n"
+    )
+    for member in party.members:
+        content += (
+            f"- {'👑 ' if member.user_id == party.owner_id else ''}<@{member.user_id}>"
+        )
+        if member.cached_ssc < 900:
+            content += f' [(!)]({party.jump_url} "Warning: Party member has low SSC ({member.cached_ssc}).")'
+        content += "\n"
+
+    if party.waitlist:
+        content += f"\n{waitlist_string}\n"
+
+    embed_contents = {"message": content, "color": party.role.color}
+
+    if party.role_image_url:
+        embed_contents["image_url"] = party.role_image_url
+
+    return embed_contents
+
+
+async def bench_party_embed(max_size: int = 20, users: int = 40, actions: int = 20_000):
+    """
+    Replays random joins, leaves and start time changes on a party, like the party
+    view's buttons, rendering the embed after each one by rebuilding it and through
+    the party's cached fragments. Asserts both render the same embeds, and counts the
+    message edits left after skipping embeds the message already shows. Start times
+    are clamped like the time buttons, so some changes leave the embed as it was.
+    """
+    rng = random.Random(0)
+    plan = []
+    for _ in range(actions):
+        roll = rng.random()
+        if roll < 0.4:
+            plan.append(("join", rng.randrange(users)))
+        elif roll < 0.8:
+            plan.append(("leave", rng.randrange(users)))
+        else:
+            plan.append(("time", rng.choice([-15, 5, 15, 60])))
+
+    def replay(render):
+        party = Party(
+            uuid=uuid.uuid4(),
+            role=SimpleNamespace(id=0, color=0xFFAE00),
+            name="party",
+            owner_id=0,
+            created_at=0,
+            max_size=max_size,
+            start_time=0,
+        )
+        party.add_member(0, "owner", 1000)
+        party.jump_url = "https://discord.com/channels/0/0/0"
+        renders = []
+        start = time.perf_counter()
+        for action, value in plan:
+            in_party = value in party.members or value in party.waitlist
+            if action == "join" and not in_party:
+                # Every third user has low SSC, so their lines carry a warning.
+                party.add_member(value, "member", 800 if value % 3 == 0 else 1000)
+            elif action == "leave" and in_party and len(party.members) > 1:
+                party.remove_member(value)
+            elif action == "time":
+                party.start_time = min(max(party.start_time + value * 60, 0), 3600 * 12)
+            else:
+                # The views turn these away without rendering.
+                continue
+            renders.append(render(party))
+        return renders, time.perf_counter() - start
+
+    expected, rebuild_elapsed = replay(generate_embed_by_rebuild)
+
+    def render_cached(party: Party):
+        embed_contents = party.generate_embed()
+        if not party.embed_changed(embed_contents):
+            return None
+        party.mark_embed_shown(embed_contents)
+        return embed_contents
+
+    renders, cached_elapsed = replay(render_cached)
+
+    shown = None
+    for rebuilt, cached in zip(expected, renders):
+        if cached is not None:
+            shown = cached
+        if shown != rebuilt:
+            raise AssertionError("The cached fragments rendered a different embed")
+    edits = sum(cached is not None for cached in renders)
+    for name, elapsed, sent in [
+        ("rebuild", rebuild_elapsed, len(expected)),
+        ("fragments", cached_elapsed, edits),
+    ]:
+        print(
+            f"{name:>16} : {elapsed / len(expected) * 1e6:>6,.1f}us per render, "
+            f"{sent:,} of {len(expected):,} renders edited in"
+        )
+
+
+BENCHMARKS = {
+    "settlements": bench_settlements,
+    "recalculate": bench_recalculate,
+    "crash-graph": bench_crash_graph,
+    "lobby-edits": bench_lobby_edits,
+    "gif-render": bench_gif_render,
+    "coinflip": bench_coinflip,
+    "jackpot-reel": bench_jackpot_reel,
+    "restore": bench_restore,
+    "timers": bench_timers,
+    "party-search": bench_party_search,
+    "party-members": bench_party_members,
+    "party-embed": bench_party_embed,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        asyncio.run(BENCHMARKS[name]())
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entry once full. Counts hits
+    and misses so the cache's effectiveness can be checked at runtime.
+
+    By default max_size is a number of entries. If size_of is given, it's a budget in
+    whatever unit size_of weighs each value in, like bytes.
+    """
+
+    def __init__(self, max_size: int, size_of: Optional[Callable[[Any], int]] = None):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Optional[Any]:
+        if key not in self._entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.pop(key)
+        size = self.size_of(value) if self.size_of else 1
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._size += size
+        # Keep at least the newest entry, even if it's over the budget by itself.
+        while self._size > self.max_size and len(self._entries) > 1:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self._size -= self._sizes.pop(evicted_key)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        if key not in self._entries:
+            return None
+        self._size -= self._sizes.pop(key)
+        return self._entries.pop(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._sizes.clear()
+        self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self._size,
+            "max_size": self.max_size,
+        }
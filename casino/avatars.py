@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from cache import LRUCache
+from casino.util import fetch_image
+
+AVATAR_CACHE_DIR = "avatar_cache"
+
+AVATAR_MEMORY_BUDGET = 32 * 1024 * 1024  # 32 MiB
+AVATAR_DISK_BUDGET = 256 * 1024 * 1024  # 256 MiB
+
+
+def image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class AvatarCache:
+    """
+    Avatars cropped to a square size, for the casino's GIFs.
+
+    Avatars are kept decoded in memory, least recently used first out once they're
+    over the memory budget. Behind that, they're stored on disk as PNGs named by a hash
+    of their URL and size, so they survive restarts. Discord avatar URLs contain the
+    avatar's hash, so a changed avatar is a new URL and stored entries never go stale.
+    The least recently used files are deleted once the store is over its budget.
+
+    The returned images are shared, so they must not be modified in place.
+    """
+
+    def __init__(
+        self,
+        directory: str = AVATAR_CACHE_DIR,
+        memory_budget: int = AVATAR_MEMORY_BUDGET,
+        disk_budget: int = AVATAR_DISK_BUDGET,
+    ):
+        self.directory = directory
+        self.disk_budget = disk_budget
+        self.memory = LRUCache(memory_budget, size_of=image_bytes)
+        self._disk_size: Optional[int] = None
+        self._disk_lock = threading.Lock()
+        # Avatars being read or fetched, so concurrent misses for the same key, like a
+        # user in two lobbies, load it once.
+        self._loading: Dict[Tuple[str, int], asyncio.Task] = {}
+
+    async def get(self, url: str, size: int) -> Image.Image:
+        """
+        Returns the avatar at url, cropped and resized to a size x size RGBA image.
+        """
+        key = (url, size)
+        image = self.memory.get(key)
+        if image is not None:
+            return image
+
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(url, size))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        # Shielded so one cancelled caller doesn't cancel the load for the others.
+        return await asyncio.shield(task)
+
+    async def _load(self, url: str, size: int) -> Image.Image:
+        path = self._path(url, size)
+        image = await asyncio.to_thread(self._read, path)
+        if image is None:
+            image = await fetch_image(url)
+            image = await asyncio.to_thread(self._fit_and_store, image, size, path)
+
+        self.memory.put((url, size), image)
+        return image
+
+    def _path(self, url: str, size: int) -> str:
+        digest = hashlib.sha256(f"{size}:{url}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.png")
+
+    def _read(self, path: str) -> Optional[Image.Image]:
+        try:
+            with Image.open(path) as image:
+                image = image.convert("RGBA")
+            # Touched so pruning deletes the least recently used files first.
+            os.utime(path)
+            return image
+        except OSError:
+            # Missing, or just pruned.
+            return None
+
+    def _fit_and_store(self, image: Image.Image, size: int, path: str) -> Image.Image:
+        image = ImageOps.fit(image, (size, size), centering=(0.5, 0.5)).convert("RGBA")
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first, so a crash never leaves a partial PNG
+        # under the real name. Each write gets its own file, so writes of the same
+        # avatar never move each other's partial files into place.
+        temporary = tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        )
+        try:
+            with temporary:
+                image.save(temporary, format="PNG")
+
+            with self._disk_lock:
+                # An avatar fetched again, like after its file failed to read, replaces
+                # the stored file rather than adding to the store.
+                try:
+                    replaced_size = os.path.getsize(path)
+                except OSError:
+                    replaced_size = 0
+                os.replace(temporary.name, path)
+
+                if self._disk_size is None:
+                    self._disk_size = sum(
+                        entry.stat().st_size for entry in os.scandir(self.directory)
+                    )
+                else:
+                    self._disk_size += os.path.getsize(path) - replaced_size
+                if self._disk_size > self.disk_budget:
+                    self._prune()
+        except Exception:
+            if os.path.exists(temporary.name):
+                os.remove(temporary.name)
+            raise
+
+        return image
+
+    def _prune(self) -> None:
+        """
+        Deletes the least recently used files until the store is at most 3/4 of its
+        budget, so pruning doesn't run on every write.
+        """
+        entries = sorted(
+            (
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(".png")
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self._disk_size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._disk_size <= self.disk_budget * 3 // 4:
+                break
+            self._disk_size -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+# Shared by every casino game, since the same regulars play every round.
+avatar_cache = AvatarCache()
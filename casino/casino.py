@@ -1,4 +1,4 @@
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timedelta, timezone
 from typing import Callable, Dict, List, Optional
 import uuid
@@ -8,9 +8,11 @@ from casino.models import CasinoGame, CasinoGameAlias, DegenerateGambler
 from casino.util import get_log_source
 from casino.views import CasinoLobbyView
 import db
+from edit_scheduler import EditTarget
+from state_store import StateStore
+from timers import TimerWheel, timer_wheel
 from util import create_embed
 import time
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import discord
 
 from casino.crash import Crash
@@ -28,12 +30,17 @@ class CasinoLobby:
     name: str
     created_at: int
     start_time: int
-    interaction: discord.Interaction
+    # The interaction that opened the lobby, or its message if it was restored.
+    interaction: EditTarget
     game: CasinoGame
+    alias: CasinoGameAlias
     members: List[DegenerateGambler] = field(default_factory=list)
     started: bool = False
     max_size: Optional[int] = None
     finished: bool = False
+    # The lobby's message, once it's been sent.
+    channel_id: Optional[int] = None
+    message_id: Optional[int] = None
 
     @property
     def size(self) -> int:
@@ -54,10 +61,24 @@ class CasinoLobby:
 
 
 class CasinoPitboss:
-    def __init__(self):
+    def __init__(self, client: discord.Client, timers: TimerWheel = timer_wheel):
+        self.client = client
         self.lobbies: List[CasinoLobby] = []
-        self.scheduler = AsyncIOScheduler(timezone="UTC")
-        self.scheduler.start()
+        self.timers = timers
+        self.store: StateStore[CasinoLobby] = StateStore(
+            self._to_row, db.save_casino_lobby_states, db.delete_casino_lobby_states
+        )
+        # Views listening to restored lobbies' messages, which only stop when told to.
+        self.restored_views: Dict[uuid.UUID, discord.ui.View] = {}
+
+    def save_lobby(self, lobby: CasinoLobby) -> None:
+        """
+        Queues a write of the lobby's state, after it changed. Only lobbies still
+        taking bets are written, since games can't be resumed halfway through.
+        """
+        if lobby.started or lobby not in self.lobbies:
+            return
+        self.store.mark(str(lobby.uuid), lobby)
 
     async def start_lobby(
         self,
@@ -86,6 +107,7 @@ class CasinoPitboss:
             uuid=uuid.uuid4(),
             name=initialized_game.name,
             game=initialized_game,
+            alias=game,
             created_at=now,
             start_time=start_time,
             interaction=interaction,
@@ -95,61 +117,129 @@ class CasinoPitboss:
         if on_lobby_create:
             on_lobby_create(lobby)
 
-        initialized_game.finish_callback = lambda: self.finish_lobby(lobby)
-
-        self.lobbies.append(lobby)
-        run_date = datetime.now(tz=timezone.utc) + timedelta(
-            seconds=lobby.game.lobby_time
+        self._open_lobby(
+            lobby,
+            datetime.now(tz=timezone.utc) + timedelta(seconds=lobby.game.lobby_time),
         )
 
-        async def start(casino_lobby: CasinoLobby):
-            casino_lobby.started = True
-
-            try:
-                await casino_lobby.game.start(casino_lobby.members)
-            except Exception:
-                if not casino_lobby.finished:
-                    # Refund all bets if the game fails
-                    for member in casino_lobby.members:
-                        user_data = await db.get_user(member.user_id)
-                        ssc = user_data["sail_credit"]
-                        await db.change_and_log_sail_credit(
-                            member.user_id,
-                            -1,
-                            -1,
-                            -1,
-                            ssc,
-                            ssc + member.bet_amount,
-                            source=get_log_source(
-                                casino_lobby.game.canonical_name, "CREDIT"
-                            ),
-                        )
-                    await self.finish_lobby(casino_lobby)
-                    await casino_lobby.interaction.channel.send(
-                        embed=create_embed(
-                            f"An error occurred during the last **{casino_lobby.game.name}** lobby.\nAll bets have been refunded.",
-                            color=discord.Colour.red(),
-                        ),
-                        view=None,
-                    )
-                raise
-
-        self.scheduler.add_job(
-            start,
-            "date",
-            args=[lobby],
-            run_date=run_date,
-            id=str(lobby.uuid),
+        await interaction.response.send_message(
+            embed=lobby.generate_embed(),
+            view=CasinoLobbyView(lobby, self, timeout=lobby.game.lobby_time),
         )
 
-        await interaction.response.send_message(
-            embed=lobby.generate_embed(), view=CasinoLobbyView(lobby)
+        message = await interaction.original_response()
+        lobby.channel_id = message.channel.id
+        lobby.message_id = message.id
+        self.save_lobby(lobby)
+
+    async def restore(self) -> int:
+        """
+        Restores the lobbies that were taking bets before the last restart, and
+        returns how many were restored. Lobbies whose message was never sent or whose
+        channel is gone are refunded. Needs the client's cache to be ready.
+
+        Nothing is fetched from Discord here. Each lobby's buttons are listened to
+        again by message ID, and its game edits the message by ID.
+        """
+        now = int(time.time())
+        restored = 0
+        for row in await db.get_casino_lobby_states():
+            channel = self.client.get_channel(row["channel_id"])
+            message = (
+                channel.get_partial_message(row["message_id"])
+                if channel and row["message_id"] is not None
+                else None
+            )
+            game = GAME_MAP[row["game"]](message, **row["state"]["options"])
+            lobby = CasinoLobby(
+                uuid=uuid.UUID(row["uuid"]),
+                name=game.name,
+                game=game,
+                alias=row["game"],
+                created_at=row["state"]["created_at"],
+                # Lobbies that should have started while the bot was down start now.
+                start_time=max(row["start_time"], now),
+                interaction=message,
+                members=[
+                    DegenerateGambler(**member) for member in row["state"]["members"]
+                ],
+                max_size=game.max_size,
+                channel_id=row["channel_id"],
+                message_id=row["message_id"],
+            )
+
+            if message is None:
+                self.store.mark(row["uuid"], None)
+                await self._refund(lobby)
+                continue
+
+            self._open_lobby(
+                lobby, datetime.fromtimestamp(lobby.start_time, tz=timezone.utc)
+            )
+            view = CasinoLobbyView(lobby, self, timeout=None)
+            self.client.add_view(view, message_id=lobby.message_id)
+            self.restored_views[lobby.uuid] = view
+            restored += 1
+
+        return restored
+
+    def _open_lobby(self, lobby: CasinoLobby, run_date: datetime) -> None:
+        lobby.game.finish_callback = lambda: self.finish_lobby(lobby)
+        self.lobbies.append(lobby)
+        self.timers.schedule(f"casino:{lobby.uuid}", run_date, self._start_lobby, lobby)
+
+    def _to_row(self, lobby: CasinoLobby) -> Dict:
+        return {
+            "uuid": str(lobby.uuid),
+            "game": lobby.alias,
+            "channel_id": lobby.channel_id,
+            "message_id": lobby.message_id,
+            "start_time": lobby.start_time,
+            "state": {
+                "created_at": lobby.created_at,
+                "options": lobby.game.get_options(),
+                "members": [asdict(member) for member in lobby.members],
+            },
+        }
+
+    async def _start_lobby(self, casino_lobby: CasinoLobby):
+        casino_lobby.started = True
+        # From here on the game settles the bets, so the lobby isn't restored anymore.
+        self.store.mark(str(casino_lobby.uuid), None)
+
+        try:
+            await casino_lobby.game.start(casino_lobby.members)
+        except Exception:
+            if not casino_lobby.finished:
+                # Refund all bets if the game fails
+                await self._refund(casino_lobby)
+                await self.finish_lobby(casino_lobby)
+                await casino_lobby.interaction.channel.send(
+                    embed=create_embed(
+                        f"An error occurred during the last **{casino_lobby.game.name}** lobby.\nAll bets have been refunded.",
+                        color=discord.Colour.red(),
+                    ),
+                    view=None,
+                )
+            raise
+
+    async def _refund(self, casino_lobby: CasinoLobby):
+        source = get_log_source(casino_lobby.game.canonical_name, "CREDIT")
+        await db.write_ledger(
+            [
+                db.LedgerWrite(member.user_id, source, delta=member.bet_amount)
+                for member in casino_lobby.members
+            ]
         )
 
     async def finish_lobby(self, lobby: CasinoLobby):
         if lobby in self.lobbies:
             self.lobbies.remove(lobby)
 
+        view = self.restored_views.pop(lobby.uuid, None)
+        if view:
+            view.stop()
+
         end_time = int(time.time())
         await db.create_casino_lobby_log(
             str(lobby.uuid),
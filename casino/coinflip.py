@@ -1,4 +1,5 @@
 import asyncio
+import io
 from dataclasses import dataclass, field
 import random
 
@@ -9,7 +10,8 @@ from typing import Dict, List, Literal, Optional
 
 from casino.util import get_log_source
 import db
-from util import create_embed
+from edit_scheduler import EditTarget
+from util import create_embed, edit_scheduler
 
 
 @dataclass
@@ -49,16 +51,18 @@ class Coinflip(CasinoGame):
 
     def __init__(
         self,
-        interaction: discord.Interaction,
+        interaction: EditTarget,
         host_bet: int = 10,
         host_choice: Literal["heads", "tails"] = "heads",
+        host_id: Optional[int] = None,
     ):
         super().__init__(interaction)
         self.name = "🪙 Sail Coinflip"
         self.canonical_name = "COINFLIP"
 
         self.game_state = CoinFlipGameState()
-        self.description = f"Join a 1v1 coinflip against <@{interaction.user.id}>!\n\nThe winner receives **{int(host_bet * self.game_state.win_multiplier)} SSC**."
+        self.host_id = host_id if host_id is not None else interaction.user.id
+        self.description = f"Join a 1v1 coinflip against <@{self.host_id}>!\n\nThe winner receives **{int(host_bet * self.game_state.win_multiplier)} SSC**."
         self.bet_config = BetConfig(bet_type="fixed", fixed_bet_amount=host_bet)
         self.lobby_time = 15
         self.embed_details = {
@@ -68,6 +72,13 @@ class Coinflip(CasinoGame):
         self.host_choice = host_choice
         self.max_size = 2
 
+    def get_options(self) -> Dict:
+        return {
+            "host_bet": self.bet_config.fixed_bet_amount,
+            "host_choice": self.host_choice,
+            "host_id": self.host_id,
+        }
+
     async def flip(self):
 
         winner = random.choice(self.game_state.members)
@@ -93,8 +104,9 @@ class Coinflip(CasinoGame):
         for member in self.game_state.members:
             description += f"- <@{member.user_id}> **({member.bet_amount} SSC)** **({member.choice})**\n"
 
-        await self.interaction.edit_original_response(
-            attachments=[discord.File(gif_bytes, filename="coinflip.gif")],
+        await edit_scheduler.edit(
+            self.interaction,
+            attachments=[discord.File(io.BytesIO(gif_bytes), filename="coinflip.gif")],
             embed=create_embed(
                 description,
                 "Flipping...",
@@ -106,19 +118,14 @@ class Coinflip(CasinoGame):
 
         await asyncio.sleep(wait_time_ms / 1000)
 
-        winner_data = await db.get_user(winner.user_id)
-        ssc = winner_data["sail_credit"]
-        await db.change_and_log_sail_credit(
+        await db.apply_sail_credit_delta(
             winner.user_id,
-            -1,
-            -1,
-            -1,
-            ssc,
-            ssc + win_amount,
+            win_amount,
             source=get_log_source(self.canonical_name, "CREDIT"),
         )
 
-        await self.interaction.edit_original_response(
+        await edit_scheduler.edit(
+            self.interaction,
             embed=create_embed(
                 f"<@{winner.user_id}> wins! **(+{win_amount} SSC)**\n\nBetter luck next time, <@{loser.user_id}>.",
                 f"{winner.choice.capitalize()}!",
@@ -131,7 +138,8 @@ class Coinflip(CasinoGame):
 
     async def start(self, members: List[DegenerateGambler]) -> None:
         if len(members) == 1:
-            await self.interaction.edit_original_response(
+            await edit_scheduler.edit(
+                self.interaction,
                 embed=create_embed(
                     f"<@{members[0].user_id}> No opponent found!",
                     image_url=self.embed_details["image_url"],
@@ -139,15 +147,9 @@ class Coinflip(CasinoGame):
                 ),
                 view=None,
             )
-            user_data = await db.get_user(members[0].user_id)
-            ssc = user_data["sail_credit"]
-            await db.change_and_log_sail_credit(
+            await db.apply_sail_credit_delta(
                 members[0].user_id,
-                -1,
-                -1,
-                -1,
-                ssc,
-                ssc + members[0].bet_amount,
+                members[0].bet_amount,
                 source=get_log_source(self.canonical_name, "REFUND"),
             )
             await self.finish()
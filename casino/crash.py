@@ -10,7 +10,8 @@ from typing import Dict, List
 
 from casino.util import get_crash_point, get_log_source, mult_to_emoji
 import db
-from util import create_embed, user_interaction_callback
+from edit_scheduler import EditTarget
+from util import create_embed, edit_scheduler
 import time
 
 
@@ -42,7 +43,6 @@ class CrashView(discord.ui.View):
         self.add_item(cash_out_button)
         self.crash = crash
 
-    @user_interaction_callback()
     async def cash_out(self, interaction: discord.Interaction):
         user_id = interaction.user.id
         crash_member = None
@@ -69,24 +69,15 @@ class CrashView(discord.ui.View):
             crash_member.bet_amount * self.crash.game_state.current_multiplier
         )
 
-        user = interaction.data["user_data"]  # pyright: ignore
         source = get_log_source(self.crash.canonical_name, "CREDIT")
-        await db.change_and_log_sail_credit(
-            user_id,
-            -1,
-            -1,
-            -1,
-            user["sail_credit"],
-            user["sail_credit"] + cash_out_amount,
-            source,
-        )
+        await db.apply_sail_credit_delta(user_id, cash_out_amount, source)
 
         # Avoid sending messages to respect rate limits
         await interaction.response.defer()
 
 
 class Crash(CasinoGame):
-    def __init__(self, interaction: discord.Interaction):
+    def __init__(self, interaction: EditTarget):
         super().__init__(interaction)
         self.name = "🚀 Sail Crash"
         self.canonical_name = "CRASH"
@@ -169,15 +160,16 @@ class Crash(CasinoGame):
             content = f"# {self.name}\n{past_crash_line}\n```{graph}```"
             start_time = time.time()
             if not view_initialized:
-                await self.interaction.edit_original_response(
+                await edit_scheduler.edit(
+                    self.interaction,
                     embed=self.generate_embed(),
                     content=content,
                     view=CrashView(self),
                 )
                 view_initialized = True
             else:
-                await self.interaction.edit_original_response(
-                    embed=self.generate_embed(), content=content
+                await edit_scheduler.edit(
+                    self.interaction, embed=self.generate_embed(), content=content
                 )
 
             if self.game_state.finished:
@@ -190,8 +182,8 @@ class Crash(CasinoGame):
     async def start(self, members: List[DegenerateGambler]) -> None:
         self.game_state.members = members
         await self.simulate()
-        await self.interaction.edit_original_response(
-            embed=self.generate_embed(), view=None
+        await edit_scheduler.edit(
+            self.interaction, embed=self.generate_embed(), view=None
         )
         await self.finish()
 
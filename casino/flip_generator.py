@@ -1,12 +1,19 @@
 import asyncio
-import io
 import math
 from typing import Literal, Tuple
 
-import aiohttp
-from PIL import Image, ImageDraw, ImageOps
+from PIL import Image, ImageDraw
 
-from casino.util import fetch_image
+from cache import LRUCache
+from casino.avatars import avatar_cache
+from casino.rendering import build_palette, encode_gif
+
+
+EDGE_COLOR = (255, 215, 0, 255)
+
+# Masked and labelled coin faces by (avatar URL, label, size).
+COIN_FACE_CACHE_SIZE = 256
+coin_face_cache = LRUCache(COIN_FACE_CACHE_SIZE)
 
 
 def _to_circle(
@@ -14,7 +21,6 @@ def _to_circle(
     size: int,
     label: Literal["H", "T"] | None = None,
 ) -> Image.Image:
-    img = ImageOps.fit(img, (size, size), centering=(0.5, 0.5))
     mask = Image.new("L", (size, size), 0)
     draw = ImageDraw.Draw(mask)
     draw.ellipse((0, 0, size - 1, size - 1), fill=255)
@@ -45,12 +51,27 @@ def _to_circle(
     return result
 
 
+async def get_coin_face(
+    url: str, label: Literal["H", "T"] | None, size: int
+) -> Image.Image:
+    """
+    Returns the avatar at url masked as a coin face, which is cached since the same
+    players flip again and again.
+    """
+    key = (url, label, size)
+    face = coin_face_cache.get(key)
+    if face is None:
+        face = _to_circle(await avatar_cache.get(url, size), size, label)
+        coin_face_cache.put(key, face)
+    return face
+
+
 def _render_flip_frame(
     front: Image.Image,
     back: Image.Image,
     angle: float,
     size: int,
-    edge_color: Tuple[int, int, int, int] = (255, 215, 0, 255),
+    edge_color: Tuple[int, int, int, int] = EDGE_COLOR,
 ) -> Image.Image:
     cos_a = math.cos(angle)
     width_factor = abs(cos_a)
@@ -73,6 +94,18 @@ def _render_flip_frame(
     return canvas
 
 
+def _flip_frame_key(angle: float, size: int) -> Tuple[str, int]:
+    """
+    Returns what _render_flip_frame draws at the angle: the coin's edge, or a face
+    scaled to a whole number of pixels wide. Frames with the same key are identical.
+    """
+    cos_a = math.cos(angle)
+    width_factor = abs(cos_a)
+    if width_factor < 0.08:
+        return ("edge", 0)
+    return ("front" if cos_a >= 0 else "back", max(1, int(size * width_factor)))
+
+
 def _build_gif(
     front: Image.Image,
     back: Image.Image,
@@ -80,13 +113,11 @@ def _build_gif(
     size: int,
     total_ms: int,
     frame_ms: int,
-    front_label: Literal["H", "T"] | None,
-    back_label: Literal["H", "T"] | None,
     result: Literal["front", "back"] = "front",
-) -> io.BytesIO:
-    front = _to_circle(front, size, front_label)
-    back = _to_circle(back, size, back_label)
-
+) -> bytes:
+    """
+    Animates a flip between two faces already masked by _to_circle.
+    """
     frames = max(2, total_ms // frame_ms)
 
     # Rotations scaled to duration: ~3 per second feels natural
@@ -103,7 +134,15 @@ def _build_gif(
     if result == "back":
         angles = [a + math.pi for a in angles]
 
-    gif_frames = [_render_flip_frame(front, back, a, size) for a in angles]
+    # The coin passes through the same widths on every rotation, and the frames slow
+    # down into near repeats as it lands, so each distinct frame is rendered once.
+    rendered = {}
+    gif_frames = []
+    for angle in angles:
+        key = _flip_frame_key(angle, size)
+        if key not in rendered:
+            rendered[key] = _render_flip_frame(front, back, angle, size)
+        gif_frames.append(rendered[key])
 
     # Hold the final frame for 1s
     hold_frames = max(1, 1000 // frame_ms)
@@ -114,18 +153,13 @@ def _build_gif(
     gif_frames = gif_frames[: len(gif_frames) - hold_frames + 1]
     durations = durations[: len(gif_frames)]
 
-    output = io.BytesIO()
-    gif_frames[0].save(
-        output,
-        format="GIF",
-        save_all=True,
-        append_images=gif_frames[1:],
+    return encode_gif(
+        gif_frames,
+        build_palette([front, back], [EDGE_COLOR]),
         duration=durations,
         loop=1,
         disposal=2,
     )
-    output.seek(0)
-    return output
 
 
 async def create_coinflip_gif(
@@ -138,7 +172,7 @@ async def create_coinflip_gif(
     size: int = 128,
     total_ms: int = 2000,
     frame_ms: int = 40,
-) -> io.BytesIO:
+) -> bytes:
     """
     Download two images, mask them as circles, animate a coin flip between them,
     and return an endlessly looping GIF that decelerates and lands on a given side.
@@ -153,14 +187,10 @@ async def create_coinflip_gif(
         total_ms:    Total animation duration in milliseconds (default 2000).
         frame_ms:    Duration of each frame in milliseconds (default 40 = 25 fps).
     """
-    timeout = aiohttp.ClientTimeout(total=15)
-    headers = {"User-Agent": "sail-credit/1.0"}
-
-    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-        front, back = await asyncio.gather(
-            fetch_image(session, front_url),
-            fetch_image(session, back_url),
-        )
+    front, back = await asyncio.gather(
+        get_coin_face(front_url, front_label, size),
+        get_coin_face(back_url, back_label, size),
+    )
 
     return await asyncio.to_thread(
         _build_gif,
@@ -169,7 +199,5 @@ async def create_coinflip_gif(
         size=size,
         total_ms=total_ms,
         frame_ms=frame_ms,
-        front_label=front_label,
-        back_label=back_label,
         result=result,
     )
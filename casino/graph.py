@@ -1,5 +1,9 @@
 import math
 
+import numpy as np
+
+from cache import LRUCache
+
 # Configuration
 COLS, ROWS = 40, 20
 W, H = COLS * 2, ROWS * 4
@@ -39,38 +43,44 @@ def format_label(value: float) -> str:
     return f"{int(round(value)):>5d}x"
 
 
-def render_dynamic_crash(current_return: float) -> list[str]:
-    buf = [0.0] * (W * H)
-    y_min, y_max = 1.0, max(2.0, current_return)
+# Bit of each dot in a braille cell, by (row, column) within the 2x4 block.
+DOT_BITS = np.array(
+    [
+        [0x01, 0x08],
+        [0x02, 0x10],
+        [0x04, 0x20],
+        [0x40, 0x80],
+    ],
+    dtype=np.uint8,
+)
 
-    # 1. Determine horizontal limit
-    draw_percentage = max(0.0, min(1.0, (current_return - 1.0) / (2.0 - 1.0)))
-    max_px = int(W * draw_percentage)
+# The braille character for every combination of dots.
+BRAILLE = np.array([chr(B | bits) for bits in range(256)])
 
-    # 2. Dynamic growth rate k so that exp(k*1) == current_return
-    k = math.log(current_return)
+# Pixels brighter than this are drawn as dots.
+DOT_THRESHOLD = 0.35
 
-    for px in range(max_px):
-        t = px / (W - 1)
-        val = math.exp(k * t)
+PIXEL_ROWS = np.arange(H)[:, None] + 0.5
+PIXEL_COLUMNS = np.arange(W)
 
-        norm_y = (val - y_min) / (y_max - y_min)
-        y_center = (1.0 - norm_y) * (H - 1)
+# Row labels only depend on y_max, which stays at 2.0 until the curve passes it.
+Y_LABEL_CACHE_SIZE = 1024
+y_label_cache = LRUCache(Y_LABEL_CACHE_SIZE)
 
-        y0 = int(math.floor(y_center - 1.0))
-        y1 = int(math.ceil(y_center + 1.0))
-        for py in range(max(0, y0), min(H - 1, y1) + 1):
-            dist = abs(py + 0.5 - y_center)
-            intensity = max(0.0, 1.0 - dist)
-            if intensity > 0:
-                idx = py * W + px
-                buf[idx] = max(buf[idx], intensity)
 
-    # Build tick lookup: map each row to a label string (or None)
+def get_row_labels(y_min: float, y_max: float) -> list[str | None]:
+    """
+    Returns the tick label for each row of the graph, or None for rows without one.
+    """
+    key = (y_min, y_max)
+    row_labels = y_label_cache.get(key)
+    if row_labels is not None:
+        return row_labels
+
     ticks = get_y_ticks(y_min, y_max)
 
     # For each row, compute the y value and check if it snaps to a tick
-    row_labels: list[str | None] = []
+    row_labels = []
     for row in range(ROWS):
         y_val = y_max - (row / (ROWS - 1)) * (y_max - y_min)
         # Find the closest tick and see if this row is close enough to show it
@@ -82,28 +92,34 @@ def render_dynamic_crash(current_return: float) -> list[str]:
         else:
             row_labels.append(None)
 
-    # Quantize and render
+    y_label_cache.put(key, row_labels)
+    return row_labels
+
+
+def render_dynamic_crash(current_return: float) -> list[str]:
+    y_min, y_max = 1.0, max(2.0, current_return)
+
+    # 1. Determine horizontal limit
+    draw_percentage = max(0.0, min(1.0, (current_return - 1.0) / (2.0 - 1.0)))
+    max_px = int(W * draw_percentage)
+
+    # 2. Dynamic growth rate k so that exp(k*1) == current_return
+    k = math.log(current_return)
+
+    # 3. Light every pixel within reach of the curve, one column per pixel.
+    t = PIXEL_COLUMNS[:max_px] / (W - 1)
+    norm_y = (np.exp(k * t) - y_min) / (y_max - y_min)
+    y_center = (1.0 - norm_y) * (H - 1)
+    lit = np.zeros((H, W), dtype=bool)
+    lit[:, :max_px] = 1.0 - np.abs(PIXEL_ROWS - y_center) > DOT_THRESHOLD
+
+    # 4. Pack each 2x4 block of pixels into a braille character.
+    blocks = lit.reshape(ROWS, 4, COLS, 2).transpose(0, 2, 1, 3)
+    bits = (blocks * DOT_BITS).sum(axis=(2, 3), dtype=np.uint8)
+    lines = BRAILLE[bits].view(f"<U{COLS}")[:, 0].tolist()
+
     out = []
-    for row in range(ROWS):
-        line = ""
-        for col in range(COLS):
-            bits = 0
-            for dc, dr, bit in [
-                (0, 0, 0x01),
-                (0, 1, 0x02),
-                (0, 2, 0x04),
-                (0, 3, 0x40),
-                (1, 0, 0x08),
-                (1, 1, 0x10),
-                (1, 2, 0x20),
-                (1, 3, 0x80),
-            ]:
-                px, py = col * 2 + dc, row * 4 + dr
-                if px < W and py < H and buf[py * W + px] > 0.35:
-                    bits |= bit
-            line += chr(B | bits)
-
-        label = row_labels[row]
+    for label, line in zip(get_row_labels(y_min, y_max), lines):
         if label is not None:
             out.append(f"{label} ┤{line}")
         else:
@@ -113,7 +129,38 @@ def render_dynamic_crash(current_return: float) -> list[str]:
     return out
 
 
+# Rendered graphs by displayed multiplier. Every round draws the same low multipliers,
+# so they're rendered once and reused.
+GRAPH_CACHE_SIZE = 1024
+graph_cache = LRUCache(GRAPH_CACHE_SIZE)
+
+# Multipliers up to this are pre-rendered at startup, since most rounds pass them.
+WARM_UP_MULTIPLIER = 3.0
+
+
 def render_graph(current_return: float, crashed: bool) -> str:
+    """
+    Returns the graph for the multiplier rounded to the displayed precision, which only
+    renders it if it isn't cached.
+    """
+    display = format(round(current_return, 3), ".2f")
+    key = (display, crashed)
+    graph = graph_cache.get(key)
+    if graph is None:
+        graph = _render_graph(float(display), crashed)
+        graph_cache.put(key, graph)
+    return graph
+
+
+def warm_graph_cache(up_to: float = WARM_UP_MULTIPLIER) -> None:
+    """
+    Renders the in progress graph for every displayed multiplier from 1.00x to up_to.
+    """
+    for step in range(round((up_to - 1.0) * 100) + 1):
+        render_graph(1.0 + step / 100, False)
+
+
+def _render_graph(current_return: float, crashed: bool) -> str:
     graph = render_dynamic_crash(current_return)
     x_0 = math.floor(COLS * 1 / 4)
     y_0 = math.floor(ROWS * 1 / 4)
@@ -1,4 +1,5 @@
 import asyncio
+import io
 from dataclasses import dataclass, field
 import random
 
@@ -9,7 +10,8 @@ from casino.models import BetConfig, CasinoGame, DegenerateGambler
 from casino.spin_generator import Player, create_jackpot_gif
 from casino.util import get_log_source
 import db
-from util import create_embed
+from edit_scheduler import EditTarget
+from util import create_embed, edit_scheduler
 
 
 @dataclass
@@ -35,7 +37,7 @@ class JackpotGameState:
 class Jackpot(CasinoGame):
     def __init__(
         self,
-        interaction: discord.Interaction,
+        interaction: EditTarget,
     ):
         super().__init__(interaction)
         self.name = "🎰 Sail Jackpot"
@@ -85,8 +87,9 @@ class Jackpot(CasinoGame):
             member_chance = format(member.bet_amount / total_bet_amount * 100, ".2f")
             description += f"- <@{member.user_id}> **({member.bet_amount} SSC)** **({member_chance}%)**\n"
 
-        await self.interaction.edit_original_response(
-            attachments=[discord.File(gif_bytes, filename="jackpot.gif")],
+        await edit_scheduler.edit(
+            self.interaction,
+            attachments=[discord.File(io.BytesIO(gif_bytes), filename="jackpot.gif")],
             embed=create_embed(
                 description,
                 "🎰 Rolling...",
@@ -98,14 +101,9 @@ class Jackpot(CasinoGame):
 
         await asyncio.sleep(wait_time_ms / 1000)
 
-        winner_data = await db.get_user(winner.user_id)
-        await db.change_and_log_sail_credit(
+        await db.apply_sail_credit_delta(
             winner.user_id,
-            -1,
-            -1,
-            -1,
-            winner_data["sail_credit"],
-            winner_data["sail_credit"] + winning_amount,
+            winning_amount,
             source=get_log_source(self.canonical_name, "CREDIT"),
         )
 
@@ -117,7 +115,8 @@ class Jackpot(CasinoGame):
                 )
                 end_description += f"- <@{member.user_id}> **(-{member.bet_amount} SSC)** **({member_chance}%)**\n"
 
-        await self.interaction.edit_original_response(
+        await edit_scheduler.edit(
+            self.interaction,
             embed=create_embed(
                 f"🏆 <@{winner.user_id}> won with a **{winning_chance}%** chance! **(+{winning_amount} SSC)**\n\n{end_description}",
                 self.name,
@@ -131,19 +130,14 @@ class Jackpot(CasinoGame):
     async def start(self, members: List[DegenerateGambler]) -> None:
         if len(members) < 2:
             if members:
-                user_data = await db.get_user(members[0].user_id)
-                ssc = user_data["sail_credit"]
-                await db.change_and_log_sail_credit(
+                await db.apply_sail_credit_delta(
                     members[0].user_id,
-                    -1,
-                    -1,
-                    -1,
-                    ssc,
-                    ssc + members[0].bet_amount,
+                    members[0].bet_amount,
                     source=get_log_source(self.canonical_name, "CREDIT"),
                 )
 
-            await self.interaction.edit_original_response(
+            await edit_scheduler.edit(
+                self.interaction,
                 embed=create_embed(
                     f"Not enough players! All bets were refunded.",
                     image_url=self.embed_details["image_url"],
@@ -4,6 +4,8 @@ import discord
 from abc import ABC, abstractmethod
 from typing import Callable, Dict, Any, List, Literal, Optional
 
+from edit_scheduler import EditTarget
+
 CasinoGameAlias = Literal["crash"]
 
 
@@ -24,7 +26,9 @@ class BetConfig:
 
 
 class CasinoGame(ABC):
-    interaction: discord.Interaction
+    # The interaction that opened the game's lobby, or the lobby's message if it was
+    # restored after a restart. Either way, the game edits it to show its progress.
+    interaction: EditTarget
     name: str
     canonical_name: str
     description: str
@@ -34,7 +38,7 @@ class CasinoGame(ABC):
     bet_config: BetConfig
     max_size: Optional[int] = None
 
-    def __init__(self, interaction: discord.Interaction):
+    def __init__(self, interaction: EditTarget):
         self.interaction = interaction
 
     @abstractmethod
@@ -49,6 +53,13 @@ class CasinoGame(ABC):
     def get_metadata(self) -> Dict:
         pass
 
+    def get_options(self) -> Dict[str, Any]:
+        """
+        The keyword arguments the game was created with, to recreate it with when its
+        lobby is restored.
+        """
+        return {}
+
     def player_descriptor(
         self, member: DegenerateGambler, members: List[DegenerateGambler]
     ) -> str:
@@ -1,13 +1,15 @@
 import asyncio
-import io
 import random
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
-import aiohttp
-from PIL import Image, ImageDraw, ImageOps
+from PIL import Image, ImageDraw
 
-from casino.util import fetch_image
+from casino.avatars import avatar_cache
+from casino.rendering import build_palette, encode_gif
+
+
+MARKER_COLOR = (255, 215, 0, 255)
 
 
 # ── Types ────────────────────────────────────────────────────────────────────
@@ -23,10 +25,6 @@ class Player:
 # ── Avatar helpers ────────────────────────────────────────────────────────────
 
 
-def _prepare_avatar(img: Image.Image, size: int) -> Image.Image:
-    return ImageOps.fit(img, (size, size), centering=(0.5, 0.5)).convert("RGBA")
-
-
 def _draw_avatar_tile(img: Image.Image, tile_w: int) -> Image.Image:
     size = img.height
     tile = Image.new("RGBA", (tile_w, size), (0, 0, 0, 255))
@@ -35,22 +33,21 @@ def _draw_avatar_tile(img: Image.Image, tile_w: int) -> Image.Image:
     return tile
 
 
-# ── Strip builder ─────────────────────────────────────────────────────────────
+# ── Reel builder ──────────────────────────────────────────────────────────────
 
 
-def _build_strip(
+def _build_reel(
     players: List[Player],
-    avatar_size: int,
     tile_w: int,
     total_distance: int,
     marker_x: int,
     winner_idx: int,
-) -> tuple[Image.Image, int]:
+) -> tuple[List[int], int]:
     """
-    Build a strip long enough to cover total_distance, ending with the
-    winner tile centered at marker_x.
+    Build a reel of player indexes long enough to cover total_distance, ending
+    with the winner tile centered at marker_x.
 
-    Returns (strip_image, final_offset) where final_offset is the scroll
+    Returns (tile_sequence, final_offset) where final_offset is the scroll
     position that places the winner under the marker.
     """
     total_weight = sum(p.weight for p in players)
@@ -65,62 +62,54 @@ def _build_strip(
         return c
 
     # Build tile sequence from shuffled cycles until we have a winner tile
-    # beyond total_distance + marker_x
+    # beyond total_distance + marker_x. Tiles never move once placed, so only
+    # the newest cycle needs checking.
     min_end_pixel = total_distance + marker_x
     tile_sequence: List[int] = []
+    winner_tile_i = None
 
-    while True:
+    while winner_tile_i is None:
+        cycle_start = len(tile_sequence)
         tile_sequence.extend(shuffled_cycle())
-        candidates = [
-            (i, tile_w * i + tile_w // 2)
-            for i, s in enumerate(tile_sequence)
-            if s == winner_idx and tile_w * i + tile_w // 2 > min_end_pixel
-        ]
-        if candidates:
-            winner_tile_i, winner_center_x = candidates[0]
-            break
-
-    final_offset = winner_center_x - marker_x
-
-    # Build the image up to winner_tile_i + a few extra tiles for safety
-    visible_tiles = winner_tile_i + 8
-    tile_sequence = tile_sequence[:visible_tiles]
-
-    strip_w = len(tile_sequence) * tile_w
-    strip = Image.new("RGBA", (strip_w, avatar_size), (0, 0, 0, 0))
+        winner_tile_i = next(
+            (
+                i
+                for i in range(cycle_start, len(tile_sequence))
+                if tile_sequence[i] == winner_idx
+                and tile_w * i + tile_w // 2 > min_end_pixel
+            ),
+            None,
+        )
 
-    for i, pidx in enumerate(tile_sequence):
-        x = i * tile_w
-        tile = _draw_avatar_tile(players[pidx].image, tile_w)
-        strip.paste(tile, (x, 0))
+    final_offset = tile_w * winner_tile_i + tile_w // 2 - marker_x
 
-    return strip, final_offset
+    # Keep the reel up to winner_tile_i + a few extra tiles for safety
+    return tile_sequence[: winner_tile_i + 8], final_offset
 
 
 # ── Frame renderer ────────────────────────────────────────────────────────────
 
 
 def _render_frame(
-    strip: Image.Image,
+    tiles: List[Image.Image],
+    tile_sequence: List[int],
     offset: int,
     canvas_w: int,
     avatar_size: int,
     marker_x: int,
-    marker_color: tuple = (255, 215, 0, 255),
+    marker_color: tuple = MARKER_COLOR,
     marker_thickness: int = 3,
 ) -> Image.Image:
     frame = Image.new("RGBA", (canvas_w, avatar_size), (0, 0, 0, 0))
 
-    strip_w = strip.width
-    x_in_strip = max(0, min(offset, strip_w - 1))
-    visible_end = x_in_strip + canvas_w
-
-    if visible_end <= strip_w:
-        region = strip.crop((x_in_strip, 0, visible_end, avatar_size))
-        frame.paste(region, (0, 0))
-    else:
-        part1 = strip.crop((x_in_strip, 0, strip_w, avatar_size))
-        frame.paste(part1, (0, 0))
+    # Only the tiles under the canvas are drawn, each cut off where it leaves it.
+    tile_w = tiles[0].width
+    reel_w = len(tile_sequence) * tile_w
+    x_in_reel = max(0, min(offset, reel_w - 1))
+    first_tile = x_in_reel // tile_w
+    end_tile = min(len(tile_sequence), -(-(x_in_reel + canvas_w) // tile_w))
+    for i in range(first_tile, end_tile):
+        frame.paste(tiles[tile_sequence[i]], (i * tile_w - x_in_reel, 0))
 
     draw = ImageDraw.Draw(frame)
     for dx in range(-marker_thickness // 2, marker_thickness // 2 + 1):
@@ -133,7 +122,7 @@ def _render_frame(
 # ── GIF assembler ─────────────────────────────────────────────────────────────
 
 
-def _build_gif(
+def _render_frames(
     players: List[Player],
     winner_idx: int,
     *,
@@ -141,25 +130,23 @@ def _build_gif(
     tile_w: int,
     canvas_w: int,
     total_ms: int,
-    frame_ms: int,
-    hold_ms: int,
-) -> io.BytesIO:
-    for p in players:
-        p.image = _prepare_avatar(p.image, avatar_size)
-
+    frames: int,
+) -> Iterator[Image.Image]:
+    """
+    Renders the reel's frames one at a time, as they're consumed.
+    """
     marker_x = canvas_w // 2
-    frames = max(2, total_ms // frame_ms)
 
     total_distance = int((total_ms / 1000) * 800 * tile_w / 112)
 
-    strip, final_offset = _build_strip(
+    tile_sequence, final_offset = _build_reel(
         players,
-        avatar_size,
         tile_w,
         total_distance,
         marker_x,
         winner_idx,
     )
+    tiles = [_draw_avatar_tile(p.image, tile_w) for p in players]
 
     # Two-phase animation:
     # Phase 1 (0 to split): constant full speed
@@ -180,28 +167,48 @@ def _build_gif(
             t2 = (t - split) / (1 - split)
             return int(cruise_end + ease_out(t2) * decel_distance)
 
-    offsets = [offset_at(i) for i in range(frames)]
+    for i in range(frames):
+        yield _render_frame(
+            tiles, tile_sequence, offset_at(i), canvas_w, avatar_size, marker_x
+        )
 
-    gif_frames = [
-        _render_frame(strip, off, canvas_w, avatar_size, marker_x) for off in offsets
-    ]
 
-    # Hold the final frame
-    durations = [frame_ms] * len(gif_frames) + [hold_ms]
-    gif_frames.append(gif_frames[-1])
+def _build_gif(
+    players: List[Player],
+    winner_idx: int,
+    *,
+    avatar_size: int,
+    tile_w: int,
+    canvas_w: int,
+    total_ms: int,
+    frame_ms: int,
+    hold_ms: int,
+) -> bytes:
+    frames = max(2, total_ms // frame_ms)
 
-    output = io.BytesIO()
-    gif_frames[0].save(
-        output,
-        format="GIF",
-        save_all=True,
-        append_images=gif_frames[1:],
+    def gif_frames() -> Iterator[Image.Image]:
+        for frame in _render_frames(
+            players,
+            winner_idx,
+            avatar_size=avatar_size,
+            tile_w=tile_w,
+            canvas_w=canvas_w,
+            total_ms=total_ms,
+            frames=frames,
+        ):
+            yield frame
+        # Hold the final frame
+        yield frame
+
+    durations = [frame_ms] * frames + [hold_ms]
+
+    return encode_gif(
+        gif_frames(),
+        build_palette([p.image for p in players], [MARKER_COLOR, (0, 0, 0, 255)]),
         duration=durations,
         loop=0,  # play once
         disposal=2,
     )
-    output.seek(0)
-    return output
 
 
 # ── Public API ────────────────────────────────────────────────────────────────
@@ -217,7 +224,7 @@ async def create_jackpot_gif(
     total_ms: int = 4000,
     frame_ms: int = 40,
     hold_ms: int = 2000,
-) -> io.BytesIO:
+) -> bytes:
     """
     Animate a CSGO-style horizontal jackpot reel and return a GIF.
 
@@ -233,11 +240,9 @@ async def create_jackpot_gif(
     """
     winner_idx = next((i for i, p in enumerate(players) if p.url == winner_url), 0)
 
-    timeout = aiohttp.ClientTimeout(total=15)
-    headers = {"User-Agent": "sail-credit/1.0"}
-
-    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-        images = await asyncio.gather(*[fetch_image(session, p.url) for p in players])
+    images = await asyncio.gather(
+        *[avatar_cache.get(p.url, avatar_size) for p in players]
+    )
 
     for player, image in zip(players, images):
         player.image = image
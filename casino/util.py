@@ -6,6 +6,8 @@ import random
 from PIL import Image
 import aiohttp
 
+from http_client import http_client
+
 
 def get_log_source(game: str, log_type: Literal["DEBIT", "CREDIT"]):
     return game.replace(" ", "_").upper() + "_" + log_type
@@ -36,12 +38,10 @@ def mult_to_emoji(mult: float):
         return "🪦"
 
 
-async def fetch_image(
-    session: aiohttp.ClientSession, url: str, max_retries: int = 3
-) -> Image:
+async def fetch_image(url: str, max_retries: int = 3) -> Image:
     for attempt in range(max_retries + 1):
         try:
-            async with session.get(url) as response:
+            async with http_client.session.get(url) as response:
                 response.raise_for_status()
                 content = await response.read()
             return Image.open(io.BytesIO(content)).convert("RGBA")
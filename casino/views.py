@@ -1,14 +1,14 @@
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Callable, Optional
 
 import discord
 from casino.consts import MIN_BET_AMOUNT
 from casino.models import DegenerateGambler
 from casino.util import get_log_source
 import db
-from util import user_interaction_callback, get_balance
+from util import edit_scheduler, user_interaction_callback, get_balance
 
 if TYPE_CHECKING:
-    from casino.casino import CasinoLobby
+    from casino.casino import CasinoLobby, CasinoPitboss
 
 
 class BetModal(discord.ui.Modal):
@@ -50,22 +50,35 @@ class BetModal(discord.ui.Modal):
 
 
 class CasinoLobbyView(discord.ui.View):
-    def __init__(self, lobby: "CasinoLobby"):
-        super().__init__(timeout=lobby.game.lobby_time)
+    def __init__(
+        self,
+        lobby: "CasinoLobby",
+        pitboss: "CasinoPitboss",
+        timeout: Optional[float],
+    ):
+        super().__init__(timeout=timeout)
         self.lobby = lobby
+        self.pitboss = pitboss
+
+        # Custom IDs are derived from the lobby, so a restored lobby's view picks up
+        # the buttons on its existing message.
+        def custom_id(action: str) -> str:
+            return f"casino:{lobby.uuid}:{action}"
 
         if lobby.game.bet_config.bet_type == "freeform":
             bet_button = discord.ui.Button(
-                label="Place bet", style=discord.ButtonStyle.blurple
+                label="Place bet",
+                style=discord.ButtonStyle.blurple,
+                custom_id=custom_id("bet"),
             )
             bet_10_button = discord.ui.Button(
-                label="10", style=discord.ButtonStyle.green
+                label="10", style=discord.ButtonStyle.green, custom_id=custom_id("10")
             )
             bet_100_button = discord.ui.Button(
-                label="100", style=discord.ButtonStyle.green
+                label="100", style=discord.ButtonStyle.green, custom_id=custom_id("100")
             )
             bet_250_button = discord.ui.Button(
-                label="250", style=discord.ButtonStyle.green
+                label="250", style=discord.ButtonStyle.green, custom_id=custom_id("250")
             )
             bet_button.callback = self.place_bet
             bet_10_button.callback = self.bet_10
@@ -82,6 +95,7 @@ class CasinoLobbyView(discord.ui.View):
             fixed_bet_button = discord.ui.Button(
                 label=f"Join ({lobby.game.bet_config.fixed_bet_amount} SSC)",
                 style=discord.ButtonStyle.blurple,
+                custom_id=custom_id("join"),
             )
             fixed_bet_button.callback = self.fixed_bet
             self.add_item(fixed_bet_button)
@@ -133,9 +147,16 @@ class CasinoLobbyView(discord.ui.View):
             return
 
         source = get_log_source(self.lobby.game.canonical_name, "DEBIT")
-        await db.change_and_log_sail_credit(
-            user_id, -1, -1, -1, old_ssc, old_ssc - bet_amount, source
-        )
+        try:
+            await db.apply_sail_credit_delta(
+                user_id, -bet_amount, source, require_funds=True
+            )
+        except db.InsufficientFundsError:
+            # The balance was spent since it was checked, like by another bet.
+            await interaction.response.send_message(
+                "You don't have enough SSC to bet!", ephemeral=True
+            )
+            return
 
         if casino_member:
             casino_member.bet_amount += bet_amount
@@ -145,8 +166,14 @@ class CasinoLobbyView(discord.ui.View):
                     user_id, bet_amount, interaction.user.display_avatar.url
                 )
             )
+        self.pitboss.save_lobby(self.lobby)
 
-        await interaction.response.edit_message(embed=self.lobby.generate_embed())
+        # Bets come in bursts right after a lobby opens, so the lobby message is edited
+        # through the scheduler, which merges them into a couple of edits.
+        await interaction.response.defer()
+        await edit_scheduler.edit(
+            self.lobby.interaction, embed=self.lobby.generate_embed()
+        )
 
     @user_interaction_callback()
     async def place_bet(self, interaction: discord.Interaction):
@@ -0,0 +1,114 @@
+import io
+import math
+from datetime import datetime, timezone
+from typing import List, Sequence, Tuple
+
+from PIL import Image, ImageDraw
+
+# Rendered at 2x so the chart stays sharp when Discord scales it down.
+WIDTH = 1000
+HEIGHT = 600
+
+# Space around the plot for the title and axis labels.
+MARGIN_LEFT = 100
+MARGIN_RIGHT = 80
+MARGIN_TOP = 70
+MARGIN_BOTTOM = 80
+
+BACKGROUND = (255, 255, 255)
+GRID = (228, 228, 228)
+AXIS = (110, 110, 110)
+TEXT = (60, 60, 60)
+LINE = (54, 162, 235)
+
+MAX_Y_TICKS = 8
+MAX_X_TICKS = 6
+
+
+def _nice_step(span: float, max_ticks: int) -> int:
+    """
+    Returns a whole number tick step of 1, 2 or 5 times a power of ten, that splits
+    span into at most max_ticks intervals.
+    """
+    raw_step = max(span / max_ticks, 1)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for multiple in (1, 2, 5, 10):
+        if multiple * magnitude >= raw_step:
+            return int(multiple * magnitude)
+
+
+def _y_ticks(low: int, high: int) -> List[int]:
+    step = _nice_step(high - low, MAX_Y_TICKS)
+    start = math.floor(low / step) * step
+    end = math.ceil(high / step) * step
+    if start == end:
+        start, end = start - step, end + step
+    return list(range(start, end + 1, step))
+
+
+def render_ssc_chart(title: str, points: Sequence[Tuple[int, int]]) -> bytes:
+    """
+    Renders a line chart of (timestamp, SSC) points, in time order, to PNG bytes.
+    This is CPU bound, so run it in a worker thread from async code.
+    """
+    image = Image.new("RGB", (WIDTH, HEIGHT), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    draw.text((WIDTH / 2, MARGIN_TOP / 2), title, fill=TEXT, anchor="mm", font_size=28)
+
+    left, top = MARGIN_LEFT, MARGIN_TOP
+    right, bottom = WIDTH - MARGIN_RIGHT, HEIGHT - MARGIN_BOTTOM
+
+    if not points:
+        draw.rectangle((left, top, right, bottom), outline=AXIS, width=2)
+        draw.text(
+            ((left + right) / 2, (top + bottom) / 2),
+            "No SSC history in this period.",
+            fill=TEXT,
+            anchor="mm",
+            font_size=24,
+        )
+        return _to_png(image)
+
+    first_time, last_time = points[0][0], points[-1][0]
+    if first_time == last_time:
+        first_time, last_time = first_time - 60 * 30, last_time + 60 * 30
+    y_ticks = _y_ticks(min(ssc for _, ssc in points), max(ssc for _, ssc in points))
+
+    def to_x(timestamp: int) -> float:
+        return left + (timestamp - first_time) / (last_time - first_time) * (
+            right - left
+        )
+
+    def to_y(ssc: int) -> float:
+        return bottom - (ssc - y_ticks[0]) / (y_ticks[-1] - y_ticks[0]) * (bottom - top)
+
+    for tick in y_ticks:
+        y = to_y(tick)
+        draw.line((left, y, right, y), fill=GRID, width=2)
+        draw.text((left - 12, y), str(tick), fill=TEXT, anchor="rm", font_size=20)
+
+    for i in range(MAX_X_TICKS + 1):
+        timestamp = first_time + (last_time - first_time) * i / MAX_X_TICKS
+        x = to_x(timestamp)
+        draw.line((x, top, x, bottom), fill=GRID, width=2)
+        label = datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime(
+            "%b %d %H:%M"
+        )
+        draw.text((x, bottom + 12), label, fill=TEXT, anchor="mt", font_size=18)
+
+    draw.line((left, top, left, bottom, right, bottom), fill=AXIS, width=2)
+
+    line = [(to_x(timestamp), to_y(ssc)) for timestamp, ssc in points]
+    if len(line) == 1:
+        x, y = line[0]
+        draw.ellipse((x - 4, y - 4, x + 4, y + 4), fill=LINE)
+    else:
+        draw.line(line, fill=LINE, width=4, joint="curve")
+
+    return _to_png(image)
+
+
+def _to_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -1,14 +1,114 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime, timezone
+import logging
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 import aiosqlite
 
+from cache import LRUCache
+from flake_window import FLAKE_WINDOW, FlakeWindow
+from leaderboard import Leaderboard
 import party
 import json
 
+log = logging.getLogger(__name__)
+
 db = None
 
+# Users rows by discord id. Every write to a user's balance goes through this module
+# and updates the cache, so hits never need to touch the database.
+USER_CACHE_SIZE = 10_000
+user_cache = LRUCache(USER_CACHE_SIZE)
+
+# Every user ranked by balance, kept in sync with the users table the same way as the
+# user cache. Loaded once at startup with load_leaderboard().
+leaderboard = Leaderboard()
+
+# The days each user flaked on a party, kept in sync as flakes are logged. Loaded at
+# startup with load_flake_window().
+flake_window = FlakeWindow()
+
+# Pragmas applied to every connection. WAL lets readers proceed while the ledger is
+# being written, and synchronous=NORMAL only fsyncs the WAL at checkpoints, which
+# is still durable against application crashes.
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",  # 16 MB
+    "PRAGMA mmap_size = 134217728",  # 128 MB
+]
+
+# How long ledger writes are allowed to queue up before being flushed, in seconds.
+GROUP_COMMIT_WINDOW = 0.001
+
+# Flush immediately once this many ledger writes are waiting.
+GROUP_COMMIT_MAX_BATCH = 64
+
+
+@dataclass
+class LedgerWrite:
+    """
+    A single ledger entry and balance change. Either `delta` is applied to the
+    balance in SQL (optionally floored at `min_ssc`), or the balance is set from
+    `old_ssc` to `new_ssc` as given. With `require_funds`, a debit is only applied if
+    the balance covers it, and otherwise its call fails with InsufficientFundsError.
+    """
+
+    discord_id: int
+    source: str = "PARTY"
+    delta: Optional[int] = None
+    min_ssc: Optional[int] = None
+    require_funds: bool = False
+    old_ssc: Optional[int] = None
+    new_ssc: Optional[int] = None
+    party_size: int = -1
+    party_created_at: int = -1
+    party_finished_at: int = -1
+    timestamp: Optional[int] = None
+
+
+class InsufficientFundsError(Exception):
+    """
+    Raised for ledger writes with `require_funds` when the balance can't cover the
+    debit. None of the call's writes are applied.
+    """
+
+
+# Ledger writes waiting to be flushed. Each call's writes are queued together with
+# the future its caller awaits, and always land in the same transaction.
+_pending_writes: deque[Tuple[List[LedgerWrite], asyncio.Future]] = deque()
+_pending_write_count = 0
+_flush_handle: Optional[asyncio.TimerHandle] = None
+_flushing = False
+# Running flush tasks. The loop only keeps weak references to tasks, so they're held
+# here until they finish.
+_flush_tasks: Set[asyncio.Task] = set()
+
+# Held by every write to the connection from its first statement until it's committed
+# or rolled back. The connection has a single transaction, so without it one writer's
+# commit could make another's half-done statements durable, and a rollback could
+# discard another writer's statements.
+_write_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def _write_transaction():
+    """
+    Holds the write lock while writing, and rolls back the writer's statements if it
+    fails before committing.
+    """
+    async with _write_lock:
+        try:
+            yield
+        except Exception:
+            await db.rollback()
+            raise
+
 
 def dict_factory(cursor, row):
     d = {}
@@ -17,35 +117,49 @@ def dict_factory(cursor, row):
     return d
 
 
-async def init():
-    global db
-    db = await aiosqlite.connect("sail_credit.db", timeout=5)
+async def init(path: str = "sail_credit.db"):
+    global db, _write_lock
+    db = await aiosqlite.connect(path, timeout=5)
+    # Locks belong to the event loop they're first waited on in.
+    _write_lock = asyncio.Lock()
     db.row_factory = dict_factory
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
 
 
 async def cleanup():
     global db
     if db and db.is_alive():
+        await flush_pending_writes()
         await db.close()
 
 
 async def run_migrations():
     with open("migrations.sql", "r") as f:
         script = f.read()
-    await db.executescript(script)
-    await db.commit()
+    async with _write_transaction():
+        await db.executescript(script)
+        await db.commit()
 
 
 async def create_user(discord_id: int) -> Dict[str, Any]:
-    await db.execute(
-        f"INSERT INTO users (discord_id, sail_credit) VALUES (?, {party.STARTING_SSC})",
-        (discord_id,),
-    )
-    await db.commit()
-    return {"discord_id": discord_id, "sail_credit": party.STARTING_SSC}
+    async with _write_transaction():
+        await db.execute(
+            f"INSERT INTO users (discord_id, sail_credit) VALUES (?, {party.STARTING_SSC})",
+            (discord_id,),
+        )
+        await db.commit()
+    user = {"discord_id": discord_id, "sail_credit": party.STARTING_SSC}
+    user_cache.put(discord_id, user)
+    leaderboard.update(discord_id, party.STARTING_SSC)
+    return user
 
 
 async def get_user(discord_id: int) -> Optional[Dict[str, Any]]:
+    user = user_cache.get(discord_id)
+    if user:
+        return user
+
     async with db.execute(
         "SELECT * FROM users WHERE discord_id = ?", (discord_id,)
     ) as cursor:
@@ -53,15 +167,33 @@ async def get_user(discord_id: int) -> Optional[Dict[str, Any]]:
         if not row:
             return None
 
+        # A write that committed while this was being read has already cached a
+        # newer balance, so don't overwrite it.
+        if discord_id not in user_cache:
+            user_cache.put(discord_id, row)
         return row
 
 
 async def set_user(discord_id: int, sail_credit: int) -> None:
-    await db.execute(
-        "UPDATE users SET sail_credit = ? WHERE discord_id = ?",
-        (sail_credit, discord_id),
-    )
-    await db.commit()
+    async with _write_transaction():
+        await db.execute(
+            "UPDATE users SET sail_credit = ? WHERE discord_id = ?",
+            (sail_credit, discord_id),
+        )
+        await db.commit()
+    _cache_balance(discord_id, sail_credit)
+
+
+def _cache_balance(discord_id: int, sail_credit: int) -> None:
+    # Cached rows may be held by callers, so replace rather than mutate them.
+    user = user_cache.pop(discord_id)
+    if user:
+        user_cache.put(discord_id, {**user, "sail_credit": sail_credit})
+    leaderboard.update(discord_id, sail_credit)
+
+
+def get_user_cache_stats() -> Dict[str, int]:
+    return user_cache.stats()
 
 
 async def get_user_sail_credit_log(
@@ -72,7 +204,8 @@ async def get_user_sail_credit_log(
     if source:
         source_clause = "AND source = ?"
     async with db.execute(
-        f"SELECT * FROM sail_credit_log WHERE discord_id = ? AND timestamp > ? {source_clause} ORDER BY timestamp DESC",
+        "SELECT discord_id, source, timestamp, prev_sail_credit, new_sail_credit FROM sail_credit_log "
+        f"WHERE discord_id = ? AND timestamp > ? {source_clause} ORDER BY timestamp DESC",
         (
             (discord_id, start_timestamp)
             if not source
@@ -83,6 +216,71 @@ async def get_user_sail_credit_log(
         return rows
 
 
+async def get_user_sail_credit_log_buckets(
+    discord_id: int, start_timestamp: int, end_timestamp: int, buckets: int
+) -> List[Dict[str, Any]]:
+    """
+    Splits the time between start_timestamp and end_timestamp into equal buckets, and
+    returns the lowest, highest and last balance logged in each, in time order. This
+    keeps the shape of a user's history while returning O(buckets) rows.
+    """
+    # With a single MIN or MAX aggregate, SQLite takes the other column from the row
+    # holding the min or max.
+    async with db.execute(
+        "WITH bucketed AS (SELECT timestamp, new_sail_credit, "
+        "(timestamp - :start) * :buckets / :span AS bucket FROM sail_credit_log "
+        "WHERE discord_id = :discord_id AND timestamp > :start) "
+        "SELECT timestamp, MIN(new_sail_credit) AS new_sail_credit FROM bucketed "
+        "GROUP BY bucket "
+        "UNION SELECT timestamp, MAX(new_sail_credit) FROM bucketed GROUP BY bucket "
+        "UNION SELECT MAX(timestamp), new_sail_credit FROM bucketed GROUP BY bucket "
+        "ORDER BY timestamp",
+        {
+            "discord_id": discord_id,
+            "start": start_timestamp,
+            "buckets": buckets,
+            "span": max(1, end_timestamp - start_timestamp),
+        },
+    ) as cursor:
+        rows = await cursor.fetchall()
+        return rows
+
+
+async def get_user_sail_credit_log_span(
+    discord_id: int, start_timestamp: int
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Returns the timestamps of the user's first and last logs after start_timestamp.
+    """
+    async with db.execute(
+        "SELECT (SELECT MIN(timestamp) FROM sail_credit_log "
+        "WHERE discord_id = ? AND timestamp > ?) AS first_timestamp, "
+        "(SELECT MAX(timestamp) FROM sail_credit_log "
+        "WHERE discord_id = ? AND timestamp > ?) AS last_timestamp",
+        (discord_id, start_timestamp, discord_id, start_timestamp),
+    ) as cursor:
+        row = await cursor.fetchone()
+        return row["first_timestamp"], row["last_timestamp"]
+
+
+async def get_users_with_log_count(
+    discord_ids: List[int], start_timestamp: int, source: str
+) -> List[Dict[str, Any]]:
+    """
+    Returns the users rows, each with a log_count of their logs from the source since
+    start_timestamp, in one query.
+    """
+    async with db.execute(
+        "SELECT discord_id, sail_credit, (SELECT COUNT(*) FROM sail_credit_log "
+        "WHERE sail_credit_log.discord_id = users.discord_id AND source = ? "
+        "AND timestamp > ?) AS log_count FROM users "
+        f"WHERE discord_id IN ({', '.join('?' * len(discord_ids))})",
+        (source, start_timestamp, *discord_ids),
+    ) as cursor:
+        rows = await cursor.fetchall()
+        return rows
+
+
 async def change_and_log_sail_credit(
     discord_id: int,
     party_size: int,
@@ -93,34 +291,336 @@ async def change_and_log_sail_credit(
     source: str = "PARTY",
     timestamp: Optional[int] = None,
 ) -> None:
-    if not timestamp:
-        timestamp = int(time.time())
-    await db.execute(
-        "INSERT INTO sail_credit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            discord_id,
-            party_size,
-            party_created_at,
-            party_finished_at,
-            old_ssc,
-            new_ssc,
-            source,
-            timestamp,
-        ),
+    """
+    Sets the user's balance from old_ssc to new_ssc and logs it. Prefer
+    apply_sail_credit_delta for settlements, since this overwrites any change made
+    between reading old_ssc and writing.
+    """
+    await write_ledger(
+        [
+            LedgerWrite(
+                discord_id=discord_id,
+                source=source,
+                old_ssc=old_ssc,
+                new_ssc=new_ssc,
+                party_size=party_size,
+                party_created_at=party_created_at,
+                party_finished_at=party_finished_at,
+                timestamp=timestamp,
+            )
+        ]
     )
-    await db.execute(
-        "UPDATE users SET sail_credit = ? WHERE discord_id = ?", (new_ssc, discord_id)
+
+
+async def apply_sail_credit_delta(
+    discord_id: int,
+    delta: int,
+    source: str = "PARTY",
+    party_size: int = -1,
+    party_created_at: int = -1,
+    party_finished_at: int = -1,
+    timestamp: Optional[int] = None,
+    min_ssc: Optional[int] = None,
+    require_funds: bool = False,
+) -> Tuple[int, int]:
+    """
+    Adds delta to the user's balance in SQL and logs it. If min_ssc is given, the new
+    balance is floored at it. If require_funds is set, raises InsufficientFundsError
+    instead of debiting more than the balance. Returns the user's balance before and
+    after the change.
+    """
+    results = await write_ledger(
+        [
+            LedgerWrite(
+                discord_id=discord_id,
+                source=source,
+                delta=delta,
+                min_ssc=min_ssc,
+                require_funds=require_funds,
+                party_size=party_size,
+                party_created_at=party_created_at,
+                party_finished_at=party_finished_at,
+                timestamp=timestamp,
+            )
+        ]
     )
-    await db.commit()
+    return results[0]
 
 
-async def log_convict_reason(discord_id: int, reason: str) -> None:
+async def write_ledger(writes: List[LedgerWrite]) -> List[Tuple[int, int]]:
+    """
+    Queues the writes to be group committed in a single transaction, and returns each
+    write's balance before and after once that transaction has been committed.
+    """
     now = int(time.time())
-    await db.execute(
-        "INSERT INTO conviction_log VALUES (?, ?, ?)", (discord_id, reason, now)
+    for write in writes:
+        if not write.timestamp:
+            write.timestamp = now
+
+    global _pending_write_count
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending_writes.append((writes, future))
+    _pending_write_count += len(writes)
+    _schedule_flush(loop)
+    return await future
+
+
+def _schedule_flush(loop: asyncio.AbstractEventLoop) -> None:
+    global _flush_handle
+
+    # A running flush picks up anything queued while it was committing.
+    if _flushing:
+        return
+
+    if _pending_write_count >= GROUP_COMMIT_MAX_BATCH:
+        if _flush_handle:
+            _flush_handle.cancel()
+            _flush_handle = None
+        _start_flush(loop)
+    elif not _flush_handle:
+        _flush_handle = loop.call_later(GROUP_COMMIT_WINDOW, _start_flush, loop)
+
+
+def _start_flush(loop: asyncio.AbstractEventLoop) -> None:
+    task = loop.create_task(flush_pending_writes())
+    _flush_tasks.add(task)
+    task.add_done_callback(_flush_done)
+
+
+def _flush_done(task: asyncio.Task) -> None:
+    _flush_tasks.discard(task)
+    # Failed batches are reported to their callers, so this is only reached if the
+    # flush itself broke.
+    if not task.cancelled() and task.exception():
+        log.error("Failed to flush ledger writes", exc_info=task.exception())
+
+
+def _ledger_write_statements(write: LedgerWrite) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Returns the statements for a ledger write. The log row is inserted first,
+    returning the balance before and after, and the user's balance is then set from
+    that row. Daily rewards also update the user's daily streak.
+    """
+    params = {
+        "discord_id": write.discord_id,
+        "party_size": write.party_size,
+        "party_created_at": write.party_created_at,
+        "party_finished_at": write.party_finished_at,
+        "source": write.source,
+        "timestamp": write.timestamp,
+    }
+
+    if write.delta is None:
+        params["old_ssc"] = write.old_ssc
+        params["new_ssc"] = write.new_ssc
+        insert = (
+            "INSERT INTO sail_credit_log VALUES (:discord_id, :party_size, :party_created_at, "
+            ":party_finished_at, :old_ssc, :new_ssc, :source, :timestamp) "
+            "RETURNING prev_sail_credit, new_sail_credit"
+        )
+    else:
+        # The new balance is derived from the current balance in SQL, so concurrent
+        # changes to the same user can't be lost between reading and writing it.
+        params["delta"] = write.delta
+        new_ssc = "sail_credit + :delta"
+        if write.min_ssc is not None:
+            params["min_ssc"] = write.min_ssc
+            new_ssc = f"MAX(:min_ssc, {new_ssc})"
+        funds = ""
+        if write.require_funds:
+            # Nothing is logged if the balance can't cover the debit.
+            params["amount"] = -write.delta
+            funds = " AND sail_credit >= :amount"
+
+        insert = (
+            "INSERT INTO sail_credit_log SELECT discord_id, :party_size, :party_created_at, "
+            f":party_finished_at, sail_credit, {new_ssc}, :source, :timestamp "
+            f"FROM users WHERE discord_id = :discord_id{funds} "
+            "RETURNING prev_sail_credit, new_sail_credit"
+        )
+
+    update = (
+        "UPDATE users SET sail_credit = (SELECT new_sail_credit FROM sail_credit_log "
+        "WHERE rowid = last_insert_rowid()) WHERE discord_id = :discord_id"
     )
+    if write.require_funds:
+        # changes() is the number of rows the insert logged, and without one the last
+        # inserted row belongs to an earlier write.
+        update += " AND changes() > 0"
+    statements = [(insert, params), (update, {"discord_id": write.discord_id})]
+
+    if write.source == "DAILY_SSC":
+        # Extends the user's streak if their last claim was the previous day, and
+        # restarts it otherwise. Claims older than the last one are ignored.
+        streak = (
+            "INSERT INTO daily_streaks VALUES (:discord_id, 1, :reset) "
+            "ON CONFLICT (discord_id) DO UPDATE SET current_streak = CASE "
+            "WHEN excluded.last_reset = last_reset THEN current_streak "
+            "WHEN excluded.last_reset = last_reset + 86400 THEN current_streak + 1 "
+            "ELSE 1 END, last_reset = excluded.last_reset "
+            "WHERE excluded.last_reset >= last_reset"
+        )
+        statements.append(
+            (
+                streak,
+                {
+                    "discord_id": write.discord_id,
+                    "reset": int(get_reset_time(write.timestamp)),
+                },
+            )
+        )
+
+    return statements
+
+
+async def flush_pending_writes() -> None:
+    """
+    Commits all queued ledger writes, about GROUP_COMMIT_MAX_BATCH at a time, and
+    resolves the callers waiting on them.
+    """
+    global _flush_handle, _flushing, _pending_write_count
+
+    if _flush_handle:
+        _flush_handle.cancel()
+        _flush_handle = None
+
+    if _flushing:
+        return
+
+    _flushing = True
+    try:
+        while _pending_writes:
+            batch = []
+            batch_size = 0
+            while _pending_writes and batch_size < GROUP_COMMIT_MAX_BATCH:
+                writes, future = _pending_writes.popleft()
+                batch.append((writes, future))
+                batch_size += len(writes)
+            _pending_write_count -= batch_size
+
+            try:
+                async with _write_transaction():
+                    await _commit_ledger_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    finally:
+        _flushing = False
+
+
+async def _commit_ledger_batch(
+    batch: List[Tuple[List[LedgerWrite], asyncio.Future]]
+) -> None:
+    # Calls writing to unknown users are failed up front, so the rest of the batch
+    # can be committed without them. Cached users are known to exist.
+    user_ids = {write.discord_id for writes, _ in batch for write in writes}
+    existing_ids = {user_id for user_id in user_ids if user_id in user_cache}
+    uncached_ids = list(user_ids - existing_ids)
+    if uncached_ids:
+        rows = await db.execute_fetchall(
+            f"SELECT discord_id FROM users WHERE discord_id IN ({', '.join('?' * len(uncached_ids))})",
+            uncached_ids,
+        )
+        existing_ids.update(row["discord_id"] for row in rows)
+
+    committed = []
+    for writes, future in batch:
+        missing_ids = {w.discord_id for w in writes} - existing_ids
+        if missing_ids:
+            future.set_exception(ValueError(f"Users {missing_ids} do not exist."))
+        else:
+            committed.append((writes, future))
+
+    # Statements are queued on the connection as they're listed, so runs of them
+    # execute back to back on the database thread. Tasks start in creation order, so
+    # the statements execute in the order they're listed.
+    queued = []
+    returned = []
+
+    def queue(sql: str, params: Optional[Dict[str, Any]] = None) -> None:
+        queued.append(db.execute_fetchall(sql, params))
+
+    async def run_queued() -> None:
+        # Waits for every statement, even after one fails, so the rollback undoes all
+        # of them rather than running before the rest.
+        returned.extend(await asyncio.gather(*queued, return_exceptions=True))
+        queued.clear()
+        for result in returned:
+            if isinstance(result, Exception):
+                raise result
+
+    # Opened explicitly, since releasing a savepoint outside a transaction commits it.
+    queue("BEGIN")
+    insert_indexes = []
+    unfunded = set()
+    for call_index, (writes, _) in enumerate(committed):
+        checks_funds = any(write.require_funds for write in writes)
+        if checks_funds:
+            queue("SAVEPOINT ledger_call")
+
+        call_insert_indexes = []
+        for write in writes:
+            call_insert_indexes.append(len(returned) + len(queued))
+            for sql, params in _ledger_write_statements(write):
+                queue(sql, params)
+        insert_indexes.extend(call_insert_indexes)
+
+        if checks_funds:
+            # A debit the balance can't cover logs nothing. The call's writes are then
+            # undone on their own, and the rest of the batch is still committed.
+            await run_queued()
+            if not all(returned[i] for i in call_insert_indexes):
+                queue("ROLLBACK TO ledger_call")
+                unfunded.add(call_index)
+            queue("RELEASE ledger_call")
+
+    await run_queued()
     await db.commit()
 
+    # Each write's first statement is the log insert, returning the balances.
+    balances = (returned[i] for i in insert_indexes)
+    for call_index, (writes, future) in enumerate(committed):
+        if call_index in unfunded:
+            for _ in writes:
+                next(balances)
+            if not future.done():
+                future.set_exception(
+                    InsufficientFundsError(
+                        f"Users {[w.discord_id for w in writes if w.require_funds]} "
+                        "can't cover their debits."
+                    )
+                )
+            continue
+
+        result = []
+        for write in writes:
+            row = next(balances)[0]
+            result.append((row["prev_sail_credit"], row["new_sail_credit"]))
+            user_cache.put(
+                write.discord_id,
+                {"discord_id": write.discord_id, "sail_credit": row["new_sail_credit"]},
+            )
+            leaderboard.update(write.discord_id, row["new_sail_credit"])
+            if (
+                write.source == "PARTY"
+                and row["new_sail_credit"] < row["prev_sail_credit"]
+            ):
+                flake_window.add(write.discord_id, write.timestamp)
+        if not future.done():
+            future.set_result(result)
+
+
+async def log_convict_reason(discord_id: int, reason: str) -> None:
+    now = int(time.time())
+    async with _write_transaction():
+        await db.execute(
+            "INSERT INTO conviction_log VALUES (?, ?, ?)", (discord_id, reason, now)
+        )
+        await db.commit()
+
 
 async def get_all_users() -> List[Dict[str, Any]]:
     async with db.execute("SELECT * FROM users") as cursor:
@@ -137,8 +637,39 @@ async def get_sail_credit_logs() -> List[Dict[str, Any]]:
 
 
 async def clear_sail_credit_logs() -> None:
-    await db.execute("DELETE FROM sail_credit_log")
-    await db.commit()
+    async with _write_transaction():
+        await db.execute("DELETE FROM sail_credit_log")
+        # Streaks are derived from the log, so they're rebuilt as it's rewritten.
+        await db.execute("DELETE FROM daily_streaks")
+        await db.commit()
+    flake_window.clear()
+
+
+async def rewrite_sail_credit_ledger(
+    logs: List[Tuple[int, int, int, int, int, int, str, int]],
+    balances: Dict[int, int],
+) -> None:
+    """
+    Replaces the entire ledger and the given users' balances in a single transaction,
+    then rebuilds everything derived from them. Log rows are in column order.
+    """
+    await flush_pending_writes()
+    async with _write_transaction():
+        await db.execute("DELETE FROM sail_credit_log")
+        await db.execute("DELETE FROM daily_streaks")
+        await db.executemany(
+            "INSERT INTO sail_credit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?)", logs
+        )
+        await db.executemany(
+            "UPDATE users SET sail_credit = ? WHERE discord_id = ?",
+            [(sail_credit, discord_id) for discord_id, sail_credit in balances.items()],
+        )
+        await db.commit()
+
+    user_cache.clear()
+    await load_leaderboard()
+    await backfill_daily_streaks()
+    await load_flake_window()
 
 
 async def get_ssc_leaderboard() -> List[Dict[str, Any]]:
@@ -149,6 +680,26 @@ async def get_ssc_leaderboard() -> List[Dict[str, Any]]:
         return rows
 
 
+async def load_leaderboard() -> None:
+    leaderboard.load(await get_ssc_leaderboard())
+
+
+async def load_flake_window() -> None:
+    """
+    Rebuilds the flake window from the flakes logged within FLAKE_WINDOW.
+    """
+    start_timestamp = int(time.time()) - FLAKE_WINDOW
+    async with db.execute(
+        "SELECT discord_id, timestamp FROM sail_credit_log "
+        "WHERE source = 'PARTY' AND new_sail_credit < prev_sail_credit "
+        "AND timestamp > ? ORDER BY timestamp",
+        (start_timestamp,),
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    flake_window.load((row["discord_id"], row["timestamp"]) for row in rows)
+
+
 async def get_conviction_log(discord_id: Optional[int] = None) -> List[Dict[str, Any]]:
     if not discord_id:
         async with db.execute(
@@ -166,13 +717,14 @@ async def get_conviction_log(discord_id: Optional[int] = None) -> List[Dict[str,
 
 
 async def update_role_image_url(role_id: int, image_url: Optional[str]) -> None:
-    if image_url is None:
-        await db.execute("DELETE FROM role_images WHERE role_id = ?", (role_id,))
-    else:
-        await db.execute(
-            "INSERT OR REPLACE INTO role_images VALUES (?, ?)", (role_id, image_url)
-        )
-    await db.commit()
+    async with _write_transaction():
+        if image_url is None:
+            await db.execute("DELETE FROM role_images WHERE role_id = ?", (role_id,))
+        else:
+            await db.execute(
+                "INSERT OR REPLACE INTO role_images VALUES (?, ?)", (role_id, image_url)
+            )
+        await db.commit()
 
 
 async def get_role_image_url(role_id: int) -> Optional[str]:
@@ -189,11 +741,12 @@ async def get_role_image_url(role_id: int) -> Optional[str]:
 async def create_casino_lobby_log(
     uuid: str, start_time: int, end_time: int, metadata: Dict[str, Any], game: str
 ):
-    await db.execute(
-        "INSERT INTO casino_lobby_log VALUES (?, ?, ?, ?, ?)",
-        (uuid, start_time, end_time, json.dumps(metadata).encode(), game),
-    )
-    await db.commit()
+    async with _write_transaction():
+        await db.execute(
+            "INSERT INTO casino_lobby_log VALUES (?, ?, ?, ?, ?)",
+            (uuid, start_time, end_time, json.dumps(metadata).encode(), game),
+        )
+        await db.commit()
 
 
 async def get_casino_lobby_logs(game: str, limit: int = 10) -> Dict:
@@ -205,14 +758,69 @@ async def get_casino_lobby_logs(game: str, limit: int = 10) -> Dict:
         return rows
 
 
+async def save_party_states(rows: List[Dict[str, Any]]) -> None:
+    async with _write_transaction():
+        await db.executemany(
+            "INSERT OR REPLACE INTO party_state VALUES "
+            "(:uuid, :guild_id, :role_id, :channel_id, :message_id, :start_time, "
+            ":expires_at, :state)",
+            [{**row, "state": json.dumps(row["state"]).encode()} for row in rows],
+        )
+        await db.commit()
+
+
+async def delete_party_states(uuids: List[str]) -> None:
+    async with _write_transaction():
+        await db.executemany(
+            "DELETE FROM party_state WHERE uuid = ?", [(uuid,) for uuid in uuids]
+        )
+        await db.commit()
+
+
+async def get_party_states() -> List[Dict[str, Any]]:
+    async with db.execute("SELECT * FROM party_state") as cursor:
+        rows = await cursor.fetchall()
+    for row in rows:
+        row["state"] = json.loads(row["state"])
+    return rows
+
+
+async def save_casino_lobby_states(rows: List[Dict[str, Any]]) -> None:
+    async with _write_transaction():
+        await db.executemany(
+            "INSERT OR REPLACE INTO casino_lobby_state VALUES "
+            "(:uuid, :game, :channel_id, :message_id, :start_time, :state)",
+            [{**row, "state": json.dumps(row["state"]).encode()} for row in rows],
+        )
+        await db.commit()
+
+
+async def delete_casino_lobby_states(uuids: List[str]) -> None:
+    async with _write_transaction():
+        await db.executemany(
+            "DELETE FROM casino_lobby_state WHERE uuid = ?", [(uuid,) for uuid in uuids]
+        )
+        await db.commit()
+
+
+async def get_casino_lobby_states() -> List[Dict[str, Any]]:
+    async with db.execute("SELECT * FROM casino_lobby_state") as cursor:
+        rows = await cursor.fetchall()
+    for row in rows:
+        row["state"] = json.loads(row["state"])
+    return rows
+
+
+# Daily rewards reset at 8:00 AM in this timezone.
+RESET_TIMEZONE = ZoneInfo("America/New_York")
+
+
 def get_reset_time(timestamp: int) -> int:
     """
     Returns the day's reset timestamp of the given timestamp.
     """
 
-    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc).astimezone(
-        ZoneInfo("America/New_York")
-    )
+    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc).astimezone(RESET_TIMEZONE)
     reset_time = dt.replace(hour=8, minute=0, second=0, microsecond=0)
     return reset_time.timestamp()
 
@@ -222,25 +830,59 @@ async def get_daily_reward_streak(user_id: int) -> int:
     To be called BEFORE registering today's daily reward.
     """
     async with db.execute(
-        "SELECT timestamp FROM sail_credit_log WHERE discord_id = ? AND source = ? ORDER BY timestamp DESC",
-        (user_id, "DAILY_SSC"),
+        "SELECT current_streak, last_reset FROM daily_streaks WHERE discord_id = ?",
+        (user_id,),
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if not row:
+        return 0
+
+    now = int(datetime.now(timezone.utc).timestamp())
+    expected_reset = int(get_reset_time(now)) - 86400  # yesterday's reset timestamp
+
+    # A claim already made today doesn't count towards the streak being rewarded.
+    if row["last_reset"] == expected_reset + 86400:
+        return row["current_streak"] - 1
+    if row["last_reset"] == expected_reset:
+        return row["current_streak"]
+    return 0
+
+
+async def backfill_daily_streaks() -> None:
+    """
+    Builds the daily streaks table from the logged daily rewards, if it hasn't been
+    built yet.
+    """
+    async with db.execute("SELECT 1 FROM daily_streaks LIMIT 1") as cursor:
+        if await cursor.fetchone():
+            return
+
+    async with db.execute(
+        "SELECT discord_id, timestamp FROM sail_credit_log WHERE source = ? "
+        "ORDER BY discord_id, timestamp",
+        ("DAILY_SSC",),
     ) as cursor:
         rows = await cursor.fetchall()
 
-        if not rows:
-            return 0
-
-        now = int(datetime.now(timezone.utc).timestamp())
-        expected_reset = int(get_reset_time(now)) - 86400  # yesterday's reset timestamp
-        streak = 0
-        for row in rows:
-            row_reset = int(get_reset_time(row["timestamp"]))
-            if row_reset > expected_reset:
-                continue  # skip duplicate entries
-            elif row_reset == expected_reset:
-                streak += 1
-                expected_reset -= 86400
-            else:
-                break
-
-        return streak
+    streaks = {}
+    for row in rows:
+        reset = int(get_reset_time(row["timestamp"]))
+        current_streak, last_reset = streaks.get(row["discord_id"], (0, None))
+        if reset == last_reset:
+            continue
+        elif last_reset is not None and reset == last_reset + 86400:
+            current_streak += 1
+        else:
+            current_streak = 1
+        streaks[row["discord_id"]] = (current_streak, reset)
+
+    async with _write_transaction():
+        await db.executemany(
+            "INSERT INTO daily_streaks VALUES (?, ?, ?)",
+            [
+                (discord_id, current_streak, last_reset)
+                for discord_id, (current_streak, last_reset) in streaks.items()
+            ],
+        )
+        await db.commit()
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import discord
+
+EditTarget = discord.Interaction | discord.PartialMessage
+
+# Discord allows about 5 edits every 5 seconds per channel, so by default a message is
+# edited at most once a second.
+MIN_EDIT_INTERVAL = 1.0
+
+
+@dataclass
+class PendingEdit:
+    target: EditTarget
+    fields: Dict[str, Any]
+    waiters: List[asyncio.Future] = field(default_factory=list)
+
+
+def message_key(target: EditTarget) -> int:
+    """
+    Returns the ID edits to the target are coalesced by. Component interactions edit
+    the message they're attached to, and a command's interaction edits its original
+    response.
+    """
+    if isinstance(target, discord.PartialMessage):
+        return target.id
+    if target.message is not None:
+        return target.message.id
+    return target.id
+
+
+class MessageEditScheduler:
+    """
+    Coalesces edits to the same message, so a burst of updates turns into a couple of
+    Discord API calls instead of one each.
+
+    Each message gets at most one edit in flight. Edits made while one is in flight or
+    waiting to be sent are merged into a single pending edit, where later values of a
+    field replace earlier ones, and sent once the message is allowed another edit.
+
+    discord.py waits out exhausted rate limit buckets before sending a request, so an
+    edit that takes longer than the interval means the bucket is saturated, and the
+    next edit to the message is held back for as long again.
+    """
+
+    def __init__(self, min_interval: float = MIN_EDIT_INTERVAL):
+        self.min_interval = min_interval
+        self._pending: Dict[int, PendingEdit] = {}
+        self._flushers: Dict[int, asyncio.Task] = {}
+
+    async def edit(self, target: EditTarget, **fields: Any) -> None:
+        """
+        Queues an edit to the target's message, with the same keyword arguments as
+        Message.edit, and waits until an edit including it was sent. Raises the
+        exception the edit failed with, if any.
+        """
+        key = message_key(target)
+        pending = self._pending.get(key)
+        if pending:
+            # The latest interaction's token is the one least likely to have expired.
+            pending.target = target
+            pending.fields.update(fields)
+        else:
+            pending = PendingEdit(target, dict(fields))
+            self._pending[key] = pending
+
+        waiter = asyncio.get_running_loop().create_future()
+        pending.waiters.append(waiter)
+        if key not in self._flushers:
+            self._flushers[key] = asyncio.create_task(self._flush(key))
+
+        await waiter
+
+    async def flush(self) -> None:
+        """
+        Waits until every pending edit was sent.
+        """
+        while self._flushers:
+            await asyncio.gather(*self._flushers.values(), return_exceptions=True)
+
+    async def _flush(self, key: int) -> None:
+        try:
+            while key in self._pending:
+                pending = self._pending.pop(key)
+                started = time.monotonic()
+                try:
+                    await _send(pending.target, pending.fields)
+                except Exception as e:
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+
+                elapsed = time.monotonic() - started
+                if elapsed > self.min_interval:
+                    await asyncio.sleep(elapsed)
+                else:
+                    await asyncio.sleep(self.min_interval - elapsed)
+        finally:
+            del self._flushers[key]
+
+
+async def _send(target: EditTarget, fields: Dict[str, Any]) -> None:
+    if isinstance(target, discord.PartialMessage):
+        await target.edit(**fields)
+    else:
+        await target.edit_original_response(**fields)
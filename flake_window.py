@@ -0,0 +1,67 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, Tuple
+
+# How far back we check for previous flake incidents, in seconds.
+FLAKE_WINDOW = 60 * 60 * 24 * 30  # 30 days
+
+
+def flake_day(timestamp: int) -> int:
+    """
+    Returns the timestamp rounded to the nearest day. Flakes on the same day only
+    count once.
+    """
+    base = 24 * 60 * 60
+    return base * round(timestamp / base)
+
+
+class FlakeWindow:
+    """
+    The days each user flaked on, for counting their flakes in the last
+    FLAKE_WINDOW seconds.
+
+    Each user has a queue of (day, latest flake timestamp that day) buckets in day
+    order. A day stops counting once its latest flake falls out of the window, so
+    buckets expire from the front as the window moves forward.
+    """
+
+    def __init__(self):
+        self._days: Dict[int, Deque[Tuple[int, int]]] = {}
+
+    def add(self, discord_id: int, timestamp: int) -> None:
+        day = flake_day(timestamp)
+        days = self._days.setdefault(discord_id, deque())
+
+        if days and days[-1][0] == day:
+            days[-1] = (day, max(days[-1][1], timestamp))
+        elif not days or days[-1][0] < day:
+            days.append((day, timestamp))
+        else:
+            # Flakes are almost always logged in order, but keep the queue sorted if
+            # an older one is backfilled.
+            buckets = {bucket_day: latest for bucket_day, latest in days}
+            buckets[day] = max(buckets.get(day, timestamp), timestamp)
+            self._days[discord_id] = deque(sorted(buckets.items()))
+
+    def count(self, discord_id: int, start_timestamp: int) -> int:
+        """
+        Returns how many days the user flaked on after start_timestamp. Days before it
+        are dropped, so start_timestamp shouldn't move backwards between calls.
+        """
+        days = self._days.get(discord_id)
+        if not days:
+            return 0
+
+        while days and days[0][1] <= start_timestamp:
+            days.popleft()
+        return len(days)
+
+    def load(self, flakes: Iterable[Tuple[int, int]]) -> None:
+        """
+        Replaces the window's contents with (discord_id, timestamp) flakes.
+        """
+        self._days = {}
+        for discord_id, timestamp in flakes:
+            self.add(discord_id, timestamp)
+
+    def clear(self) -> None:
+        self._days = {}
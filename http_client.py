@@ -0,0 +1,113 @@
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+import aiohttp
+
+# Connections kept open across the bot, and to any one host.
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 10
+# How long an idle connection is kept for reuse, in seconds.
+KEEPALIVE_TIMEOUT = 60
+REQUEST_TIMEOUT = 15
+
+USER_AGENT = "sail-credit/1.0"
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    @property
+    def average_time(self) -> float:
+        return self.total_time / self.requests if self.requests else 0.0
+
+
+class HttpClient:
+    """
+    The bot's HTTP client for everything but the Discord API, which discord.py handles.
+
+    Requests share one connection pool, so connections to the same host are kept alive
+    and reused instead of making a new TLS handshake per request. Every request is timed
+    per host.
+    """
+
+    def __init__(self):
+        self.hosts: Dict[str, HostStats] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The shared session, started if it isn't already.
+        """
+        if self._session is None or self._session.closed:
+            self.start()
+        return self._session
+
+    def start(self) -> None:
+        """
+        Starts the session, if it isn't running. Needs a running event loop.
+        """
+        if self._session is not None and not self._session.closed:
+            return
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=CONNECTION_LIMIT,
+                limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            headers={"User-Agent": USER_AGENT},
+            trace_configs=[trace_config],
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _on_request_start(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceRequestStartParams,
+    ) -> None:
+        context.started_at = time.perf_counter()
+
+    async def _on_request_end(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceRequestEndParams,
+    ) -> None:
+        self._record(params.url.host, context, error=params.response.status >= 400)
+
+    async def _on_request_exception(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceRequestExceptionParams,
+    ) -> None:
+        self._record(params.url.host, context, error=True)
+
+    def _record(self, host: str, context: SimpleNamespace, error: bool) -> None:
+        elapsed = time.perf_counter() - context.started_at
+        stats = self.hosts.setdefault(host, HostStats())
+        stats.requests += 1
+        stats.errors += error
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+
+
+http_client = HttpClient()
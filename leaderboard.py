@@ -0,0 +1,164 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class Leaderboard:
+    """
+    Users ordered by SSC, highest first, supporting rank, top-K and page lookups in
+    logarithmic time.
+
+    Entries are kept as sorted buckets of (-sail_credit, discord_id) keys. A Fenwick
+    tree over the bucket sizes maps between a global rank and a position in a bucket
+    without walking every bucket.
+    """
+
+    # Target bucket size. Buckets are split once they grow past twice this.
+    LOAD = 256
+
+    def __init__(self):
+        self._buckets: List[List[Tuple[int, int]]] = []
+        self._maxes: List[Tuple[int, int]] = []
+        self._tree: List[int] = []
+        self._balances: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._balances)
+
+    def load(self, rows: Iterable[Dict[str, int]]) -> None:
+        """
+        Replaces the leaderboard's contents with users rows.
+        """
+        self._balances = {row["discord_id"]: row["sail_credit"] for row in rows}
+        keys = sorted((-ssc, user_id) for user_id, ssc in self._balances.items())
+        self._buckets = [
+            keys[i : i + self.LOAD] for i in range(0, len(keys), self.LOAD)
+        ]
+        self._reindex()
+
+    def update(self, discord_id: int, sail_credit: int) -> None:
+        old_ssc = self._balances.get(discord_id)
+        if old_ssc == sail_credit:
+            return
+        if old_ssc is not None:
+            self._remove((-old_ssc, discord_id))
+
+        self._balances[discord_id] = sail_credit
+        self._insert((-sail_credit, discord_id))
+
+    def rank(self, discord_id: int) -> Optional[int]:
+        """
+        Returns the user's 1-indexed rank, or None if they're not on the leaderboard.
+        """
+        ssc = self._balances.get(discord_id)
+        if ssc is None:
+            return None
+
+        key = (-ssc, discord_id)
+        bucket_idx = bisect_left(self._maxes, key)
+        return (
+            self._prefix_size(bucket_idx)
+            + bisect_left(self._buckets[bucket_idx], key)
+            + 1
+        )
+
+    def top(self, k: int) -> List[Tuple[int, int]]:
+        return self.slice(0, k)
+
+    def page(self, page: int, page_size: int = 10) -> List[Tuple[int, int]]:
+        return self.slice(page * page_size, (page + 1) * page_size)
+
+    def slice(self, start: int, stop: int) -> List[Tuple[int, int]]:
+        """
+        Returns (discord_id, sail_credit) pairs for ranks start + 1 to stop.
+        """
+        entries = []
+        if start >= len(self) or stop <= start:
+            return entries
+
+        bucket_idx, offset = self._locate(start)
+        while bucket_idx < len(self._buckets) and len(entries) < stop - start:
+            bucket = self._buckets[bucket_idx]
+            take = stop - start - len(entries)
+            entries.extend(
+                (user_id, -neg_ssc)
+                for neg_ssc, user_id in bucket[offset : offset + take]
+            )
+            bucket_idx += 1
+            offset = 0
+
+        return entries
+
+    def _insert(self, key: Tuple[int, int]) -> None:
+        if not self._buckets:
+            self._buckets.append([key])
+            self._reindex()
+            return
+
+        bucket_idx = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[bucket_idx]
+        insort(bucket, key)
+        self._maxes[bucket_idx] = bucket[-1]
+
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[bucket_idx : bucket_idx + 1] = [
+                bucket[: self.LOAD],
+                bucket[self.LOAD :],
+            ]
+            self._reindex()
+        else:
+            self._add_size(bucket_idx, 1)
+
+    def _remove(self, key: Tuple[int, int]) -> None:
+        bucket_idx = bisect_left(self._maxes, key)
+        bucket = self._buckets[bucket_idx]
+        del bucket[bisect_left(bucket, key)]
+
+        if not bucket:
+            del self._buckets[bucket_idx]
+            self._reindex()
+        else:
+            self._maxes[bucket_idx] = bucket[-1]
+            self._add_size(bucket_idx, -1)
+
+    def _reindex(self) -> None:
+        """
+        Rebuilds the bucket maxes and Fenwick tree after buckets are added or removed.
+        """
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._tree = [0] * (len(self._buckets) + 1)
+        for i, bucket in enumerate(self._buckets, start=1):
+            self._tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def _add_size(self, bucket_idx: int, delta: int) -> None:
+        i = bucket_idx + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix_size(self, bucket_idx: int) -> int:
+        """
+        Returns the number of entries in the buckets before bucket_idx.
+        """
+        total = 0
+        i = bucket_idx
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """
+        Returns the bucket and offset within it of the 0-indexed global position.
+        """
+        pos = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= index:
+                pos = nxt
+                index -= self._tree[nxt]
+            step >>= 1
+        return pos, index
@@ -6,16 +6,21 @@ from zoneinfo import ZoneInfo
 from discord import app_commands
 import discord
 from discord.ext import commands
+from casino.avatars import avatar_cache
 from casino.casino import CasinoLobby, CasinoPitboss
+from casino.graph import graph_cache, warm_graph_cache
 from casino.models import DegenerateGambler
 import db
+from http_client import http_client
 from party import Party, PartyService
 import validators
 from datetime import datetime, timedelta
 
 from util import (
-    create_ssc_graph_url,
+    create_ssc_graph,
+    ssc_graph_cache,
     divide_chunks,
+    edit_scheduler,
     get_daily_reward,
     get_scheduled_datetime_from_string,
     user_command,
@@ -32,6 +37,7 @@ bot = commands.Bot(
 )
 
 party_service: Optional[PartyService] = None
+casino_pitboss: Optional[CasinoPitboss] = None
 MAINTENENCE_MODE = False
 
 
@@ -103,7 +109,6 @@ async def create_party(
         max_size=max_size,
         description=description,
         created_at=created_at,
-        interaction=interaction,
         start_time=parsed_start_time,
         role_image_url=image_url,
     )
@@ -113,22 +118,30 @@ async def create_party(
         content += f"Description: `{party.description}`\n"
 
     # Don't send the party embed and view just yet, we need to get a message reference first
+    embed_contents = party.generate_embed()
     await interaction.response.send_message(
         content=content,
         ephemeral=False,
         allowed_mentions=discord.AllowedMentions(),
-        embed=create_embed(**party.generate_embed()),
+        embed=create_embed(**embed_contents),
     )
+    party.mark_embed_shown(embed_contents)
 
     # Get the jump URL (message link) for the party for management commands
     message = await interaction.original_response()
     party.jump_url = message.jump_url
+    party.channel_id = message.channel.id
+    party.message_id = message.id
+    party_service.save_party(party)
 
-    # Edit in the party embed and view now
-    await interaction.edit_original_response(
-        embed=create_embed(**party.generate_embed()),
-        view=PartyView(party, party_service),
-    )
+    # Edit in the view now, and the embed too if the jump URL changed it, which only
+    # happens when a low SSC warning links to the party.
+    edit = {"view": PartyView(party, party_service)}
+    embed_contents = party.generate_embed()
+    if party.embed_changed(embed_contents):
+        edit["embed"] = create_embed(**embed_contents)
+    await interaction.edit_original_response(**edit)
+    party.mark_embed_shown(embed_contents)
 
 
 @bot.tree.command(
@@ -137,13 +150,11 @@ async def create_party(
 @app_commands.describe(leader="If True, only list parties that you're the leader of.")
 @user_command()
 async def parties(interaction: discord.Interaction, leader: Optional[bool] = False):
-    personal_party_list = []
-    for party in party_service.parties.values():
-        member_ids = {m.user_id for m in party.members}
-        if interaction.user.id in member_ids and (
-            not leader or interaction.user.id == party.owner_id
-        ):
-            personal_party_list.append(party)
+    personal_party_list = [
+        party
+        for party in party_service.get_user_parties(interaction.user.id)
+        if not leader or interaction.user.id == party.owner_id
+    ]
 
     party_message = "\n".join(
         [
@@ -209,38 +220,14 @@ async def get_ssc(interaction: discord.Interaction, user: discord.User):
 @bot.tree.command(name="leaderboard", description="Check the SSC leaderboard!")
 @user_command()
 async def leaderboard(interaction: discord.Interaction):
-    pages = []
-    users = await db.get_ssc_leaderboard()
-    chunks = divide_chunks(users, 10)
-
-    me_page_idx = 0
-    for i, chunk in enumerate(chunks):
-        page_contents = []
-        for j, user in enumerate(chunk):
-            rank = i * 10 + j + 1
-            page_contents.append(
-                f"**#{rank}** <@{user['discord_id']}> ({user['sail_credit']} SSC)"
-            )
-
-            if user["discord_id"] == interaction.user.id:
-                me_page_idx = i
-
-        pages.append(
-            create_embed(title="SSC Leaderboard", message="\n".join(page_contents))
-        )
-
-    if not pages:
+    if not len(db.leaderboard):
         await interaction.response.send_message(
             embed=create_embed(title="SSC Leaderboard", message="Nobody!"),
         )
         return
 
-    await interaction.response.send_message(
-        embed=pages[0],
-        view=LeaderboardView(
-            user_id=interaction.user.id, pages=pages, me_page=me_page_idx
-        ),
-    )
+    view = LeaderboardView(user_id=interaction.user.id)
+    await interaction.response.send_message(embed=view.get_page(0), view=view)
 
 
 @bot.tree.command(
@@ -251,20 +238,17 @@ async def ssc_graph(
     interaction: discord.Interaction,
     period: Literal["1h", "6h", "12h", "1d", "7d", "30d"],
 ):
-    graph_url = await create_ssc_graph_url(
+    graph = await create_ssc_graph(
         interaction.user.id, interaction.user.display_name, period
     )
-    await interaction.response.send_message(content=graph_url)
+    await interaction.response.send_message(file=graph)
 
 
 @bot.tree.command(name="search", description="Searches for active parties for a role!")
 @app_commands.describe(role="The discord role the party should be for.")
 @user_command()
 async def search(interaction: discord.Interaction, role: discord.Role):
-    party_list = []
-    for party in party_service.parties.values():
-        if party.role.id == role.id:
-            party_list.append(party)
+    party_list = party_service.get_role_parties(role.id)
 
     party_message = "\n".join(
         [
@@ -366,12 +350,8 @@ async def adjust_ssc(interaction: discord.Interaction, user: discord.User, delta
         )
         return
 
-    new_ssc = max(0, user_info["sail_credit"] + delta)
-
     # Change and log SSC, with ADMIN as the source.
-    await db.change_and_log_sail_credit(
-        user.id, -1, -1, -1, user_info["sail_credit"], new_ssc, "ADMIN"
-    )
+    _, new_ssc = await db.apply_sail_credit_delta(user.id, delta, "ADMIN", min_ssc=0)
 
     await interaction.response.send_message(
         embed=create_embed(
@@ -425,9 +405,8 @@ async def conviction_log(
 
         pages.append(create_embed(title=title, message="\n".join(page_contents)))
 
-    await interaction.response.send_message(
-        embed=pages[0], view=MessageBook(interaction.user.id, pages=pages)
-    )
+    view = MessageBook(interaction.user.id, pages=pages)
+    await interaction.response.send_message(embed=view.get_page(0), view=view)
 
 
 casino_group = app_commands.Group(name="sscasino", description="Gamble your SSC!")
@@ -473,15 +452,15 @@ async def casino_coinflip(
         )
         return
 
-    await db.change_and_log_sail_credit(
-        interaction.user.id,
-        -1,
-        -1,
-        -1,
-        current_ssc,
-        current_ssc - amount,
-        source="COINFLIP",
-    )
+    try:
+        await db.apply_sail_credit_delta(
+            interaction.user.id, -amount, source="COINFLIP", require_funds=True
+        )
+    except db.InsufficientFundsError:
+        await interaction.response.send_message(
+            "You don't have enough SSC to bet!", ephemeral=True
+        )
+        return
 
     def on_lobby_create(lobby: CasinoLobby):
         lobby.members.append(
@@ -558,19 +537,12 @@ async def daily_ssc(interaction: discord.Interaction):
 
     reward_info = await get_daily_reward(user_id)
     if not user_info:
-        current_ssc = get_balance(interaction)
-        await db.change_and_log_sail_credit(
-            user_id,
-            -1,
-            -1,
-            -1,
-            current_ssc,
-            current_ssc + reward_info.total_reward,
-            "DAILY_SSC",
+        _, new_ssc = await db.apply_sail_credit_delta(
+            user_id, reward_info.total_reward, "DAILY_SSC"
         )
         embed = create_embed(
             title="Daily Reward",
-            message=f"Daily reward of **{reward_info.total_reward} SSC** claimed. Your balance is now **{current_ssc + reward_info.total_reward} SSC**.",
+            message=f"Daily reward of **{reward_info.total_reward} SSC** claimed. Your balance is now **{new_ssc} SSC**.",
         )
 
         embed.add_field(name="💳 Base amount", value=f"{reward_info.base_amount} SSC")
@@ -623,12 +595,98 @@ async def maintenence(interaction: discord.Interaction, mode: bool):
     )
 
 
+@bot.tree.command(
+    name="cache-stats",
+    description="Show the bot's cache hit rates. Requires admin privileges!",
+)
+async def cache_stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            embed=create_embed(message="You need admin priviliges to use this."),
+            ephemeral=True,
+        )
+        return
+
+    lines = []
+    for name, stats, unit in [
+        ("User cache", db.get_user_cache_stats(), "entries"),
+        ("SSC graph cache", ssc_graph_cache.stats(), "entries"),
+        ("Crash graph cache", graph_cache.stats(), "entries"),
+        ("Avatar cache", avatar_cache.memory.stats(), "bytes"),
+    ]:
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+        lines.append(
+            f"**{name}**: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.1f}% hit rate), {stats['size']} / {stats['max_size']} {unit}"
+        )
+
+    await interaction.response.send_message(
+        embed=create_embed(title="Cache Stats", message="\n".join(lines)),
+        ephemeral=True,
+    )
+
+
+@bot.tree.command(
+    name="http-stats",
+    description="Show the bot's outbound HTTP request timings. Requires admin privileges!",
+)
+async def http_stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            embed=create_embed(message="You need admin priviliges to use this."),
+            ephemeral=True,
+        )
+        return
+
+    lines = []
+    for host, stats in sorted(http_client.hosts.items()):
+        lines.append(
+            f"**{host}**: {stats.requests} requests, {stats.errors} errors, {stats.average_time * 1000:.0f}ms average, {stats.max_time * 1000:.0f}ms max"
+        )
+
+    await interaction.response.send_message(
+        embed=create_embed(
+            title="HTTP Stats", message="\n".join(lines) or "No requests made yet."
+        ),
+        ephemeral=True,
+    )
+
+
+@bot.tree.command(
+    name="rebuild-flake-window",
+    description="Rebuild the flake counts from the ledger. Requires admin privileges!",
+)
+async def rebuild_flake_window(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            embed=create_embed(message="You need admin priviliges to use this."),
+            ephemeral=True,
+        )
+        return
+
+    await db.load_flake_window()
+    await interaction.response.send_message(
+        embed=create_embed(message="Rebuilt the flake window from the ledger."),
+        ephemeral=True,
+    )
+
+
 @bot.event
 async def on_ready():
     global party_service
-    party_service = PartyService()
     global casino_pitboss
-    casino_pitboss = CasinoPitboss()
+    # on_ready runs again after reconnects, when everything is already restored.
+    if party_service is None:
+        party_service = PartyService(bot)
+        casino_pitboss = CasinoPitboss(bot)
+
+        start = time.perf_counter()
+        parties = await party_service.restore()
+        lobbies = await casino_pitboss.restore()
+        print(
+            f"Restored {parties} parties and {lobbies} casino lobbies in {time.perf_counter() - start:.2f}s."
+        )
+    http_client.start()
     await bot.tree.sync()
 
     print("Ready!")
@@ -639,6 +697,11 @@ def patch_close():
     original_close_fn = bot.close
 
     async def new_close(*args, **kwargs):
+        await edit_scheduler.flush()
+        if party_service is not None:
+            await party_service.store.flush()
+            await casino_pitboss.store.flush()
+        await http_client.close()
         await db.cleanup()
         await original_close_fn(*args, **kwargs)
 
@@ -650,6 +713,10 @@ if __name__ == "__main__":
 
     # Run migrations
     asyncio.run(db.run_migrations())
+    asyncio.run(db.backfill_daily_streaks())
+    asyncio.run(db.load_leaderboard())
+    asyncio.run(db.load_flake_window())
+    warm_graph_cache()
 
     token_file = "test_token" if os.environ.get("SC_TEST") else "token"
     with open(token_file, "r") as f:
@@ -62,4 +62,67 @@ CREATE TABLE
         `end_time` INTEGER,
         `metadata` BLOB,
         `game` TEXT
-    )
\ No newline at end of file
+    );
+
+-- Each user's current daily reward streak, and the reset timestamp of the day it was
+-- last extended. Maintained as DAILY_SSC entries are logged.
+CREATE TABLE
+    IF NOT EXISTS `daily_streaks` (
+        `discord_id` INTEGER PRIMARY KEY,
+        `current_streak` INTEGER,
+        `last_reset` INTEGER
+    );
+
+-- Parties that are still assembling, so they survive restarts. Rows are written as
+-- parties change and deleted once they start, get cancelled or expire. start_time is
+-- when the party's start job runs, or NULL if it isn't scheduled.
+CREATE TABLE
+    IF NOT EXISTS `party_state` (
+        `uuid` TEXT PRIMARY KEY,
+        `guild_id` INTEGER,
+        `role_id` INTEGER,
+        `channel_id` INTEGER,
+        `message_id` INTEGER,
+        `start_time` INTEGER,
+        `expires_at` INTEGER,
+        `state` BLOB
+    );
+
+-- Casino lobbies taking bets, so the bets already debited survive restarts. Rows are
+-- deleted once the lobby's game starts.
+CREATE TABLE
+    IF NOT EXISTS `casino_lobby_state` (
+        `uuid` TEXT PRIMARY KEY,
+        `game` TEXT,
+        `channel_id` INTEGER,
+        `message_id` INTEGER,
+        `start_time` INTEGER,
+        `state` BLOB
+    );
+
+-- Indexes for the per-user ledger lookups. These are created after the table rebuild
+-- above since dropping sail_credit_log drops its indexes too.
+CREATE INDEX IF NOT EXISTS `sail_credit_log_user_source_timestamp` ON `sail_credit_log` (
+    `discord_id`,
+    `source`,
+    `timestamp`,
+    `prev_sail_credit`,
+    `new_sail_credit`
+);
+
+CREATE INDEX IF NOT EXISTS `sail_credit_log_user_timestamp` ON `sail_credit_log` (
+    `discord_id`,
+    `timestamp`,
+    `prev_sail_credit`,
+    `new_sail_credit`
+);
+
+-- Party flakes only, for rebuilding the flake window at startup.
+CREATE INDEX IF NOT EXISTS `sail_credit_log_party_flakes` ON `sail_credit_log` (`timestamp`)
+WHERE
+    `source` = 'PARTY'
+    AND `new_sail_credit` < `prev_sail_credit`;
+
+CREATE INDEX IF NOT EXISTS `conviction_log_user_timestamp` ON `conviction_log` (`discord_id`, `timestamp`);
+
+CREATE INDEX IF NOT EXISTS `casino_lobby_log_game_start_time` ON `casino_lobby_log` (`game`, `start_time`);
@@ -1,18 +1,22 @@
-from collections import deque
 from dataclasses import dataclass, field
 import time
-from typing import Dict, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from enum import Enum
 from uuid import UUID, uuid4
 from discord import User, Member
 import discord
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime, timedelta, timezone
 
-from util import create_embed, disable_buttons_and_stop_view
+import db
+from state_store import StateStore
+from timers import TimerWheel, timer_wheel
+from util import create_embed, disable_buttons_and_stop_view, edit_scheduler
 
 STARTING_SSC = 1000
 
+# Parties are removed after this long without anyone using their buttons, in seconds.
+PARTY_VIEW_TIMEOUT = 3600 * 12  # 12 hr
+
 
 class PartyStatus(Enum):
     ASSEMBLING = "ASSEMBLING"  # Finding members for the party.
@@ -27,7 +31,7 @@ class PartyMemberStatus(Enum):
     FLAKED = "FLAKED"
 
 
-@dataclass
+@dataclass(slots=True)
 class PartyMember:
     user_id: int
     name: str
@@ -35,7 +39,71 @@ class PartyMember:
     status: PartyMemberStatus = PartyMemberStatus.NEUTRAL
 
 
-@dataclass
+class MemberList:
+    """
+    Party members in the order they were added, indexed by user ID, in a dict since
+    it keeps insertion order in about half the memory of an OrderedDict. Checking for
+    a user and removing them are O(1). Popping the first member skips the slots of
+    members popped before it until the dict is next resized, which is negligible at
+    party sizes.
+    """
+
+    __slots__ = ("_members",)
+
+    def __init__(self, members: Iterable[PartyMember] = ()):
+        self._members: Dict[int, PartyMember] = {
+            member.user_id: member for member in members
+        }
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __iter__(self) -> Iterator[PartyMember]:
+        return iter(self._members.values())
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._members
+
+    def __repr__(self) -> str:
+        return f"MemberList({list(self._members.values())!r})"
+
+    def get(self, user_id: int) -> Optional[PartyMember]:
+        return self._members.get(user_id)
+
+    def first(self) -> Optional[PartyMember]:
+        return next(iter(self._members.values()), None)
+
+    def append(self, member: PartyMember) -> None:
+        self._members[member.user_id] = member
+
+    def remove(self, user_id: int) -> Optional[PartyMember]:
+        return self._members.pop(user_id, None)
+
+    def popleft(self) -> PartyMember:
+        return self._members.pop(next(iter(self._members)))
+
+
+@dataclass(slots=True)
+class EmbedFragments:
+    """
+    The rendered pieces of a party's embed. Pieces set to None are rendered again the
+    next time the embed is generated.
+    """
+
+    header: str = ""
+    # The name, remaining spots and start time the header was rendered with.
+    header_key: Optional[Tuple] = None
+    # Member lines by user ID, and the owner and jump URL they were rendered with.
+    member_lines: Dict[int, str] = field(default_factory=dict)
+    owner_id: Optional[int] = None
+    jump_url: Optional[str] = None
+    members: Optional[str] = None
+    waitlist: Optional[str] = None
+    # The embed contents the party's message was last edited with.
+    shown: Optional[Dict] = None
+
+
+@dataclass(slots=True)
 class Party:
     uuid: UUID
     role: discord.Role
@@ -45,43 +113,97 @@ class Party:
     role_image_url: Optional[int] = None
     finished_at: Optional[int] = None
     start_time: Optional[int] = None
-    interaction: Optional[discord.Interaction] = None
+    # The party's message, once it's been sent.
+    channel_id: Optional[int] = None
+    message_id: Optional[int] = None
     jump_url: Optional[str] = None
+    # When the party is removed for inactivity, pushed back every time it's saved.
+    expires_at: Optional[int] = None
     max_size: int = 5
     status: PartyStatus = PartyStatus.ASSEMBLING
     description: str = ""
-    members: list[PartyMember] = field(default_factory=lambda: [])
-    waitlist: deque[PartyMember] = field(default_factory=lambda: deque())
+    members: MemberList = field(default_factory=MemberList)
+    waitlist: MemberList = field(default_factory=MemberList)
+    _embed: EmbedFragments = field(
+        default_factory=EmbedFragments, init=False, repr=False, compare=False
+    )
 
     @property
     def size(self) -> int:
         return len(self.members)
 
-    def generate_embed(self) -> str:
-        start_string = f"\n\nStarts: <t:{self.start_time}:R>" if self.start_time else ""
-        waitlist_mentions = [f"<@{m.user_id}>" for m in self.waitlist]
-        waitlist_string = f"Waitlist: {" ".join(waitlist_mentions)}"
+    def generate_embed(self) -> Dict:
+        """
+        The party message's embed contents. The header, member lines and waitlist line
+        are kept between calls, and each is only rendered again once something it shows
+        changes.
+        """
+        fragments = self._embed
         remaining_spots = self.max_size - len(self.members)
-        content = (
-            f"**{self.name}**\n\n`{remaining_spots}` spot{'s' if remaining_spots != 1 else ''} left.{start_string}\n\n"
-            + f"Current Party:\n"
-        )
-        for member in self.members:
-            content += f"- {'👑 ' if member.user_id == self.owner_id else ''}<@{member.user_id}>"
-            if member.cached_ssc < 900:
-                content += f' [(!)]({self.jump_url} "Warning: Party member has low SSC ({member.cached_ssc}).")'
-            content += "\n"
-
-        if self.waitlist:
-            content += f"\n{waitlist_string}\n"
+        header_key = (self.name, remaining_spots, self.start_time)
+        if fragments.header_key != header_key:
+            start_string = (
+                f"\n\nStarts: <t:{self.start_time}:R>" if self.start_time else ""
+            )
+            fragments.header = (
+                f"**{self.name}**\n\n`{remaining_spots}` spot{'s' if remaining_spots != 1 else ''} left.{start_string}\n\n"
+                + f"Current Party:\n"
+            )
+            fragments.header_key = header_key
+
+        if fragments.jump_url != self.jump_url:
+            # Low SSC warnings link to the party.
+            fragments.member_lines.clear()
+            fragments.members = None
+            fragments.jump_url = self.jump_url
+        if fragments.owner_id != self.owner_id:
+            # The crown moves from one member's line to another's.
+            fragments.member_lines.pop(fragments.owner_id, None)
+            fragments.member_lines.pop(self.owner_id, None)
+            fragments.members = None
+            fragments.owner_id = self.owner_id
+
+        if fragments.members is None:
+            fragments.members = "".join(map(self._member_line, self.members))
+        if fragments.waitlist is None:
+            waitlist_mentions = [f"<@{m.user_id}>" for m in self.waitlist]
+            fragments.waitlist = (
+                f"\nWaitlist: {" ".join(waitlist_mentions)}\n" if self.waitlist else ""
+            )
 
-        embed_contents = {"message": content, "color": self.role.color}
+        embed_contents = {
+            "message": fragments.header + fragments.members + fragments.waitlist,
+            "color": self.role.color,
+        }
 
         if self.role_image_url:
             embed_contents["image_url"] = self.role_image_url
 
         return embed_contents
 
+    def _member_line(self, member: PartyMember) -> str:
+        line = self._embed.member_lines.get(member.user_id)
+        if line is None:
+            line = f"- {'👑 ' if member.user_id == self.owner_id else ''}<@{member.user_id}>"
+            if member.cached_ssc < 900:
+                line += f' [(!)]({self.jump_url} "Warning: Party member has low SSC ({member.cached_ssc}).")'
+            line += "\n"
+            self._embed.member_lines[member.user_id] = line
+        return line
+
+    def embed_changed(self, embed_contents: Dict) -> bool:
+        """
+        Whether the party's message doesn't show these embed contents yet. Editing in
+        contents that didn't change is a wasted Discord API call.
+        """
+        return embed_contents != self._embed.shown
+
+    def mark_embed_shown(self, embed_contents: Dict) -> None:
+        """
+        Records that the party's message was edited to show these embed contents.
+        """
+        self._embed.shown = embed_contents
+
     """
     Adds a party member.
     Automatically adds the member to the waitlist if the party is full.
@@ -94,10 +216,12 @@ class Party:
         # There is space, add to member list.
         if len(self.members) < self.max_size:
             self.members.append(party_member)
+            self._embed.members = None
             return False
 
         # No space, add to waitlist.
         self.waitlist.append(party_member)
+        self._embed.waitlist = None
         return True
 
     """
@@ -109,34 +233,223 @@ class Party:
     def remove_member(self, user_id: int) -> Optional[PartyMember]:
 
         # User is in the waitlist. Remove them from the waitlist.
-        waitlist_ids = [member.user_id for member in self.waitlist]
-        if user_id in waitlist_ids:
-            self.waitlist = [
-                member for member in self.waitlist if member.user_id != user_id
-            ]
+        if self.waitlist.remove(user_id):
+            self._embed.waitlist = None
             return None
 
         # User is a member. Remove them from the member list.
-        self.members = [member for member in self.members if member.user_id != user_id]
+        if not self.members.remove(user_id):
+            return None
+        self._embed.member_lines.pop(user_id, None)
+        self._embed.members = None
 
         new_member = None
         # If there is a waitlist, de-queue the first one and add them to the party.
         if self.waitlist:
             new_member = self.waitlist.popleft()
             self.members.append(new_member)
+            self._embed.waitlist = None
 
         # If the user that left was the owner, assign a new owner if possible.
         if user_id == self.owner_id:
-            self.owner_id = self.members[0].user_id if self.members else None
+            owner = self.members.first()
+            self.owner_id = owner.user_id if owner else None
 
         return new_member
 
+    def to_dict(self) -> Dict:
+        """
+        The party's state, apart from its role and scheduling, as JSON.
+        """
+        return {
+            "name": self.name,
+            "owner_id": self.owner_id,
+            "created_at": self.created_at,
+            "role_image_url": self.role_image_url,
+            "jump_url": self.jump_url,
+            "max_size": self.max_size,
+            "description": self.description,
+            "members": [_member_to_dict(member) for member in self.members],
+            "waitlist": [_member_to_dict(member) for member in self.waitlist],
+        }
+
+    @classmethod
+    def from_dict(cls, uuid: UUID, role: discord.Role, state: Dict) -> "Party":
+        return cls(
+            uuid=uuid,
+            role=role,
+            name=state["name"],
+            owner_id=state["owner_id"],
+            created_at=state["created_at"],
+            role_image_url=state["role_image_url"],
+            jump_url=state["jump_url"],
+            max_size=state["max_size"],
+            description=state["description"],
+            members=MemberList(
+                _member_from_dict(member) for member in state["members"]
+            ),
+            waitlist=MemberList(
+                _member_from_dict(member) for member in state["waitlist"]
+            ),
+        )
+
+
+def _member_to_dict(member: PartyMember) -> Dict:
+    return {
+        "user_id": member.user_id,
+        "name": member.name,
+        "cached_ssc": member.cached_ssc,
+        "status": member.status.value,
+    }
+
+
+def _member_from_dict(member: Dict) -> PartyMember:
+    return PartyMember(
+        user_id=member["user_id"],
+        name=member["name"],
+        cached_ssc=member["cached_ssc"],
+        status=PartyMemberStatus(member["status"]),
+    )
+
 
 class PartyService:
-    def __init__(self):
+    def __init__(self, client: discord.Client, timers: TimerWheel = timer_wheel):
+        self.client = client
         self.parties: Dict[UUID, Party] = {}
-        self.scheduler = AsyncIOScheduler(timezone="UTC")
-        self.scheduler.start()
+        # Active parties by role ID, and by the user ID of each member (not the
+        # waitlist), in the order they were added.
+        self.parties_by_role: Dict[int, Dict[UUID, Party]] = {}
+        self.parties_by_user: Dict[int, Dict[UUID, Party]] = {}
+        self.timers = timers
+        self.store: StateStore[Party] = StateStore(
+            self._to_row, db.save_party_states, db.delete_party_states
+        )
+        # Views listening to restored parties' messages, which only stop when told to.
+        self.restored_views: Dict[UUID, discord.ui.View] = {}
+
+    def save_party(self, party: Party) -> None:
+        """
+        Queues a write of the party's state, after it changed. Parties that were
+        already removed aren't written again.
+        """
+        if party.uuid not in self.parties:
+            return
+        party.expires_at = int(time.time()) + PARTY_VIEW_TIMEOUT
+        self.store.mark(str(party.uuid), party)
+
+    def add_member(
+        self, party: Party, user_id: int, user_name: str, user_ssc: int
+    ) -> bool:
+        waitlisted = party.add_member(user_id, user_name, user_ssc)
+        if not waitlisted:
+            _index(self.parties_by_user, user_id, party)
+        self.save_party(party)
+        return waitlisted
+
+    def remove_member(self, party: Party, user_id: int) -> Optional[PartyMember]:
+        new_member = party.remove_member(user_id)
+        _unindex(self.parties_by_user, user_id, party)
+        if new_member:
+            _index(self.parties_by_user, new_member.user_id, party)
+        self.save_party(party)
+        return new_member
+
+    def get_role_parties(self, role_id: int) -> List[Party]:
+        return list(self.parties_by_role.get(role_id, {}).values())
+
+    def get_user_parties(self, user_id: int) -> List[Party]:
+        """
+        Returns the parties the user is a member of, not counting waitlists.
+        """
+        return list(self.parties_by_user.get(user_id, {}).values())
+
+    def _add_party(self, party: Party) -> None:
+        self.parties[party.uuid] = party
+        _index(self.parties_by_role, party.role.id, party)
+        for member in party.members:
+            _index(self.parties_by_user, member.user_id, party)
+
+    async def restore(self) -> int:
+        """
+        Restores the parties saved before the last restart, and returns how many were
+        restored. Needs the client's cache to be ready.
+
+        Nothing is fetched from Discord here. Each party's buttons are listened to
+        again by message ID, and its message is only fetched once its start job runs.
+        """
+        # Locally import here to avoid circular imports.
+        from views import PartyView
+
+        now = int(time.time())
+        restored = 0
+        for row in await db.get_party_states():
+            guild = self.client.get_guild(row["guild_id"])
+            role = guild.get_role(row["role_id"]) if guild else None
+            # Parties that expired, whose message was never sent or whose role is
+            # gone can't be restored.
+            if role is None or row["message_id"] is None or row["expires_at"] <= now:
+                self.store.mark(row["uuid"], None)
+                continue
+
+            party = Party.from_dict(UUID(row["uuid"]), role, row["state"])
+            party.channel_id = row["channel_id"]
+            party.message_id = row["message_id"]
+            party.start_time = row["start_time"]
+            party.expires_at = row["expires_at"]
+            self._add_party(party)
+
+            if party.start_time is not None:
+                self._schedule_start(
+                    party.uuid,
+                    datetime.fromtimestamp(max(party.start_time, now), tz=timezone.utc),
+                )
+            # Persistent views can't time out, so the timeout is a job instead.
+            self._schedule_expiry(party)
+            view = PartyView(
+                party, self, scheduled=party.start_time is not None, timeout=None
+            )
+            self.client.add_view(view, message_id=party.message_id)
+            self.restored_views[party.uuid] = view
+            restored += 1
+
+        return restored
+
+    def _to_row(self, party: Party) -> Dict:
+        return {
+            "uuid": str(party.uuid),
+            "guild_id": party.role.guild.id,
+            "role_id": party.role.id,
+            "channel_id": party.channel_id,
+            "message_id": party.message_id,
+            "start_time": party.start_time,
+            "expires_at": party.expires_at,
+            "state": party.to_dict(),
+        }
+
+    def _schedule_start(self, uuid: UUID, run_date: datetime) -> None:
+        self.timers.schedule(
+            f"party:{uuid}", run_date, self._start_scheduled_party, uuid
+        )
+
+    def _schedule_expiry(self, party: Party) -> None:
+        self.timers.schedule(
+            f"party:{party.uuid}:expire",
+            datetime.fromtimestamp(party.expires_at, tz=timezone.utc),
+            self._expire_party,
+            party.uuid,
+        )
+
+    async def _expire_party(self, uuid: UUID) -> None:
+        party = self.get_party(uuid)
+        if not party:
+            return
+
+        # The party was used since the job was scheduled.
+        if party.expires_at > time.time():
+            self._schedule_expiry(party)
+            return
+
+        self.remove_party(uuid)
 
     def create_party(
         self,
@@ -165,27 +478,24 @@ class PartyService:
         if start_time:
             run_date = start_time
 
-        self.scheduler.add_job(
-            self._start_scheduled_party,
-            "date",
-            args=[party_uuid],
-            run_date=run_date,
-            id=str(party_uuid),
-        )
+        self._schedule_start(party_uuid, run_date)
 
         party = Party(
             uuid=party_uuid,
             owner_id=user.id,
-            members=[
-                PartyMember(
-                    user_id=user.id, name=user.display_name, cached_ssc=user_ssc
-                )
-            ],
+            members=MemberList(
+                [
+                    PartyMember(
+                        user_id=user.id, name=user.display_name, cached_ssc=user_ssc
+                    )
+                ]
+            ),
             start_time=int(run_date.timestamp()),
             **party_kwargs,
         )
 
-        self.parties[party_uuid] = party
+        self._add_party(party)
+        self.save_party(party)
         return party
 
     async def _start_scheduled_party(self, uuid: UUID) -> None:
@@ -201,25 +511,32 @@ class PartyService:
         if not party:
             return
 
-        interaction = party.interaction
-        # If for any reason the party doesn't have an interaction instance, do nothing.
-        if not interaction:
+        # If for any reason the party's message was never sent, there's nothing to
+        # start it from. It's unscheduled, and without a view to time out, removed by
+        # an expiry job instead.
+        if not party.message_id:
+            party.start_time = None
+            self.save_party(party)
+            self._schedule_expiry(party)
             return
 
-        # We need to edit/reply to the original message because our auth token for the followup channel may have expired.
-        message = await interaction.original_response()
-
-        # we need to refetch this message in order to edit it (auth)
-        message = await message.channel.fetch_message(message.id)
+        # We need to fetch the message to edit/reply to it, since the interaction's auth
+        # token may have expired, or the party was restored after a restart.
+        channel = self.client.get_channel(
+            party.channel_id
+        ) or await self.client.fetch_channel(party.channel_id)
+        message = await channel.fetch_message(party.message_id)
 
         # Slightly stricter requirements here, the party needs to be full and more than 1 person to auto start.
         # If not, the party can still be started manually.
         async def unschedule_party():
             # Setting start_time to None will cause the party embed to not include a starting timestamp
             party.start_time = None
+            self.save_party(party)
 
             # Edit the original message to reflect it
-            await message.edit(
+            await edit_scheduler.edit(
+                message,
                 embed=create_embed(**party.generate_embed()),
                 view=PartyView(party, self, scheduled=False),
             )
@@ -232,7 +549,9 @@ class PartyService:
             self.remove_party(party.uuid)
             party.start_time = None
 
-            await message.edit(embed=create_embed(**party.generate_embed()), view=None)
+            await edit_scheduler.edit(
+                message, embed=create_embed(**party.generate_embed()), view=None
+            )
 
             return
 
@@ -272,15 +591,11 @@ class PartyService:
         return self.parties.get(uuid)
 
     def update_party_start_time(self, uuid: UUID, minutes: int) -> Optional[int]:
-        job_id = str(uuid)
-        job = self.scheduler.get_job(job_id=job_id)
-        if job:
+        timer_id = f"party:{uuid}"
+        run_date = self.timers.get_run_date(timer_id)
+        if run_date:
             delta = timedelta(minutes=abs(minutes))
-            new_run_time = (
-                job.trigger.run_date + delta
-                if minutes > 0
-                else job.trigger.run_date - delta
-            )
+            new_run_time = run_date + delta if minutes > 0 else run_date - delta
 
             now = int(time.time())
             if new_run_time.timestamp() < now:
@@ -288,16 +603,39 @@ class PartyService:
             elif new_run_time.timestamp() > (now + 3600 * 12):
                 new_run_time = datetime.now(tz=timezone.utc) + timedelta(hours=12)
 
-            self.scheduler.reschedule_job(job_id, run_date=new_run_time)
+            self.timers.reschedule(timer_id, new_run_time)
             self.parties[uuid].start_time = int(new_run_time.timestamp())
+            self.save_party(self.parties[uuid])
 
             return self.parties[uuid].start_time
 
     def remove_party(self, uuid: UUID) -> None:
         if uuid in self.parties:
-            del self.parties[uuid]
-
-        # Remove the queued start job.
-        job_id = str(uuid)
-        if self.scheduler.get_job(job_id=job_id):
-            self.scheduler.remove_job(job_id=job_id)
+            party = self.parties.pop(uuid)
+            _unindex(self.parties_by_role, party.role.id, party)
+            for member in party.members:
+                _unindex(self.parties_by_user, member.user_id, party)
+            self.store.mark(str(uuid), None)
+
+        view = self.restored_views.pop(uuid, None)
+        if view:
+            view.stop()
+
+        # Remove the queued start and expiry jobs.
+        self.timers.cancel(f"party:{uuid}")
+        self.timers.cancel(f"party:{uuid}:expire")
+
+
+def _index(index: Dict[int, Dict[UUID, Party]], key: int, party: Party) -> None:
+    index.setdefault(key, {})[party.uuid] = party
+
+
+def _unindex(index: Dict[int, Dict[UUID, Party]], key: int, party: Party) -> None:
+    parties = index.get(key)
+    if parties is None:
+        return
+    parties.pop(party.uuid, None)
+    # Empty entries are dropped, so the index doesn't grow with every user who ever
+    # joined a party.
+    if not parties:
+        del index[key]
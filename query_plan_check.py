@@ -0,0 +1,195 @@
+import asyncio
+import inspect
+import os
+import random
+import re
+import tempfile
+import time
+
+import db
+
+# Size of the seeded ledger the query plans are checked against.
+LEDGER_ROWS = 1_000_000
+USER_COUNT = 5_000
+
+# Arguments to call each db function with, once per tuple. The plan of every statement
+# they run is checked for full table scans.
+CHECKED_CALLS = {
+    "create_user": [(USER_COUNT + 1,)],
+    "get_user": [(1,)],
+    "set_user": [(1, 1000)],
+    "get_user_sail_credit_log": [(1, 0), (1, 0, "DAILY_SSC"), (1, 0, None)],
+    "get_user_sail_credit_log_buckets": [(1, 0, int(time.time()), 200)],
+    "get_user_sail_credit_log_span": [(1, 0)],
+    "get_users_with_log_count": [([1, 2, 3], 0, "PARTY")],
+    "change_and_log_sail_credit": [(1, -1, -1, -1, 1000, 1010, "ADMIN")],
+    "apply_sail_credit_delta": [
+        (1, 10, "ADMIN"),
+        (1, -10, "ADMIN", -1, -1, -1, None, 0),
+    ],
+    "write_ledger": [
+        ([db.LedgerWrite(1, "ADMIN", delta=10)],),
+        ([db.LedgerWrite(1, "DAILY_SSC", delta=10)],),
+        ([db.LedgerWrite(1, "DONATION_DEBIT", delta=-10, require_funds=True)],),
+    ],
+    "log_convict_reason": [(1, "Flaked")],
+    "get_conviction_log": [(1,)],
+    "update_role_image_url": [(1, "https://example.com/image.png"), (1, None)],
+    "get_role_image_url": [(1,)],
+    "create_casino_lobby_log": [("uuid", 0, 0, {}, "CRASH")],
+    "get_casino_lobby_logs": [("CRASH",)],
+    "save_party_states": [
+        (
+            [
+                {
+                    "uuid": "uuid",
+                    "guild_id": 1,
+                    "role_id": 1,
+                    "channel_id": 1,
+                    "message_id": 1,
+                    "start_time": 0,
+                    "expires_at": 0,
+                    "state": {},
+                }
+            ],
+        )
+    ],
+    "delete_party_states": [(["uuid"],)],
+    "save_casino_lobby_states": [
+        (
+            [
+                {
+                    "uuid": "uuid",
+                    "game": "crash",
+                    "channel_id": 1,
+                    "message_id": 1,
+                    "start_time": 0,
+                    "state": {},
+                }
+            ],
+        )
+    ],
+    "delete_casino_lobby_states": [(["uuid"],)],
+    "get_daily_reward_streak": [(1,)],
+    "load_flake_window": [()],
+}
+
+# Functions that are expected to read or rewrite entire tables, or don't query.
+UNCHECKED = {
+    "init",
+    "cleanup",
+    "run_migrations",
+    "flush_pending_writes",
+    "get_all_users",
+    "get_sail_credit_logs",
+    "clear_sail_credit_logs",
+    "rewrite_sail_credit_ledger",
+    "get_ssc_leaderboard",
+    "load_leaderboard",
+    "backfill_daily_streaks",
+    "get_party_states",
+    "get_casino_lobby_states",
+}
+
+TABLE_SCAN = re.compile(r"^SCAN (\w+)")
+
+
+async def seed_ledger() -> None:
+    now = int(time.time())
+    sources = ["PARTY", "DAILY_SSC", "CRASH_DEBIT", "CRASH_CREDIT", "ADMIN"]
+
+    def rows():
+        for i in range(LEDGER_ROWS):
+            yield (
+                random.randrange(USER_COUNT),
+                -1,
+                -1,
+                -1,
+                1000,
+                1000 + random.randint(-100, 100),
+                random.choice(sources),
+                now - random.randrange(60 * 60 * 24 * 90),
+            )
+
+    await db.db.executemany(
+        "INSERT INTO users (discord_id, sail_credit) VALUES (?, 1000)",
+        [(user_id,) for user_id in range(USER_COUNT)],
+    )
+    await db.db.executemany(
+        "INSERT INTO sail_credit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows()
+    )
+    await db.db.commit()
+
+
+async def check_query_plans():
+    """
+    Seeds a large ledger, then runs every function in db.py and asserts that none of
+    the statements they execute fall back to a full table scan.
+    """
+    db_functions = {
+        name
+        for name, fn in inspect.getmembers(db, inspect.iscoroutinefunction)
+        if fn.__module__ == db.__name__ and not name.startswith("_")
+    }
+    unaccounted = db_functions - CHECKED_CALLS.keys() - UNCHECKED
+    if unaccounted:
+        raise AssertionError(
+            f"Add these db functions to CHECKED_CALLS or UNCHECKED: {sorted(unaccounted)}"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await db.init(os.path.join(tmp, "query_plan.db"))
+        with open("schema.sql", "r") as f:
+            await db.db.executescript(f.read())
+        await db.run_migrations()
+
+        print(f"Seeding {LEDGER_ROWS:,} ledger rows...")
+        await seed_ledger()
+
+        # Scans of CTEs, subqueries and constant rows are fine.
+        tables = {
+            row["name"]
+            for row in await db.db.execute_fetchall(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+
+        statements = []
+        await db.db.set_trace_callback(statements.append)
+
+        failures = []
+        for name, calls in CHECKED_CALLS.items():
+            statements.clear()
+            for args in calls:
+                await getattr(db, name)(*args)
+                await db.flush_pending_writes()
+
+            for statement in statements:
+                if (
+                    not statement.lstrip()
+                    .upper()
+                    .startswith(("SELECT", "INSERT", "UPDATE", "DELETE"))
+                ):
+                    continue
+
+                async with db.db.execute(f"EXPLAIN QUERY PLAN {statement}") as cursor:
+                    plan = [row["detail"] for row in await cursor.fetchall()]
+
+                for detail in plan:
+                    scan = TABLE_SCAN.match(detail)
+                    if scan and scan.group(1) in tables:
+                        failures.append(f"{name}: {detail}\n    {statement}")
+
+            print(f"Checked {name} ({len(statements)} statements)")
+
+        await db.db.set_trace_callback(None)
+        await db.cleanup()
+
+    if failures:
+        raise AssertionError("Full table scans found:\n" + "\n".join(failures))
+
+    print("No full table scans found!")
+
+
+if __name__ == "__main__":
+    asyncio.run(check_query_plans())
@@ -1,12 +1,136 @@
-import uuid
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+import numpy as np
 import db
 import asyncio
 from scb import SailCreditBureau
-from party import Party, PartyMember, STARTING_SSC
+from party import STARTING_SSC
+from util import get_last_reset_time
 
 
 scb = SailCreditBureau()
 
+LogRow = Tuple[int, int, int, int, int, int, str, int]
+
+
+def replay(
+    logs: Iterable[Dict[str, Any]],
+    balances: Dict[int, int],
+    last_reset: int,
+    flake_window_start: int,
+) -> List[LogRow]:
+    """
+    Replays the logs in order on top of the given balances, which are updated in
+    place, and returns the rebuilt log rows.
+
+    Admin changes keep their delta, floored at 0 SSC. Every other entry is rescored
+    as a party, a flake if its original delta was negative, with the same inputs
+    SailCreditBureau reads from the ledger: the user's parties since last_reset, and
+    the days they flaked on since flake_window_start.
+
+    A user's entries only depend on their own earlier entries, so the logs are
+    replayed in waves: the first entry of every user, then every user's second entry,
+    and so on, each scored with one batch call.
+    """
+    logs = list(logs)
+    if not logs:
+        return []
+
+    slots = {user_id: slot for slot, user_id in enumerate(balances)}
+    missing_ids = {log["discord_id"] for log in logs} - slots.keys()
+    if missing_ids:
+        raise ValueError(f"Users {missing_ids} do not exist.")
+
+    def column(name: str) -> np.ndarray:
+        return np.fromiter((log[name] for log in logs), np.int64, len(logs))
+
+    user_slot = np.fromiter(
+        (slots[log["discord_id"]] for log in logs), np.int64, len(logs)
+    )
+    timestamp = column("timestamp")
+    logged_delta = column("new_sail_credit") - column("prev_sail_credit")
+    party_age = column("party_finished_at") - column("party_created_at")
+    is_admin = np.fromiter((log["source"] == "ADMIN" for log in logs), bool, len(logs))
+    flake_day = scb.flake_day_batch(timestamp)
+    flaked = ~is_admin & (logged_delta < 0)
+
+    # Parties are rebuilt with one placeholder member per logged member.
+    logged_size = column("party_size")
+    party_size = np.where(is_admin, logged_size, np.maximum(0, logged_size))
+
+    # Each entry's position among its user's entries is the wave it's replayed in.
+    by_user = np.argsort(user_slot, kind="stable")
+    user_start = np.searchsorted(user_slot[by_user], user_slot[by_user])
+    wave = np.empty(len(logs), np.int64)
+    wave[by_user] = np.arange(len(logs)) - user_start
+    by_wave = np.argsort(wave, kind="stable")
+    wave_bounds = np.searchsorted(wave[by_wave], np.arange(wave.max() + 2))
+
+    balance = np.fromiter(balances.values(), np.int64, len(balances))
+    parties_since_reset = np.zeros(len(balances), np.int64)
+    flake_count = np.zeros(len(balances), np.int64)
+    # Flakes are replayed in time order, so a user's flake days only ever increase
+    # and a new day is one that differs from the last.
+    last_flake_day = np.full(len(balances), np.nan)
+
+    prev_ssc = np.empty(len(logs), np.int64)
+    new_ssc = np.empty(len(logs), np.int64)
+    for start, end in zip(wave_bounds[:-1], wave_bounds[1:]):
+        rows = by_wave[start:end]
+        users = user_slot[rows]
+        old = balance[users]
+
+        # If this is an admin change, don't recalculate using the algorithm.
+        # Just find the delta and apply.
+        new = np.maximum(0, old + logged_delta[rows])
+
+        flake = flaked[rows]
+        new[flake] = old[flake] + scb.debit_batch(
+            old[flake],
+            flake_count[users[flake]],
+            party_age[rows[flake]],
+            party_size[rows[flake]],
+        )
+        credit = ~is_admin[rows] & ~flake
+        new[credit] = old[credit] + scb.credit_batch(
+            old[credit],
+            parties_since_reset[users[credit]],
+            party_size[rows[credit]],
+        )
+
+        prev_ssc[rows] = old
+        new_ssc[rows] = new
+        balance[users] = new
+
+        party = ~is_admin[rows]
+        parties_since_reset[users] += party & (timestamp[rows] > last_reset)
+
+        day = flake_day[rows]
+        new_flake_day = (
+            party
+            & (new < old)
+            & (timestamp[rows] > flake_window_start)
+            & (day != last_flake_day[users])
+        )
+        flake_count[users[new_flake_day]] += 1
+        last_flake_day[users[new_flake_day]] = day[new_flake_day]
+
+    for user_id, slot in slots.items():
+        balances[user_id] = int(balance[slot])
+
+    return list(
+        zip(
+            (log["discord_id"] for log in logs),
+            party_size.tolist(),
+            (log["party_created_at"] for log in logs),
+            (log["party_finished_at"] for log in logs),
+            prev_ssc.tolist(),
+            new_ssc.tolist(),
+            np.where(is_admin, "ADMIN", "PARTY").tolist(),
+            timestamp.tolist(),
+        )
+    )
+
 
 async def calculate():
     """
@@ -18,64 +142,28 @@ async def calculate():
     existing_logs = await db.get_sail_credit_logs()
 
     # Reset all user to their starting SSC.
-    print("Resetting all users to default SSC...")
     old_user_ssc = {}
+    new_user_ssc = {}
     for user in await db.get_all_users():
         old_user_ssc[user["discord_id"]] = user["sail_credit"]
-        await db.set_user(user["discord_id"], STARTING_SSC)
-
-    # Wipe the logs table.
-    print("Wiping the logs table...")
-    await db.clear_sail_credit_logs()
+        new_user_ssc[user["discord_id"]] = STARTING_SSC
 
     # Recalculate the SSC for all users.
     print("Recalculating SSC for all users...")
     print(f"Total logs: {len(existing_logs)}")
-    for log in existing_logs:
+    rebuilt_logs = replay(
+        existing_logs,
+        new_user_ssc,
+        get_last_reset_time(),
+        int(time.time()) - scb.FLAKE_WINDOW,
+    )
 
-        # If this is an admin change, don't recalculate using the algorithm.
-        # Just find the delta and apply.
-        if log["source"] == "ADMIN":
-            user = await db.get_user(log["discord_id"])
-            old_ssc = user["sail_credit"]
-            delta = log["new_sail_credit"] - log["prev_sail_credit"]
-            new_ssc = max(0, old_ssc + delta)
-            await db.change_and_log_sail_credit(
-                discord_id=log["discord_id"],
-                party_size=log["party_size"],
-                party_created_at=log["party_created_at"],
-                party_finished_at=log["party_finished_at"],
-                new_ssc=new_ssc,
-                old_ssc=old_ssc,
-                source=log["source"],
-                timestamp=log["timestamp"],
-            )
-            continue
-
-        party = Party(
-            uuid=uuid.uuid4(),
-            role=0,
-            owner_id=0,
-            name="",
-            created_at=log["party_created_at"],
-            finished_at=log["party_finished_at"],
-            max_size=log["party_size"],
-            members=[PartyMember(0, "", 0) for _ in range(log["party_size"])],
-        )
-        if log["new_sail_credit"] - log["prev_sail_credit"] < 0:
-            await scb.process_flaked_user(
-                party, log["discord_id"], timestamp=log["timestamp"]
-            )
-        else:
-            await scb.process_party_member(
-                party, log["discord_id"], timestamp=log["timestamp"]
-            )
+    # Replace the logs table and balances.
+    print("Writing the recalculated logs...")
+    await db.rewrite_sail_credit_ledger(rebuilt_logs, new_user_ssc)
 
     print("Non-zero SSC deltas after recalculation:")
 
-    new_user_ssc = {
-        user["discord_id"]: user["sail_credit"] for user in await db.get_all_users()
-    }
     for user_id in new_user_ssc:
         old_ssc = old_user_ssc.get(user_id, 1000)
         delta = new_user_ssc[user_id] - old_ssc
@@ -1,11 +1,36 @@
 import math
 import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+import numpy as np
 from party import Party
 import db
+import flake_window
 import party
 from util import get_last_reset_time
 
 
+@dataclass
+class ScoreTrace:
+    """
+    A breakdown of a single credit or debit, passed to SailCreditBureau's trace
+    callback. Ratios that didn't apply are None.
+    """
+
+    user_id: int
+    kind: str  # CREDIT or DEBIT
+    base: int
+    ratios: Dict[str, Optional[float]]
+    amount: int
+
+    def __str__(self) -> str:
+        log = f"[user-{self.user_id}]: {self.kind} base:{self.base} SSC "
+        for name, ratio in self.ratios.items():
+            if ratio is not None:
+                log += f"* {name}:{round(ratio * 100, 3)}% "
+        return log + f"= {self.amount} SSC"
+
+
 class SailCreditBureau:
     """
     Welcome all.
@@ -22,11 +47,15 @@ class SailCreditBureau:
     BASE_PENALTY = -200
 
     # How far back we check for previous flake incidents, in seconds.
-    FLAKE_WINDOW = 60 * 60 * 24 * 30  # 30 days
+    FLAKE_WINDOW = flake_window.FLAKE_WINDOW
 
     # Multiplier to reduce SSC gain from 2 member parties.
     SMALL_PARTY_MULTIPLIER = 0.6
 
+    def __init__(self, trace: Optional[Callable[[ScoreTrace], None]] = None):
+        # Called with the breakdown of every credit and debit, if given.
+        self.trace = trace
+
     async def process(flake: bool):
         """
         Handles the process of calculating sail credit for a user based on whether they
@@ -35,14 +64,14 @@ class SailCreditBureau:
 
         pass
 
-    async def debit(
+    def debit(
         self,
         user_id: int,
         current_ssc: int,
         flake_count: int,
         party_age: int,
         party_size: int,
-    ):
+    ) -> int:
         """
         Method for calculating how much sail credit to deduct to give to a user for
         flaking on a party.
@@ -64,36 +93,33 @@ class SailCreditBureau:
         """
         # 1. The base SSC to deduct for flaking.
         penalty = self.BASE_PENALTY
-        log = f"[user-{user_id}]: DEBIT base:{self.BASE_PENALTY} SSC "
 
         # 2. Punish based on how many people were affected.
         # (less than group of 5 = < 20% reduction) / (more than group of 5 = > 20% reduction)
         size_ratio = 1 - 0.2 * (party_size / 5)
         penalty *= size_ratio
-        log += f"* size:{self._percent(size_ratio)}% "
 
         # 3. Punish based on how long everybody waited.
         # Only applicable if greater than 30 minutes.
         # (less than 30m  = 0.x) / (more than 30m = 1.x)
+        age_ratio = None
         if party_age > 30 * 60:
             age_ratio = party_age / (30 * 60)
             penalty *= age_ratio
-            log += f"* age:{self._percent(age_ratio)}% "
 
         # 4. Punished based on how many times the user has flaked in the past N days.
         # The more days that the user flaked on, increases the penalty by 50%. Flakes
         # on the same day are not affected.
         flake_ratio = 0.5 * flake_count + 1
         penalty *= flake_ratio
-        log += f"* flake:{self._percent(flake_ratio)}% "
 
         # 5. Punish less based on how much SSC the user has.
         # Only applicable if the user has less than the starting SSC.
         # Function Requirements: f(STARTING_SSC) = 1, f(0) = 0
+        tax_break_ratio = None
         if current_ssc < party.STARTING_SSC:
             tax_break_ratio = (current_ssc**2) / (party.STARTING_SSC**2)
             penalty *= tax_break_ratio
-            log += f"* tax-break:{self._percent(tax_break_ratio)}% "
 
         # 6. Round up to the nearest integer.
         penalty = math.ceil(penalty)
@@ -101,13 +127,50 @@ class SailCreditBureau:
         # 7. If the penalty is greater than their current SSC, limit it to their current SSC.
         penalty = min(current_ssc, penalty)
 
-        log += f"= {penalty} SSC for flaking on a party."
-        print(log)
+        if self.trace:
+            self.trace(
+                ScoreTrace(
+                    user_id,
+                    "DEBIT",
+                    self.BASE_PENALTY,
+                    {
+                        "size": size_ratio,
+                        "age": age_ratio,
+                        "flake": flake_ratio,
+                        "tax-break": tax_break_ratio,
+                    },
+                    penalty,
+                )
+            )
         return penalty
 
-    async def credit(
+    def debit_batch(
+        self,
+        current_ssc: np.ndarray,
+        flake_count: np.ndarray,
+        party_age: np.ndarray,
+        party_size: np.ndarray,
+    ) -> np.ndarray:
+        """
+        debit for many users at once. Takes equal length arrays of debit's inputs and
+        returns the penalties, identical to calling debit for each.
+        """
+        current_ssc = np.asarray(current_ssc, dtype=np.int64)
+        party_age = np.asarray(party_age, dtype=np.int64)
+
+        penalty = self.BASE_PENALTY * (1 - 0.2 * (np.asarray(party_size) / 5))
+        penalty *= np.where(party_age > 30 * 60, party_age / (30 * 60), 1.0)
+        penalty *= 0.5 * np.asarray(flake_count) + 1
+        penalty *= np.where(
+            current_ssc < party.STARTING_SSC,
+            (current_ssc**2) / (party.STARTING_SSC**2),
+            1.0,
+        )
+        return np.minimum(current_ssc, np.ceil(penalty).astype(np.int64))
+
+    def credit(
         self, user_id: int, current_ssc: int, parties_joined: int, party_size: int
-    ):
+    ) -> int:
         """
         Method for calculating how much sail credit to give to a user for not flaking
         on a party.
@@ -124,33 +187,69 @@ class SailCreditBureau:
         """
         # 1. The base reward for joining a party.
         reward = self.BASE_REWARD
-        log = f"[user-{user_id}]: CREDIT base-{self.BASE_REWARD} SSC "
 
         # 2. Reward people with less SSC, the more games they play in a certain period.
         # (first game = 1.0) / (any more after that = 0.x)
         diminishing_ratio = 1 / ((2 * parties_joined) + 1)
         reward = reward * diminishing_ratio
-        log += f"* dim:{self._percent(diminishing_ratio)}% "
 
         # 3. Reward people less based on how much SSC they have.
         # Only applicable if the user has more than the starting SSC.
         # Function Requirements: f(STARTING_SSC) = 1, f(infinity) = 0
+        tax_ratio = None
         if current_ssc > party.STARTING_SSC:
             tax_ratio = (party.STARTING_SSC**2) / (current_ssc**2)
             reward *= tax_ratio
-            log += f"* tax:{self._percent(tax_ratio)}% "
 
         # 4. Reduce the amount of SSC gained from parties of two.
+        small_party_ratio = None
         if party_size <= 2:
-            reward *= self.SMALL_PARTY_MULTIPLIER
+            small_party_ratio = self.SMALL_PARTY_MULTIPLIER
+            reward *= small_party_ratio
 
         # 5. Round up to the nearest integer.
         reward = math.ceil(reward)
 
-        log += f"= {reward} SSC for joining a party."
-        print(log)
+        if self.trace:
+            self.trace(
+                ScoreTrace(
+                    user_id,
+                    "CREDIT",
+                    self.BASE_REWARD,
+                    {
+                        "dim": diminishing_ratio,
+                        "tax": tax_ratio,
+                        "small": small_party_ratio,
+                    },
+                    reward,
+                )
+            )
         return reward
 
+    def credit_batch(
+        self,
+        current_ssc: np.ndarray,
+        parties_joined: np.ndarray,
+        party_size: np.ndarray,
+    ) -> np.ndarray:
+        """
+        credit for many users at once. Takes equal length arrays of credit's inputs
+        and returns the rewards, identical to calling credit for each.
+        """
+        current_ssc = np.asarray(current_ssc, dtype=np.int64)
+
+        reward = self.BASE_REWARD * (1 / ((2 * np.asarray(parties_joined)) + 1))
+        reward *= np.divide(
+            party.STARTING_SSC**2,
+            current_ssc**2,
+            out=np.ones(len(current_ssc)),
+            where=current_ssc > party.STARTING_SSC,
+        )
+        reward *= np.where(
+            np.asarray(party_size) <= 2, self.SMALL_PARTY_MULTIPLIER, 1.0
+        )
+        return np.ceil(reward).astype(np.int64)
+
     async def process_party_member(
         self, party: Party, user_id, timestamp: int = None
     ) -> tuple[int, int, int]:
@@ -163,22 +262,56 @@ class SailCreditBureau:
         history = await db.get_user_sail_credit_log(
             user_id, last_reset_timestamp, source="PARTY"
         )
-        reward = await self.credit(
-            user_id, user["sail_credit"], len(history), party.size
-        )
-        kwargs = {}
-        if timestamp:
-            kwargs["timestamp"] = timestamp
-        await db.change_and_log_sail_credit(
+        reward = self.credit(user_id, user["sail_credit"], len(history), party.size)
+        old_ssc, new_ssc = await db.apply_sail_credit_delta(
             user_id,
+            reward,
+            "PARTY",
             party.size,
             party.created_at,
             party.finished_at,
-            user["sail_credit"],
-            user["sail_credit"] + reward,
-            **kwargs,
+            timestamp=timestamp,
         )
-        return (user["sail_credit"], user["sail_credit"] + reward, reward)
+        return (old_ssc, new_ssc, reward)
+
+    async def process_party_members(
+        self, party: Party, user_ids: List[int], timestamp: int = None
+    ) -> Dict[int, tuple[int, int, int]]:
+        """
+        Rewards every given player in the party at once. Balances and party counts are
+        read in one query, and every reward is written in a single transaction.
+        Returns the same tuples as process_party_member, by user ID.
+        """
+        users = await db.get_users_with_log_count(
+            user_ids, get_last_reset_time(), "PARTY"
+        )
+        missing_ids = set(user_ids) - {user["discord_id"] for user in users}
+        if missing_ids:
+            raise ValueError(f"Users {missing_ids} do not exist.")
+
+        rewards = self.credit_batch(
+            [user["sail_credit"] for user in users],
+            [user["log_count"] for user in users],
+            [party.size] * len(users),
+        ).tolist()
+        results = await db.write_ledger(
+            [
+                db.LedgerWrite(
+                    discord_id=user["discord_id"],
+                    source="PARTY",
+                    delta=reward,
+                    party_size=party.size,
+                    party_created_at=party.created_at,
+                    party_finished_at=party.finished_at,
+                    timestamp=timestamp,
+                )
+                for user, reward in zip(users, rewards)
+            ]
+        )
+        return {
+            user["discord_id"]: (old_ssc, new_ssc, reward)
+            for user, reward, (old_ssc, new_ssc) in zip(users, rewards, results)
+        }
 
     async def process_flaked_user(
         self, party: Party, user_id: int, timestamp: int = None
@@ -190,41 +323,35 @@ class SailCreditBureau:
         """
         user = await db.get_user(user_id)
 
-        def round_nearest_day(x, base=(24 * 60 * 60)) -> int:
-            return base * round(x / base)
-
         # Calculate how many times in the FLAKE_WINDOW has the user flaked.
-        days_flaked = set()
         start_timestamp = int(time.time()) - self.FLAKE_WINDOW
-        history = await db.get_user_sail_credit_log(
-            user_id, start_timestamp, source="PARTY"
-        )
-        for entry in history:
-            if entry["new_sail_credit"] - entry["prev_sail_credit"] < 0:
-                days_flaked.add(round_nearest_day(entry["timestamp"]))
+        flake_count = db.flake_window.count(user_id, start_timestamp)
 
         # Calculate the penalty for flaking.
-        penalty = await self.debit(
+        penalty = self.debit(
             user_id,
             user["sail_credit"],
-            len(days_flaked),
+            flake_count,
             party.finished_at - party.created_at,
             party.size,
         )
 
-        kwargs = {}
-        if timestamp:
-            kwargs["timestamp"] = timestamp
-        await db.change_and_log_sail_credit(
+        old_ssc, new_ssc = await db.apply_sail_credit_delta(
             user_id,
+            penalty,
+            "PARTY",
             party.size,
             party.created_at,
             party.finished_at,
-            user["sail_credit"],
-            user["sail_credit"] + penalty,
-            **kwargs,
+            timestamp=timestamp,
         )
-        return (user["sail_credit"], user["sail_credit"] + penalty, penalty)
+        return (old_ssc, new_ssc, penalty)
 
-    def _percent(self, x: float) -> float:
-        return round(x * 100, 3)
+    @staticmethod
+    def flake_day_batch(timestamps: np.ndarray) -> np.ndarray:
+        """
+        flake_window.flake_day for an array of timestamps, identical to calling it for
+        each. np.round rounds halves to even, like round.
+        """
+        base = 24 * 60 * 60
+        return base * np.round(np.asarray(timestamps) / base)
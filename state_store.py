@@ -0,0 +1,84 @@
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+# How long changes are allowed to queue up before being written, in seconds. Bursts of
+# changes to the same object, like a party filling up, are written once.
+STATE_FLUSH_DELAY = 0.5
+
+
+class StateStore(Generic[T]):
+    """
+    Keeps the database copy of a service's live objects, like parties or casino lobbies,
+    up to date so they can be restored after a restart.
+
+    Changed objects are marked, and written together after a short delay. Objects are
+    turned into rows when they're written rather than when they're marked, so each
+    write has their latest state and an object changed many times is written once.
+    """
+
+    def __init__(
+        self,
+        to_row: Callable[[T], Dict[str, Any]],
+        save: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        delete: Callable[[List[Hashable]], Awaitable[None]],
+        flush_delay: float = STATE_FLUSH_DELAY,
+    ):
+        self.to_row = to_row
+        self.save = save
+        self.delete = delete
+        self.flush_delay = flush_delay
+        # Marked objects by key, or None if the object should be deleted.
+        self._dirty: Dict[Hashable, Optional[T]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._lock = asyncio.Lock()
+
+    def mark(self, key: Hashable, obj: Optional[T]) -> None:
+        """
+        Queues a write of obj, or a delete of the key's row if obj is None. Needs a
+        running event loop.
+        """
+        self._dirty[key] = obj
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.flush_delay, lambda: loop.create_task(self.flush())
+            )
+
+    async def flush(self) -> None:
+        """
+        Writes every queued change. Changes that fail to write are queued again,
+        unless the object was marked again in the meantime.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        async with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+
+            try:
+                saved = [self.to_row(obj) for obj in dirty.values() if obj is not None]
+                deleted = [key for key, obj in dirty.items() if obj is None]
+                if saved:
+                    await self.save(saved)
+                if deleted:
+                    await self.delete(deleted)
+            except Exception as e:
+                print(f"Failed to write state, retrying: {e}")
+                for key, obj in dirty.items():
+                    if key not in self._dirty:
+                        self.mark(key, obj)
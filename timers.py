@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+# Each wheel has 2^WHEEL_BITS slots, and each level's slots span as many ticks as the
+# whole wheel below it. With 1 second ticks, five levels reach decades ahead.
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_LEVELS = 5
+
+# Timers fire on the first tick at or after their run time, in seconds.
+TIMER_RESOLUTION = 1.0
+
+
+@dataclass(slots=True)
+class Timer:
+    id: str
+    run_at: float
+    callback: Callable[..., Awaitable[Any]]
+    args: Tuple[Any, ...]
+    # The tick the timer fires on, and the wheel slot it's waiting in.
+    tick: int = 0
+    level: int = 0
+    slot: int = 0
+
+
+class TimerWheel:
+    """
+    Runs coroutine functions at given times on the asyncio loop, like parties' and
+    casino lobbies' start jobs. Timers are identified by an ID, which replaces any
+    timer with the same ID.
+
+    It's a hierarchical timer wheel. The lowest wheel has a slot per tick, and each
+    wheel above has slots as wide as the whole wheel below it. A timer waits in the
+    slot of the lowest wheel that reaches its tick, so adding, cancelling and
+    rescheduling it is O(1). Whenever a wheel comes around, the next slot of the wheel
+    above is spread over the wheels below, and each tick runs the timers in the current
+    slot of the lowest wheel.
+
+    The wheel only ticks while it has timers.
+    """
+
+    def __init__(self, resolution: float = TIMER_RESOLUTION):
+        self.resolution = resolution
+        self._timers: Dict[str, Timer] = {}
+        self._wheels: List[List[Dict[str, Timer]]] = [
+            [{} for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)
+        ]
+        # The last tick that was run.
+        self._tick = self._current_tick()
+        self._driver: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, timer_id: str) -> bool:
+        return timer_id in self._timers
+
+    def schedule(
+        self,
+        timer_id: str,
+        run_date: datetime,
+        callback: Callable[..., Awaitable[Any]],
+        *args: Any,
+    ) -> None:
+        """
+        Runs callback(*args) at run_date, or on the next tick if it's in the past.
+        Needs a running event loop.
+        """
+        self.cancel(timer_id)
+        if not self._timers:
+            # Nothing was ticking, so catch up to the present first.
+            self._tick = max(self._tick, self._current_tick())
+
+        timer = Timer(timer_id, run_date.timestamp(), callback, args)
+        self._timers[timer_id] = timer
+        self._place(timer, self._due_tick(timer.run_at))
+
+        if self._driver is None:
+            self._driver = asyncio.create_task(self._drive())
+
+    def reschedule(self, timer_id: str, run_date: datetime) -> bool:
+        """
+        Moves the timer to run_date. Returns False if there's no such timer.
+        """
+        timer = self._timers.get(timer_id)
+        if not timer:
+            return False
+
+        del self._wheels[timer.level][timer.slot][timer_id]
+        timer.run_at = run_date.timestamp()
+        self._place(timer, self._due_tick(timer.run_at))
+        return True
+
+    def cancel(self, timer_id: str) -> bool:
+        """
+        Cancels the timer. Returns False if there's no such timer.
+        """
+        timer = self._timers.pop(timer_id, None)
+        if not timer:
+            return False
+
+        del self._wheels[timer.level][timer.slot][timer_id]
+        return True
+
+    def get_run_date(self, timer_id: str) -> Optional[datetime]:
+        timer = self._timers.get(timer_id)
+        if not timer:
+            return None
+        return datetime.fromtimestamp(timer.run_at, tz=timezone.utc)
+
+    def _current_tick(self) -> int:
+        return math.floor(time.time() / self.resolution)
+
+    def _due_tick(self, run_at: float) -> int:
+        # Timers in the past run on the next tick.
+        return max(math.ceil(run_at / self.resolution), self._tick + 1)
+
+    def _place(self, timer: Timer, tick: int) -> None:
+        """
+        Puts the timer in the slot of the lowest wheel that reaches its tick, relative
+        to the last tick that was run.
+        """
+        timer.tick = tick
+        delta = tick - self._tick
+        level = 0
+        while level < WHEEL_LEVELS - 1 and delta >= 1 << (WHEEL_BITS * (level + 1)):
+            level += 1
+        # Timers past the top wheel wait at its far end, and are placed again once they
+        # come down from it.
+        tick = min(tick, self._tick + (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1)
+
+        timer.level = level
+        timer.slot = (tick >> (WHEEL_BITS * level)) & (WHEEL_SIZE - 1)
+        self._wheels[level][timer.slot][timer.id] = timer
+
+    def _advance(self, tick: int) -> None:
+        """
+        Runs a tick: spreads the slots of wheels that came around over the wheels below,
+        then runs the timers in the lowest wheel's slot.
+        """
+        self._tick = tick
+
+        # From the top down, so timers spread from one wheel to the next land in slots
+        # that haven't been spread yet this tick.
+        for level in range(WHEEL_LEVELS - 1, 0, -1):
+            if tick & ((1 << (WHEEL_BITS * level)) - 1):
+                continue
+            index = (tick >> (WHEEL_BITS * level)) & (WHEEL_SIZE - 1)
+            slot, self._wheels[level][index] = self._wheels[level][index], {}
+            for timer in slot.values():
+                self._place(timer, timer.tick)
+
+        index = tick & (WHEEL_SIZE - 1)
+        slot, self._wheels[0][index] = self._wheels[0][index], {}
+        for timer in slot.values():
+            if timer.tick > tick:
+                # Was past the top wheel.
+                self._place(timer, timer.tick)
+                continue
+
+            del self._timers[timer.id]
+            task = asyncio.create_task(self._run(timer))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _drive(self) -> None:
+        try:
+            while self._timers:
+                current_tick = self._current_tick()
+                if current_tick <= self._tick:
+                    await asyncio.sleep(
+                        (self._tick + 1) * self.resolution - time.time()
+                    )
+                    continue
+
+                # Runs every tick that passed, in case the loop fell behind.
+                for tick in range(self._tick + 1, current_tick + 1):
+                    self._advance(tick)
+        finally:
+            self._driver = None
+
+    async def _run(self, timer: Timer) -> None:
+        try:
+            await timer.callback(*timer.args)
+        except Exception:
+            log.exception("Timer %s failed", timer.id)
+
+
+# Shared by every service that schedules jobs.
+timer_wheel = TimerWheel()
@@ -1,13 +1,18 @@
+import asyncio
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 import functools
+import io
 import math
 import time
-from typing import Literal, Optional, Tuple
+from typing import List, Literal, Optional, Sequence, Tuple
 import discord
+import numpy as np
 from pytimeparse import parse as timeparse
+from cache import LRUCache
+from chart import render_ssc_chart
 import db
-from quickchart import QuickChart
+from edit_scheduler import MessageEditScheduler
 from zoneinfo import ZoneInfo
 import re
 import random
@@ -16,6 +21,7 @@ import random
 def user_command():
     """
     A util decorator to automatically create and inject db info for a user command.
+    User data is served from db.user_cache when possible.
     This needs to be right above the function definition, and the function's first argument must accept a discord interaction!
     """
 
@@ -44,6 +50,7 @@ def user_command():
 def user_interaction_callback():
     """
     A util decorator to automatically create and inject db info for a user interaction callback.
+    User data is served from db.user_cache when possible.
     This needs to be right above the function definition, and the function's second argument must accept a discord interaction!
     """
 
@@ -80,6 +87,11 @@ def create_embed(
     return embed
 
 
+# Edits to bot messages go through here, so bursts of updates to one message are
+# merged instead of queueing up behind Discord's rate limits.
+edit_scheduler = MessageEditScheduler()
+
+
 async def disable_buttons_and_stop_view(
     view: discord.ui.View,
     obj: discord.Interaction | discord.Message | discord.WebhookMessage,
@@ -88,12 +100,9 @@ async def disable_buttons_and_stop_view(
         if isinstance(component, discord.ui.Button):
             component.disabled = True
 
-    if type(obj) == discord.Message or type(obj) == discord.WebhookMessage:
-        await obj.edit(view=view)
-    elif type(obj) == discord.Interaction:
-        await obj.edit_original_response(view=view)
-    else:
+    if type(obj) not in (discord.Message, discord.WebhookMessage, discord.Interaction):
         raise Exception("Invalid object type passed to disable_buttons_and_stop_view")
+    await edit_scheduler.edit(obj, view=view)
 
 
 def divide_chunks(l, n):
@@ -101,76 +110,81 @@ def divide_chunks(l, n):
         yield l[i : i + n]
 
 
-def down_scale_data(qc_data, n=500):
-    if n > len(qc_data):
-        return qc_data
+# Rendered SSC graphs by (user, name, period, first and last log timestamp).
+SSC_GRAPH_CACHE_SIZE = 128
+ssc_graph_cache = LRUCache(SSC_GRAPH_CACHE_SIZE)
+
+
+# How many points SSC graphs are drawn with.
+SSC_GRAPH_POINTS = 200
 
-    new_data = []
-    quantum = len(qc_data) / n
-    idx = 0
-    while round(idx) < len(qc_data):
-        new_data.append(qc_data[round(idx)])
-        idx += quantum
 
-    if round(idx) < len(qc_data) - 1:
-        new_data.append(qc_data[-1])
+def downsample_lttb(points: Sequence[Tuple[int, int]], n: int) -> List[Tuple[int, int]]:
+    """
+    Downsamples (x, y) points in x order to n points with Largest-Triangle-Three-
+    Buckets. Each bucket keeps the point forming the largest triangle with the
+    previously kept point and the next bucket's average, which keeps spikes that
+    evenly spaced sampling would skip.
+    """
+    if n >= len(points) or n < 3:
+        return list(points)
+
+    data = np.asarray(points, dtype=np.float64)
+    x, y = data[:, 0], data[:, 1]
+
+    # The first and last points are always kept. The rest are split into n - 2
+    # buckets, bucket i being edges[i] to edges[i + 1].
+    edges = np.linspace(1, len(points) - 1, n - 1).astype(np.int64)
+    edges[-1] = len(points) - 1
+
+    selected = [0]
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        prev_x, prev_y = x[selected[-1]], y[selected[-1]]
+        areas = np.abs(
+            (prev_x - next_x) * (y[start:end] - prev_y)
+            - (prev_x - x[start:end]) * (next_y - prev_y)
+        )
+        selected.append(start + int(np.argmax(areas)))
 
-    return new_data
+    selected.append(len(points) - 1)
+    return [points[i] for i in selected]
 
 
-async def create_ssc_graph_url(
+async def create_ssc_graph(
     discord_id: int, name: str, period: Literal["1h", "6h", "12h", "1d", "7d", "30d"]
-) -> str:
-
+) -> discord.File:
+    """
+    Renders the user's SSC history over the period to a PNG attachment. Charts are
+    cached until the logs in the period change.
+    """
     start_timestamp = int(time.time()) - timeparse(period)
-    credit_log = await db.get_user_sail_credit_log(
-        discord_id, start_timestamp, source=None
+    first_timestamp, last_timestamp = await db.get_user_sail_credit_log_span(
+        discord_id, start_timestamp
     )
 
-    qc_data = down_scale_data(
-        [{"x": d["timestamp"] * 1000, "y": d["new_sail_credit"]} for d in credit_log],
-        n=200,
-    )
-    qc = QuickChart()
-    qc.width = 500
-    qc.height = 300
-    qc.device_pixel_ratio = 2.0
-
-    qc.config = {
-        "type": "line",
-        "data": {"datasets": [{"fill": False, "data": qc_data}]},
-        "options": {
-            "elements": {"point": {"radius": 0}},
-            "legend": {
-                "display": False,
-            },
-            "title": {
-                "display": True,
-                "text": f"{name}'s SSC History",
-            },
-            "scales": {
-                "xAxes": [
-                    {
-                        "type": "time",
-                        "ticks": {
-                            "maxTicksLimit": 15,
-                        },
-                        "time": {
-                            "parser": "x",
-                            "displayFormats": {
-                                "hour": "MMM DD HH:mm",
-                                "minute": "MMM DD HH:mm",
-                                "second": "MMM DD HH:mm",
-                            },
-                        },
-                    }
-                ],
-                "yAxes": [{"ticks": {"precision": 0}}],
-            },
-        },
-    }
-
-    return qc.get_short_url()
+    cache_key = (discord_id, name, period, first_timestamp, last_timestamp)
+    png = ssc_graph_cache.get(cache_key)
+    if not png:
+        # The lowest, highest and last balance of each bucket keep spikes in, and
+        # are then thinned down to the points that matter most to the line's shape.
+        buckets = await db.get_user_sail_credit_log_buckets(
+            discord_id, start_timestamp, int(time.time()), SSC_GRAPH_POINTS
+        )
+        points = downsample_lttb(
+            [(d["timestamp"], d["new_sail_credit"]) for d in buckets],
+            SSC_GRAPH_POINTS,
+        )
+        png = await asyncio.to_thread(render_ssc_chart, f"{name}'s SSC History", points)
+        ssc_graph_cache.put(cache_key, png)
+
+    return discord.File(io.BytesIO(png), filename="ssc_graph.png")
 
 
 def get_last_reset_time():
@@ -277,16 +291,8 @@ async def get_daily_reward(user_id: int) -> DailyRewardInfo:
     # 1 SSC for each day in the streak after the first. Maxes out at 30 days.
     streak_bonus = min(30, current_streak)
 
-    leaderboard = await db.get_ssc_leaderboard()
-    total_entries = len(leaderboard)
-    user_rank = next(
-        (
-            i + 1
-            for i, entry in enumerate(leaderboard)
-            if entry["discord_id"] == user_id
-        ),
-        None,
-    )
+    total_entries = len(db.leaderboard)
+    user_rank = db.leaderboard.rank(user_id)
 
     total_reward = amount + random_bonus + streak_bonus
 
@@ -4,16 +4,23 @@ from typing import List
 import discord
 
 import db
-from party import Party, PartyMemberStatus, PartyService, PartyStatus
+from party import (
+    PARTY_VIEW_TIMEOUT,
+    Party,
+    PartyMemberStatus,
+    PartyService,
+    PartyStatus,
+)
 from scb import SailCreditBureau
 from util import (
     create_embed,
     disable_buttons_and_stop_view,
+    edit_scheduler,
     get_balance,
     user_interaction_callback,
 )
 
-scb = SailCreditBureau()
+scb = SailCreditBureau(trace=print)
 """
 View Workflow for Parties
 
@@ -32,18 +39,37 @@ class PartyView(discord.ui.View):
     This view is responsible for removing the party on timeout, or start.
     """
 
-    def __init__(self, party: Party, party_service: PartyService, scheduled=True):
+    def __init__(
+        self,
+        party: Party,
+        party_service: PartyService,
+        scheduled=True,
+        timeout=PARTY_VIEW_TIMEOUT,
+    ):
         self.party: Party = party
         self.party_service = party_service
-        super().__init__(timeout=3600 * 12)  # 12 hr
+        super().__init__(timeout=timeout)
+
+        # Custom IDs are derived from the party, so a restored party's view picks up
+        # the buttons on its existing message.
+        def custom_id(action: str) -> str:
+            return f"party:{party.uuid}:{action}"
 
         # Start, join, leave, cancel buttons
-        start_button = discord.ui.Button(label="Start", style=discord.ButtonStyle.green)
-        join_button = discord.ui.Button(label="Join", style=discord.ButtonStyle.blurple)
+        start_button = discord.ui.Button(
+            label="Start", style=discord.ButtonStyle.green, custom_id=custom_id("start")
+        )
+        join_button = discord.ui.Button(
+            label="Join", style=discord.ButtonStyle.blurple, custom_id=custom_id("join")
+        )
         leave_button = discord.ui.Button(
-            label="Leave", style=discord.ButtonStyle.blurple
+            label="Leave",
+            style=discord.ButtonStyle.blurple,
+            custom_id=custom_id("leave"),
+        )
+        cancel_button = discord.ui.Button(
+            label="Cancel", style=discord.ButtonStyle.red, custom_id=custom_id("cancel")
         )
-        cancel_button = discord.ui.Button(label="Cancel", style=discord.ButtonStyle.red)
 
         start_button.callback = self.start
         join_button.callback = self.join
@@ -68,9 +94,7 @@ class PartyView(discord.ui.View):
 
                     self.party_service.update_party_start_time(self.party.uuid, minutes)
                     await interaction.response.defer()
-                    await interaction.edit_original_response(
-                        embed=create_embed(**self.party.generate_embed())
-                    )
+                    await self.update_embed(interaction)
 
                 return button_callback
 
@@ -82,11 +106,26 @@ class PartyView(discord.ui.View):
                 ("+1h", 60),
             ]:
                 button = discord.ui.Button(
-                    label=val[0], style=discord.ButtonStyle.gray, row=1
+                    label=val[0],
+                    style=discord.ButtonStyle.gray,
+                    row=1,
+                    custom_id=custom_id(val[0]),
                 )
                 button.callback = callback_constructor(val[1])
                 self.add_item(button)
 
+    async def update_embed(self, interaction: discord.Interaction):
+        """
+        Edits the party's current embed into its message, unless the message already
+        shows it.
+        """
+        embed_contents = self.party.generate_embed()
+        if not self.party.embed_changed(embed_contents):
+            return
+
+        await edit_scheduler.edit(interaction, embed=create_embed(**embed_contents))
+        self.party.mark_embed_shown(embed_contents)
+
     # When this view is inactive, remove the party.
     async def on_timeout(self):
         # TODO: Fix cancer. Pass in self-referential message, and then cancel.
@@ -133,11 +172,9 @@ class PartyView(discord.ui.View):
     async def join(self, interaction: discord.Interaction):
 
         # Check if the user is already in the party or waitlist.
-        party_member_ids = [member.user_id for member in self.party.members]
-        waitlisted_ids = [member.user_id for member in self.party.waitlist]
         if (
-            interaction.user.id in party_member_ids
-            or interaction.user.id in waitlisted_ids
+            interaction.user.id in self.party.members
+            or interaction.user.id in self.party.waitlist
         ):
             await interaction.response.send_message(
                 "You are already in the party or waitlist.", ephemeral=True
@@ -145,16 +182,15 @@ class PartyView(discord.ui.View):
             return
 
         # Add the user to the party
-        waitlisted = self.party.add_member(
+        waitlisted = self.party_service.add_member(
+            self.party,
             interaction.user.id,
             interaction.user.display_name,
             get_balance(interaction),
         )
 
         await interaction.response.defer()
-        await interaction.edit_original_response(
-            embed=create_embed(**self.party.generate_embed())
-        )
+        await self.update_embed(interaction)
 
         if waitlisted:
             await interaction.followup.send(
@@ -167,12 +203,9 @@ class PartyView(discord.ui.View):
     async def leave(self, interaction: discord.Interaction):
 
         # Check if the user is in the party or waitlist.
-        party_member_ids = [member.user_id for member in self.party.members]
-        waitlisted_ids = [member.user_id for member in self.party.waitlist]
-
         if (
-            interaction.user.id not in party_member_ids
-            and not interaction.user.id in waitlisted_ids
+            interaction.user.id not in self.party.members
+            and interaction.user.id not in self.party.waitlist
         ):
             await interaction.response.send_message(
                 "You are not in the party or waitlist.", ephemeral=True
@@ -181,13 +214,16 @@ class PartyView(discord.ui.View):
 
         old_owner = self.party.owner_id
 
-        member_from_waitlist = self.party.remove_member(interaction.user.id)
+        member_from_waitlist = self.party_service.remove_member(
+            self.party, interaction.user.id
+        )
 
         await interaction.response.defer()
 
         # If the party has no members left, it's abandoned.
         if not self.party.members:
-            await interaction.edit_original_response(
+            await edit_scheduler.edit(
+                interaction,
                 embed=create_embed("This party was abandoned since everyone left."),
                 content=None,
             )
@@ -196,9 +232,7 @@ class PartyView(discord.ui.View):
             await disable_buttons_and_stop_view(self, interaction)
             return
 
-        await interaction.edit_original_response(
-            embed=create_embed(**self.party.generate_embed()),
-        )
+        await self.update_embed(interaction)
 
         # If the party has a new owner, announce it.
         if self.party.owner_id != old_owner:
@@ -224,7 +258,8 @@ class PartyView(discord.ui.View):
         self.party_service.remove_party(self.party.uuid)
         await interaction.response.defer()
 
-        await interaction.edit_original_response(
+        await edit_scheduler.edit(
+            interaction,
             embed=create_embed(
                 f"This party was cancelled by the party leader <@{interaction.user.id}>."
             ),
@@ -251,11 +286,12 @@ class PostPartyView(discord.ui.View):
         ):
             self.party.status = PartyStatus.SUCCESS
             self.party.finished_at = int(time.time())
-            reward_data = {}
-            for member in self.party.members:
-                reward_data[member.user_id] = await scb.process_party_member(
-                    self.party, member.user_id
-                )
+            rewards = await scb.process_party_members(
+                self.party, [member.user_id for member in self.party.members]
+            )
+            reward_data = {
+                member.user_id: rewards[member.user_id] for member in self.party.members
+            }
 
             await disable_buttons_and_stop_view(self, self.message)
             await self.message.edit(
@@ -275,7 +311,7 @@ class PostPartyView(discord.ui.View):
             return False
 
         # Only allow party members to interact with this view.
-        if interaction.user.id not in [member.user_id for member in self.party.members]:
+        if interaction.user.id not in self.party.members:
             return False
         return True
 
@@ -323,10 +359,7 @@ class ReportSelectView(discord.ui.View):
             return
 
         # Check if the party member has already been reported.
-        selected_member = next(
-            (member for member in self.party.members if member.user_id == selected_id),
-            None,
-        )
+        selected_member = self.party.members.get(selected_id)
         if selected_member.status == PartyMemberStatus.FLAKED:
             await interaction.response.send_message(
                 "This user has already been reported.", ephemeral=True
@@ -429,10 +462,7 @@ class ReportView(discord.ui.View):
         self.add_item(self.acquit_button)
 
         # Declare the member as flaked.
-        reported_member = next(
-            (member for member in self.party.members if member.user_id == reported_id),
-            None,
-        )
+        reported_member = self.party.members.get(reported_id)
         reported_member.status = PartyMemberStatus.FLAKED
 
     def generate_embed(self) -> str:
@@ -479,8 +509,7 @@ class ReportView(discord.ui.View):
 
     async def on_convict(self, interaction: discord.Interaction):
         # Check if the user is in the party.
-        party_member_ids = [member.user_id for member in self.party.members]
-        if interaction.user.id not in party_member_ids:
+        if interaction.user.id not in self.party.members:
             await interaction.response.send_message(
                 "You are not in the party.", ephemeral=True
             )
@@ -506,8 +535,7 @@ class ReportView(discord.ui.View):
 
     async def on_acquit(self, interaction: discord.Interaction):
         # Check if the user is in the party.
-        party_member_ids = [member.user_id for member in self.party.members]
-        if interaction.user.id not in party_member_ids:
+        if interaction.user.id not in self.party.members:
             await interaction.response.send_message(
                 "You are not in the party.", ephemeral=True
             )
@@ -544,15 +572,19 @@ class MessageBook(discord.ui.View):
         pages: List[discord.Embed],
     ):
         super().__init__(timeout=120)
-        self.page_count = len(pages)
-
-        for i, page in enumerate(pages):
-            page.set_footer(text=f"Page {i + 1} of {self.page_count}")
-
         self.pages = pages
         self.user_id = user_id
         self.current_page = 0
 
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def get_page(self, index: int) -> discord.Embed:
+        page = self.pages[index]
+        page.set_footer(text=f"Page {index + 1} of {self.page_count}")
+        return page
+
     async def interaction_check(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             return False
@@ -574,7 +606,7 @@ class MessageBook(discord.ui.View):
 
     async def next_page(self, interaction: discord.Interaction):
         self.current_page += 1
-        if self.current_page > len(self.pages) - 1:
+        if self.current_page > self.page_count - 1:
             self.current_page = 0
 
         await self.update_page(interaction)
@@ -582,23 +614,45 @@ class MessageBook(discord.ui.View):
     async def prev_page(self, interaction: discord.Interaction):
         self.current_page -= 1
         if self.current_page < 0:
-            self.current_page = len(self.pages) - 1
+            self.current_page = self.page_count - 1
 
         await self.update_page(interaction)
 
     async def update_page(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        await interaction.edit_original_response(embed=self.pages[self.current_page])
+        await interaction.edit_original_response(embed=self.get_page(self.current_page))
 
 
 class LeaderboardView(MessageBook):
-    def __init__(self, user_id: int, pages: List[discord.Embed], me_page: int):
-        self.me_page = me_page
-        super().__init__(user_id, pages)
+    """
+    Pages through db.leaderboard, rendering each page when it's shown so the current
+    balances are displayed.
+    """
+
+    PAGE_SIZE = 10
+
+    def __init__(self, user_id: int):
+        super().__init__(user_id, pages=[])
+
+    @property
+    def page_count(self) -> int:
+        return max(1, math.ceil(len(db.leaderboard) / self.PAGE_SIZE))
+
+    def get_page(self, index: int) -> discord.Embed:
+        page_contents = [
+            f"**#{index * self.PAGE_SIZE + i + 1}** <@{discord_id}> ({sail_credit} SSC)"
+            for i, (discord_id, sail_credit) in enumerate(
+                db.leaderboard.page(index, self.PAGE_SIZE)
+            )
+        ]
+        page = create_embed(title="SSC Leaderboard", message="\n".join(page_contents))
+        page.set_footer(text=f"Page {index + 1} of {self.page_count}")
+        return page
 
     @discord.ui.button(label="Jump to me", style=discord.ButtonStyle.grey)
     async def jump(self, interaction: discord.Interaction, _):
-        self.current_page = self.me_page
+        rank = db.leaderboard.rank(self.user_id) or 1
+        self.current_page = (rank - 1) // self.PAGE_SIZE
         await self.update_page(interaction)
 
 
@@ -636,20 +690,22 @@ class TopupView(discord.ui.View):
             await interaction.response.send_message("Insufficient SSC.", ephemeral=True)
             return False
 
-        acquiring_user_data = await db.get_user(self.acquiring_user_id)
-        await db.change_and_log_sail_credit(
-            user_id, -1, -1, -1, user_balance, user_balance - amount, "DONATION_DEBIT"
-        )
-        acquiring_user_balance = acquiring_user_data["sail_credit"]  # pyright: ignore
-        await db.change_and_log_sail_credit(
-            self.acquiring_user_id,
-            -1,
-            -1,
-            -1,
-            acquiring_user_balance,
-            acquiring_user_balance + amount,
-            "DONATION_CREDIT",
-        )
+        # Both sides of the donation are committed together, and neither is if the
+        # balance was spent since it was checked.
+        try:
+            await db.write_ledger(
+                [
+                    db.LedgerWrite(
+                        user_id, "DONATION_DEBIT", delta=-amount, require_funds=True
+                    ),
+                    db.LedgerWrite(
+                        self.acquiring_user_id, "DONATION_CREDIT", delta=amount
+                    ),
+                ]
+            )
+        except db.InsufficientFundsError:
+            await interaction.response.send_message("Insufficient SSC.", ephemeral=True)
+            return False
 
         if user_id not in self.topup_data:
             self.topup_data[user_id] = amount